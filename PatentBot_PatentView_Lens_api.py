@@ -1,18 +1,26 @@
 import streamlit as st
-import requests
-import json
-from time import sleep
 from fpdf import FPDF
 import os
-import uuid
-import fitz  # PyMuPDF
 import shutil
 import atexit
-from langchain_community.vectorstores import Chroma
-from langchain.prompts import ChatPromptTemplate
-from langchain_community.llms.ollama import Ollama
-from get_embedding_function import get_embedding_function
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from answer_cache import get_answer_cache
+from conversation import ConversationCache, conversation_prefix, next_prompt_prefix, recent_turns, warm_model
+from doc_metadata import PATENT_API_SOURCES, SOURCE_DATA, SOURCE_UPLOAD, build_where
+from get_embedding_function import EMBEDDING_MODEL
+from ingest_jobs import describe_job, get_job_queue, spool_upload
+from model_manager import get_model_manager, preload_models
+from patent_fetch import (
+    LENS_API_TOKEN, LENS_URL, PATENTSVIEW_API_KEY, PATENTSVIEW_DELAY, PATENTSVIEW_URL, extract_english_text,
+    get_lens_client, get_patentsview_client, lens_jobs, parse_lens, parse_patentsview, patentsview_jobs,
+    patentsview_record, run_jobs,
+)
+from patent_store import get_patent_store
+from pdf_pipeline import extract_text
+from populate_database import list_data_files
+from rag import LLM_MODEL, query_conversation_stream, query_rag_stream
+from resources import registry
+from session_store import get_session_stores
+from streaming import StreamMetrics
 
 # ------------ Utilitaires ---------------
 
@@ -20,173 +28,129 @@ def clean_text(text):
     return text.encode("latin-1", errors="ignore").decode("latin-1")
 
 def extract_text_from_pdf(pdf_file):
-    text = ""
-    with fitz.open(stream=pdf_file.read(), filetype="pdf") as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
-
-def query_rag(query_text: str, db_path: str):
-    db = Chroma(
-        persist_directory=db_path,
-        embedding_function=get_embedding_function()
-    )
-
-    results = db.similarity_search_with_score(query_text, k=5)
-
-    if not results:
-        return "Je n'ai trouvé aucune information pertinente dans la base."
-
-    context_text = "\n\n---\n\n".join([doc.page_content for doc, _ in results])
-    
-    prompt_template = ChatPromptTemplate.from_template("""
-You are an assistant who is an expert in patents. Answer the question based only on the following context:
-
-{context}
-
----
+    return extract_text(pdf_file)
 
-Answer the question based on the above context: {question}
-""")
-
-    prompt = prompt_template.format(context=context_text, question=query_text)
+def show_job_status(job_id, label):
+    # Affiche l'état d'une tâche d'ingestion ; la page se rafraîchit tant qu'elle tourne.
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return None
 
-    model = Ollama(model="mistral")
-    return model.invoke(prompt)
+    st.caption(f"{label} : {describe_job(job)}")
+    if job["status"] == "failed":
+        st.error(f"❌ {job['error']}")
+    elif job["status"] in ("queued", "running"):
+        col_refresh, col_cancel = st.columns(2)
+        with col_refresh:
+            st.button("🔄 Actualiser", key=f"refresh_{job_id}")
+        with col_cancel:
+            if st.button("⛔ Annuler", key=f"cancel_{job_id}"):
+                get_job_queue().cancel(job_id)
+                st.rerun()
+    return job
+
+def show_latency_breakdown(trace):
+    # Durée de chaque étape de la dernière requête, dans la barre latérale.
+    if trace is None:
+        return
+    with st.sidebar.expander(f"⏱️ Latence de la dernière requête : {trace.duration_ms / 1000:.2f}s"):
+        st.dataframe(
+            [{"Étape": name, "ms": round(ms, 1)} for name, ms in trace.breakdown()],
+            hide_index=True,
+        )
+
+def show_model_status(models):
+    # Modèles Ollama chargés en mémoire, dans la barre latérale.
+    status = get_model_manager().status(models)
+    with st.sidebar.expander(f"🧠 Modèles Ollama ({status['max_resident']} en mémoire au plus)"):
+        st.dataframe(
+            [{"Modèle": row["model"], "Chargé": "✅" if row["loaded"] else "—", "Épinglé": "📌" if row["pinned"] else "",
+              "Requêtes": row["active"], "Mo": row["size_mb"]} for row in status["models"]],
+            hide_index=True,
+        )
+        if status["queued"]:
+            st.caption(f"⏳ {status['queued']} requêtes en attente d'un modèle")
+
+def show_search_filters(extra_files=()):
+    # Filtres de la recherche, appliqués dans la requête vectorielle elle-même.
+    with st.sidebar.expander("🔎 Filtres de recherche"):
+        files = st.multiselect(
+            "Fichiers",
+            sorted({os.path.basename(path) for path in list_data_files()} | set(extra_files)),
+        )
+        sources = st.multiselect(
+            "Sources",
+            [SOURCE_DATA, SOURCE_UPLOAD] + PATENT_API_SOURCES,
+            format_func=lambda source: {SOURCE_DATA: "Corpus data/", SOURCE_UPLOAD: "PDF importé"}.get(source, source),
+        )
+        col_from, col_to = st.columns(2)
+        with col_from:
+            date_from = st.text_input("Depuis (AAAA-MM-JJ)", "")
+        with col_to:
+            date_to = st.text_input("Jusqu'au (AAAA-MM-JJ)", "")
+    where = build_where(files=files, api_sources=sources, date_from=date_from.strip(), date_to=date_to.strip())
+    if where is not None:
+        st.sidebar.caption("🔎 Recherche filtrée")
+    return where
 
 # ------------ Classes API ---------------
 
 class PatentFetcher:
-    def _init_(self):
-        self.api_key = "CQSd3FBT.8vmxye4Np3EBjNgPMwadolmTjQhg5TJr"
-        self.base_url = "https://search.patentsview.org/api/v1/patent/"
-        self.headers = {
-            "Content-Type": "application/json",
-            "X-Api-Key": self.api_key
-        }
-        self.delay = 0.6
+    def __init__(self):
+        self.api_key = PATENTSVIEW_API_KEY
+        self.base_url = PATENTSVIEW_URL
+        self.delay = PATENTSVIEW_DELAY
+        # Client partagé entre les relances de la page ; le seau à jetons remplace sleep(delay).
+        self.client = get_patentsview_client(self.api_key)
 
     def fetch_patents(self, keyword=None, page_start=1, page_end=3):
-        all_patents = []
-        page = page_start
-        total_pages = page_end - page_start + 1
-
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        while page <= page_end:
-            query = {
-                "q": {
-                    "_or": [
-                        {"_text_any": {"patent_title": keyword}},
-                        {"_text_any": {"patent_abstract": keyword}}
-                    ]
-                },
-                "f": ["patent_id", "patent_title", "patent_abstract", "patent_date"],
-                "o": {"page": page, "per_page": 100}
-            }
-
-            try:
-                status_text.text(f"Récupération page {page}/{page_end}... (PatentsView)")
-                progress_bar.progress((page - page_start + 1) / total_pages)
-
-                response = requests.post(self.base_url, headers=self.headers, data=json.dumps(query), timeout=20)
-                if response.status_code != 200:
-                    st.error(f"Erreur {response.status_code}: {response.text}")
-                    break
-
-                data = response.json()
-                patents = data.get("patents", [])
-                if not patents:
-                    break
-
-                all_patents.extend(patents)
-                page += 1
-                sleep(self.delay)
-
-            except Exception as e:
-                st.error(f"Erreur PatentsView: {str(e)}")
-                break
-
-        progress_bar.empty()
-        status_text.empty()
-        return all_patents
+        jobs = {"PatentsView": (self.client, patentsview_jobs(keyword, page_start, page_end), parse_patentsview)}
+        results, errors = run_jobs_with_progress(jobs, "PatentsView")
+        for error in errors:
+            st.error(f"Erreur PatentsView: {error}")
+        return results["PatentsView"]
 
 class LensFetcher:
-    def _init_(self):
-        self.api_token = "NKKdKUVJetizjiuFBqyltBQGWg9OWSdtwxJNtcz68FieAHDoX8mc"
-        self.base_url = "https://api.lens.org/patent/search"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
-
-    @staticmethod
-    def extract_english_text(field):
-        if isinstance(field, list):
-            for item in field:
-                if isinstance(item, dict) and item.get("lang") == "en":
-                    return item.get("text", "")
-            return None
-        if isinstance(field, dict):
-            return None
-        return None
-
-    def fetch_patents(self, keyword, total_to_fetch=100, batch_size=25):
-        all_patents = []
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+    def __init__(self):
+        self.api_token = LENS_API_TOKEN
+        self.base_url = LENS_URL
+        self.client = get_lens_client(self.api_token)
 
-        for offset in range(0, total_to_fetch, batch_size):
-            try:
-                completion = min((offset + batch_size) / total_to_fetch, 1.0)
-                status_text.text(f"Récupération {offset}-{offset+batch_size}... (The Lens)")
-                progress_bar.progress(completion)
-
-                payload = {
-                    "query": {
-                        "match": {"title": keyword}
-                    },
-                    "size": batch_size,
-                    "from": offset,
-                    "include": [
-                        "biblio.invention_title",
-                        "abstract"
-                    ]
-                }
-                response = requests.post(self.base_url, headers=self.headers, json=payload)
-                
-                if response.status_code != 200:
-                    st.error(f"Erreur The Lens (offset={offset}): {response.status_code}")
-                    st.code(response.text)
-                    break
-
-                data = response.json().get("data", [])
-                if not data:
-                    break
-
-                for patent in data:
-                    title_raw = patent.get("biblio", {}).get("invention_title", [])
-                    title_en = self.extract_english_text(title_raw)
-
-                    abstract_raw = patent.get("abstract", [])
-                    abstract_en = self.extract_english_text(abstract_raw)
-
-                    if title_en and abstract_en:
-                        all_patents.append({
-                            "source": "The Lens",
-                            "title": title_en,
-                            "abstract": abstract_en,
-                            "id": patent.get("lens_id", "")
-                        })
-
-            except Exception as e:
-                st.error(f"Erreur The Lens: {str(e)}")
-                break
+    extract_english_text = staticmethod(extract_english_text)
 
+    def fetch_patents(self, keyword, total_to_fetch=100, batch_size=25):
+        jobs = {"The Lens": (self.client, lens_jobs(keyword, total_to_fetch, batch_size), parse_lens)}
+        results, errors = run_jobs_with_progress(jobs, "The Lens")
+        for error in errors:
+            st.error(f"Erreur The Lens: {error}")
+        return results["The Lens"]
+
+def run_jobs_with_progress(jobs, label):
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+
+    def on_progress(done, total):
+        status_text.text(f"Récupération {done}/{total} pages... ({label})")
+        progress_bar.progress(done / total)
+
+    try:
+        return run_jobs(jobs, on_progress)
+    finally:
         progress_bar.empty()
         status_text.empty()
-        return all_patents
+
+def search_both_sources(keyword, pv_pages, lens_count):
+    # Les deux API sont interrogées en même temps, plusieurs pages en cours pour chacune.
+    fetcher_pv = PatentFetcher()
+    fetcher_lens = LensFetcher()
+    jobs = {
+        "PatentsView": (fetcher_pv.client, patentsview_jobs(keyword, 1, pv_pages), parse_patentsview),
+        "The Lens": (fetcher_lens.client, lens_jobs(keyword, lens_count), parse_lens),
+    }
+    results, errors = run_jobs_with_progress(jobs, "PatentsView + The Lens")
+    for error in errors:
+        st.error(error)
+    return results["PatentsView"], results["The Lens"], errors
 
 # ------------ Fonctions PDF ---------------
 
@@ -274,39 +238,36 @@ def search_page():
         
         st.subheader("The Lens")
         lens_count = st.slider("Nombre de brevets", 25, 200, 100, step=25, key="lens_count")
+        use_saved = st.checkbox("Réutiliser les résultats enregistrés (< 24 h)", value=True)
         
         if st.button("🔎 Lancer la recherche sur les deux sources"):
             st.session_state.search_in_progress = True
             st.session_state.pv_results = []
             st.session_state.lens_results = []
             st.session_state.search_count += 1
-            
-            # Recherche séquentielle
-            with st.spinner("Recherche PatentsView en cours..."):
-                fetcher_pv = PatentFetcher()
-                patents_pv = fetcher_pv.fetch_patents(
-                    keyword=keyword,
-                    page_start=1,
-                    page_end=pv_pages
-                )
-                
-                st.session_state.pv_results = []
-                for patent in patents_pv:
-                    st.session_state.pv_results.append({
-                        "source": "PatentsView",
-                        "title": patent.get("patent_title", "Sans titre"),
-                        "abstract": patent.get("patent_abstract", "Non disponible"),
-                        "date": patent.get("patent_date", "Inconnue"),
-                        "id": patent.get("patent_id", "")
-                    })
-            
-            with st.spinner("Recherche The Lens en cours..."):
-                fetcher_lens = LensFetcher()
-                patents_lens = fetcher_lens.fetch_patents(
-                    keyword=keyword,
-                    total_to_fetch=lens_count
-                )
-                st.session_state.lens_results = patents_lens
+
+            store = get_patent_store()
+            search_params = {"pv_pages": pv_pages, "lens_count": lens_count}
+            saved = store.cached_search(keyword, search_params) if use_saved else None
+
+            if saved is not None:
+                # Les recherches enregistrées par d'anciennes versions de l'API gardaient le format brut.
+                st.session_state.pv_results = [patent if "title" in patent else patentsview_record(patent)
+                                               for patent in saved.get("PatentsView", [])]
+                st.session_state.lens_results = saved.get("The Lens", [])
+            else:
+                # Recherche parallèle sur les deux sources
+                with st.spinner("Recherche PatentsView et The Lens en cours..."):
+                    patents_pv, patents_lens, errors = search_both_sources(keyword, pv_pages, lens_count)
+
+                    st.session_state.pv_results = [patentsview_record(patent) for patent in patents_pv]
+                    st.session_state.lens_results = patents_lens
+
+                # Une recherche incomplète (erreurs d'API) n'est pas réutilisée.
+                store.save_search(keyword, search_params, {
+                    "PatentsView": st.session_state.pv_results,
+                    "The Lens": st.session_state.lens_results,
+                }, complete=not errors)
             
             st.session_state.search_in_progress = False
             st.rerun()
@@ -403,63 +364,95 @@ def search_page():
         # Bouton pour indexer les résultats dans le chatbot
         if st.button("💬 Indexer dans le chatbot"):
             with st.spinner("Indexation dans la base de connaissances..."):
-                # Créer un PDF temporaire combiné pour l'indexation
-                combined_text = ""
-                
-                # Ajouter les résultats PatentsView
-                for patent in st.session_state.pv_results:
-                    combined_text += f"Titre: {patent['title']}\n"
-                    combined_text += f"Date: {patent.get('date', '')}\n"
-                    combined_text += f"Résumé: {patent['abstract']}\n\n"
-                
-                # Ajouter les résultats The Lens
-                for patent in st.session_state.lens_results:
-                    combined_text += f"Titre: {patent['title']}\n"
-                    combined_text += f"Résumé: {patent['abstract']}\n\n"
-                
-                # Indexer le texte combiné
-                splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-                docs = splitter.create_documents([combined_text])
-                db = Chroma(persist_directory="chroma", embedding_function=get_embedding_function())
-                db.add_documents(docs)
-                db.persist()
-                st.success("✅ Résultats indexés dans la base persistante du chatbot.")
+                # Les doublons entre sources et les brevets déjà indexés sont ignorés
+                store = get_patent_store()
+                keys = store.upsert_records(st.session_state.pv_results + st.session_state.lens_results)
+                new_patents = store.not_embedded(keys)
+
+                if not new_patents:
+                    st.info("ℹ️ Tous ces brevets sont déjà indexés.")
+                else:
+                    # Indexation en arrière-plan, un document par brevet
+                    st.session_state.index_job = get_job_queue().submit(
+                        "index_patents", {"keys": [patent["key"] for patent in new_patents], "db_path": "chroma"}
+                    )
+                    st.success(f"✅ Indexation de {len(new_patents)} nouveaux brevets lancée en arrière-plan.")
+
+        if "index_job" in st.session_state:
+            show_job_status(st.session_state.index_job, "Indexation des brevets")
 
 def chatbot_page():
     st.title("💬 Chatbot - Brevets")
 
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
+    if "conversation_cache" not in st.session_state:
+        # Chunks des tours précédents, réutilisés par les questions de suivi.
+        # Le modèle se charge pendant la saisie de la première question.
+        st.session_state.conversation_cache = ConversationCache()
+        warm_model(LLM_MODEL, conversation_prefix([]))
 
     st.subheader("📄 Importer un PDF personnel (optionnel)")
     uploaded_file = st.file_uploader("Choisir un fichier PDF", type=["pdf"])
 
-    if uploaded_file:
-        st.info("📔 Lecture du fichier PDF...")
-
-        extracted_text = extract_text_from_pdf(uploaded_file)
-
-        if len(extracted_text.strip()) < 50:
-            st.error("❌ Impossible d'extraire du texte sélectionnable. Le PDF semble illisible ou scanné.")
-        else:
-            user_temp_path = os.path.join("chroma_temp", str(uuid.uuid4()))
-            os.makedirs(user_temp_path, exist_ok=True)
-
-            splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-            docs = splitter.create_documents([extracted_text])
-            db = Chroma(persist_directory=user_temp_path, embedding_function=get_embedding_function())
-            db.add_documents(docs)
-            db.persist()
-
-            st.session_state["custom_db_path"] = user_temp_path
-            st.success("✅ PDF personnel indexé temporairement.")
-
+    # Le PDF importé va dans une collection propre à la session, dans un
+    # magasin partagé ; elle expire après une période d'inactivité.
+    sessions = get_session_stores()
+    if "custom_db_path" in st.session_state and not sessions.is_live(st.session_state["custom_db_path"]):
+        # Collection supprimée après inactivité : le fichier encore sélectionné sera réindexé.
+        st.session_state.pop("custom_db_path")
+        st.session_state.pop("uploaded_file_key", None)
+        st.session_state.pop("upload_job", None)
+        st.info("⌛ Le PDF importé a expiré après une période d'inactivité.")
+
+    # Un même fichier n'est indexé qu'une fois, même si la page est relancée
+    if uploaded_file and st.session_state.get("uploaded_file_key") != (uploaded_file.name, uploaded_file.size):
+        st.session_state["uploaded_file_key"] = (uploaded_file.name, uploaded_file.size)
+        if "custom_db_path" in st.session_state:
+            sessions.drop(st.session_state.pop("custom_db_path"))
+        session_ref = sessions.create()
+        st.session_state["upload_job"] = get_job_queue().submit("upload_pdf", {
+            "path": spool_upload(uploaded_file),
+            "db_path": session_ref,
+            "source_name": uploaded_file.name,
+            "session": True,
+        })
+        st.session_state["custom_db_path"] = session_ref
+
+    if "upload_job" in st.session_state:
+        job = show_job_status(st.session_state["upload_job"], "Indexation du PDF personnel")
+        if job is not None and job["status"] in ("failed", "cancelled") and "custom_db_path" in st.session_state:
+            sessions.drop(st.session_state.pop("custom_db_path"))
+
+    include_corpus = True
     if "custom_db_path" in st.session_state:
+        include_corpus = st.checkbox("Inclure aussi la base de brevets", value=True)
         if st.button("🧹 Réinitialiser le PDF importé"):
-            shutil.rmtree(st.session_state["custom_db_path"], ignore_errors=True)
-            del st.session_state["custom_db_path"]
+            if "upload_job" in st.session_state:
+                get_job_queue().cancel(st.session_state.pop("upload_job"))
+            sessions.drop(st.session_state.pop("custom_db_path"))
             st.experimental_rerun()
 
+    cache_stats = get_answer_cache().stats()
+    st.sidebar.caption(
+        f"🗂️ Cache de réponses : {cache_stats['entries']} entrées · "
+        f"taux de succès {cache_stats['hit_rate']:.0%}"
+    )
+    session_stats = sessions.stats()
+    st.sidebar.caption(
+        f"📚 Sessions : {session_stats['sessions']} collections · "
+        f"{session_stats['bytes'] / 2**20:.1f} / {session_stats['max_bytes'] / 2**20:.0f} Mo"
+    )
+
+    conversation_mode = st.sidebar.checkbox("💬 Tenir compte de la conversation", value=True)
+    conversation_cache = st.session_state.conversation_cache
+    st.sidebar.caption(
+        f"♻️ Passages réutilisés : {conversation_cache.hits} / {conversation_cache.hits + conversation_cache.misses} questions"
+    )
+
+    uploaded_names = [st.session_state["uploaded_file_key"][0]] if "custom_db_path" in st.session_state else []
+    where = show_search_filters(uploaded_names)
+
     for sender, message in st.session_state.chat_history:
         with st.chat_message(sender):
             st.markdown(message)
@@ -469,23 +462,42 @@ def chatbot_page():
     if user_input:
         with st.chat_message("user"):
             st.markdown(user_input)
+        turns = recent_turns(st.session_state.chat_history)
         st.session_state.chat_history.append(("user", user_input))
 
-        db_path = st.session_state.get("custom_db_path", "chroma")
-
-        try:
-            response = query_rag(user_input, db_path)
-        except Exception as e:
-            response = f"❌ Une erreur est survenue : {e}"
+        db_path = ["chroma"]
+        # Une session supprimée depuis l'affichage de la page est ignorée, jamais recréée vide.
+        if "custom_db_path" in st.session_state and sessions.touch(st.session_state["custom_db_path"]):
+            db_path = [st.session_state["custom_db_path"]] + (["chroma"] if include_corpus else [])
 
+        # Les tokens s'affichent à leur arrivée ; la réponse complète va dans l'historique.
         with st.chat_message("assistant"):
-            st.markdown(response)
+            metrics = StreamMetrics()
+            try:
+                if conversation_mode:
+                    stream = query_conversation_stream(user_input, turns, db_path, conversation_cache, metrics, where)
+                else:
+                    stream = query_rag_stream(user_input, db_path, metrics, where)
+                response = st.write_stream(stream)
+            except Exception as e:
+                response = f"❌ Une erreur est survenue : {e}"
+                st.markdown(response)
+            st.caption(metrics.summary())
+        st.session_state["last_trace"] = metrics.trace
         st.session_state.chat_history.append(("assistant", response))
+        if conversation_mode:
+            # Pendant la saisie de la question suivante, le modèle reste chargé
+            # et évalue le prochain prompt jusqu'à la question.
+            warm_model(LLM_MODEL, next_prompt_prefix(st.session_state.chat_history, conversation_cache))
+
+    show_latency_breakdown(st.session_state.get("last_trace"))
 
 # ------------ Main Application ---------------
 
 def main():
     st.set_page_config(page_title="Patent Assistant Pro", layout="wide")
+    # Les modèles de chat et d'embedding se chargent pendant l'affichage de la première page.
+    preload_models([LLM_MODEL])
     
     # Navigation
     page = st.sidebar.selectbox(
@@ -498,11 +510,14 @@ def main():
         search_page()
     elif page == "💬 Chatbot RAG":
         chatbot_page()
+    show_model_status([LLM_MODEL, EMBEDDING_MODEL])
 
 if __name__ == "__main__":
     main()
 
 @atexit.register
 def clean_temp_chroma():
+    registry.close()
+    # Restes de l'ancienne organisation, un répertoire par PDF importé.
     if os.path.exists("chroma_temp"):
         shutil.rmtree("chroma_temp", ignore_errors=True)
\ No newline at end of file
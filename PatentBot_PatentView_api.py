@@ -1,20 +1,17 @@
 import streamlit as st
-import requests
-import json
-from time import sleep
 from fpdf import FPDF
 import os
 import fitz  # PyMuPDF
 from langchain_community.vectorstores import Chroma
 from langchain.prompts import ChatPromptTemplate
 from langchain_community.llms.ollama import Ollama
-from get_embedding_function import get_embedding_function
-from populate_database import run as populate_database_main
-from langchain.text_splitter import CharacterTextSplitter
+from get_embedding_function import EMBEDDING_MODEL, get_embedding_function
+from ingest_jobs import describe_job, get_job_queue, spool_upload
 from langchain_core.documents import Document
 from langchain.schema import Document
-from ingest import initialize_vector_store  # Adapté de l’autre projet
-import pdfplumber
+from chunking import parent_limit
+from parent_store import expand_to_parents
+from session_store import get_session_stores
 
 # ------------ Utilitaires ---------------
 
@@ -22,32 +19,22 @@ def clean_text(text):
     return text.encode("latin-1", errors="ignore").decode("latin-1")
 
 
-def extract_and_ingest_pdf(file):
-    with pdfplumber.open(file) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-
-    doc = Document(page_content=text)
-    splitter = CharacterTextSplitter.from_tiktoken_encoder(chunk_size=1000, chunk_overlap=200)
-    splits = splitter.split_documents([doc])
-
-    db = initialize_vector_store()  # from ingest.py
-    db.add_documents(splits)
-    db.persist()
-    return db
-
-
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.chat_models import ChatOllama
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.prompts import ChatPromptTemplate
-
-def ask_question_with_rag(db, question):
-    retriever = db.as_retriever(k=3)
-    model = ChatOllama(model="llama3.2")
-
-    prompt_template = ChatPromptTemplate.from_template("""
+from patent_fetch import (
+    PATENTSVIEW_API_KEY, PATENTSVIEW_URL, get_patentsview_client, parse_patentsview, patentsview_jobs, run_jobs,
+)
+from reranker import RERANK_CANDIDATES, get_reranker
+from resources import get_chat_llm, get_vector_store, registry, vector_store_key
+from streaming import StreamMetrics, stream_with_metrics
+from tracing import span, start_trace, traced_stream
+from model_manager import get_model_manager, model_slot, preload_models
+
+CHAT_MODEL = "llama3.2"
+CHAT_CONTEXT_K = 3
+
+RAG_PROMPT_TEMPLATE = ChatPromptTemplate.from_template("""
     Answer the question based only on the following context:
     
     {context}
@@ -57,71 +44,95 @@ def ask_question_with_rag(db, question):
     If the answer is not in the context, reply with: "Sorry, I couldn't find relevant information in the document."
     """)
 
-    chain = (
-        {"context": retriever, "question": RunnablePassthrough()}
-        | prompt_template
-        | model
-        | StrOutputParser()
-    )
 
-    return chain.invoke(question)
+def retrieve_context(db_path, question):
+    # Matched chunks are replaced by their parent sections (parent_store.py).
+    db = get_vector_store(db_path)
+    reranker = get_reranker()
+    if reranker is None:
+        results = db.similarity_search_with_score(question, k=CHAT_CONTEXT_K)
+    else:
+        # Wider candidate set, re-ranked down to the same number of chunks.
+        results = reranker.rerank(
+            question, db.similarity_search_with_score(question, k=RERANK_CANDIDATES), top_n=CHAT_CONTEXT_K)
+    return [doc for doc, _ in expand_to_parents(results, db_path, limit=parent_limit())]
+
+
+def build_rag_chain(db_path):
+    # Retrieval and prompt only: the model runs apart, in its model manager
+    # slot, so the embedding calls of the retriever never wait on it.
+    retriever = RunnableLambda(lambda question: retrieve_context(db_path, question))
+    return {"context": retriever, "question": RunnablePassthrough()} | RAG_PROMPT_TEMPLATE
+
+
+def get_answer_chain():
+    return registry.get(("answer_chain", CHAT_MODEL), lambda: get_chat_llm(CHAT_MODEL) | StrOutputParser())
+
+
+def rag_chain_key(db_path):
+    # One chain per store, evicted with the store (evict_vector_store).
+    return vector_store_key(db_path) + ("rag_chain",)
+
+
+def get_rag_chain(db_path):
+    return registry.get(rag_chain_key(db_path), lambda: build_rag_chain(db_path))
+
+
+def ask_question_with_rag(db_path, question):
+    with start_trace("ask_question_with_rag", model=CHAT_MODEL):
+        with span("rag_chain"):
+            prompt = get_rag_chain(db_path).invoke(question)
+            with model_slot(CHAT_MODEL):
+                return get_answer_chain().invoke(prompt)
+
+
+def ask_question_with_rag_stream(db_path, question, metrics=None):
+    # The time to first token includes retrieval; the embedding and search
+    # spans show how much of it.
+    with start_trace("ask_question_with_rag", model=CHAT_MODEL) as trace:
+        if metrics is not None:
+            metrics.trace = trace
+        prompt = get_rag_chain(db_path).invoke(question)
+        with model_slot(CHAT_MODEL):
+            yield from stream_with_metrics(traced_stream(get_answer_chain().stream(prompt)), metrics)
+
+
+def show_latency_breakdown(trace):
+    # Durée de chaque étape de la dernière requête, dans la barre latérale.
+    if trace is None:
+        return
+    with st.sidebar.expander(f"⏱️ Latence de la dernière requête : {trace.duration_ms / 1000:.2f}s"):
+        st.dataframe(
+            [{"Étape": name, "ms": round(ms, 1)} for name, ms in trace.breakdown()],
+            hide_index=True,
+        )
 
 
 # ------------ PatentFetcher ---------------
 
 class PatentFetcher:
     def __init__(self):
-        self.api_key = "CQSd3FBT.8vmxye4Np3EBjNgPMwadolmTjQhg5TJr"
-        self.base_url = "https://search.patentsview.org/api/v1/patent/"
-        self.headers = {
-            "Content-Type": "application/json",
-            "X-Api-Key": self.api_key
-        }
-        self.delay = 0.6
+        self.api_key = PATENTSVIEW_API_KEY
+        self.base_url = PATENTSVIEW_URL
+        # Pooled client of patent_fetch, shared with the Lens app and the API.
+        self.client = get_patentsview_client(self.api_key)
 
     def fetch_patents(self, keyword=None, max_pages=1):
-        all_patents = []
-        page = 1
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        while page <= max_pages:
-            query = {
-                "q": {
-                    "_or": [
-                        {"_text_any": {"patent_title": keyword}},
-                        {"_text_any": {"patent_abstract": keyword}}
-                    ]
-                },
-                "f": ["patent_id", "patent_title", "patent_abstract", "patent_date"],
-                "o": {"page": page, "per_page": 100}
-            }
-
-            try:
-                status_text.text(f"Fetching page {page}/{max_pages}...")
-                progress_bar.progress(page / max_pages)
-
-                response = requests.post(self.base_url, headers=self.headers, data=json.dumps(query), timeout=20)
-                if response.status_code != 200:
-                    st.error(f"Error {response.status_code}: {response.text}")
-                    break
-
-                data = response.json()
-                patents = data.get("patents", [])
-                if not patents:
-                    break
-
-                all_patents.extend(patents)
-                page += 1
-                sleep(self.delay)
-
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
-                break
+        def on_progress(done, total):
+            status_text.text(f"Fetching page {done}/{total}...")
+            progress_bar.progress(done / total)
+
+        jobs = {"PatentsView": (self.client, patentsview_jobs(keyword, 1, max_pages), parse_patentsview)}
+        results, errors = run_jobs(jobs, on_progress)
+        for error in errors:
+            st.error(f"Error: {error}")
 
         progress_bar.empty()
         status_text.empty()
-        return all_patents
+        return results["PatentsView"]
 
 
 def save_patents_to_pdf(patents, keyword):
@@ -153,12 +164,29 @@ def save_patents_to_pdf(patents, keyword):
 
 
 def run_populate_database():
+    # La mise à jour tourne en arrière-plan ; son état est affiché dans la barre latérale.
     try:
-        populate_database_main()
-        st.success("Chroma DB mise à jour avec succès.")
+        st.session_state["populate_job"] = get_job_queue().submit("populate_database", {})
+        st.success("Mise à jour de la Chroma DB lancée en arrière-plan.")
     except Exception as e:
         st.error(f"Erreur lors de la mise à jour de la base : {e}")
 
+
+def show_populate_status():
+    job_id = st.session_state.get("populate_job")
+    job = get_job_queue().get(job_id) if job_id else None
+    if job is None:
+        return
+
+    st.sidebar.caption(f"Mise à jour de la base : {describe_job(job)}")
+    if job["status"] == "failed":
+        st.sidebar.error(f"Erreur lors de la mise à jour de la base : {job['error']}")
+    elif job["status"] in ("queued", "running"):
+        st.sidebar.button("🔄 Actualiser")
+        if st.sidebar.button("⛔ Annuler la mise à jour"):
+            get_job_queue().cancel(job_id)
+            st.rerun()
+
 # ------------ UI ---------------
 
 def search_page():
@@ -198,7 +226,6 @@ def search_page():
             st.success(f"PDF généré : {pdf_file}")
             st.write("🔄 Mise à jour de la base de données RAG...")
             run_populate_database()
-            st.success("✅ Base de données Chroma mise à jour.")
             st.session_state.page = "chatbot"
             st.rerun()
 
@@ -212,30 +239,87 @@ def chatbot_page():
     st.subheader("📤 Importer un PDF personnel")
     uploaded_file = st.file_uploader("Choisir un fichier PDF", type=["pdf"])
 
-    if uploaded_file:
-        st.info("📄 Lecture et indexation du fichier PDF...")
-        db = extract_and_ingest_pdf(uploaded_file)
-        st.success("✅ Document importé et indexé dans la base de données.")
-
-        st.session_state.vector_db = db
+    # Le PDF est indexé en arrière-plan dans une collection propre à la
+    # session ; elle expire après une période d'inactivité.
+    sessions = get_session_stores()
+    if "vector_db_path" in st.session_state and not sessions.is_live(st.session_state["vector_db_path"]):
+        st.session_state.pop("vector_db_path")
+        st.session_state.pop("uploaded_file_key", None)
+        st.session_state.pop("upload_job", None)
+        st.info("⌛ Le PDF importé a expiré après une période d'inactivité.")
+
+    # Un même fichier n'est indexé qu'une fois, même si la page est relancée à chaque message.
+    if uploaded_file and st.session_state.get("uploaded_file_key") != (uploaded_file.name, uploaded_file.size):
+        st.session_state["uploaded_file_key"] = (uploaded_file.name, uploaded_file.size)
+        if "vector_db_path" in st.session_state:
+            sessions.drop(st.session_state.pop("vector_db_path"))
+        session_ref = sessions.create()
+        st.session_state["upload_job"] = get_job_queue().submit("upload_pdf", {
+            "path": spool_upload(uploaded_file),
+            "db_path": session_ref,
+            "source_name": uploaded_file.name,
+            "session": True,
+        })
+        st.session_state["vector_db_path"] = session_ref
+
+    ready = False
+    job = get_job_queue().get(st.session_state["upload_job"]) if "upload_job" in st.session_state else None
+    if job is not None:
+        st.caption(f"Indexation du PDF : {describe_job(job)}")
+        if job["status"] == "failed":
+            st.error(f"❌ {job['error']}")
+        elif job["status"] in ("queued", "running"):
+            st.button("🔄 Actualiser")
+        if job["status"] in ("failed", "cancelled") and "vector_db_path" in st.session_state:
+            sessions.drop(st.session_state.pop("vector_db_path"))
+        ready = job["status"] == "done" and "vector_db_path" in st.session_state
 
     user_input = st.chat_input("Posez votre question sur ce document")
 
-    if user_input and "vector_db" in st.session_state:
-        response = ask_question_with_rag(st.session_state.vector_db, user_input)
+    for sender, message in st.session_state.chat_history:
+        with st.chat_message(sender):
+            st.markdown(message)
+
+    if user_input and ready and sessions.touch(st.session_state["vector_db_path"]):
+        with st.chat_message("Vous"):
+            st.markdown(user_input)
+        with st.chat_message("Assistant"):
+            metrics = StreamMetrics()
+            response = st.write_stream(
+                ask_question_with_rag_stream(st.session_state["vector_db_path"], user_input, metrics)
+            )
+            st.caption(metrics.summary())
+        st.session_state["last_trace"] = metrics.trace
         st.session_state.chat_history.append(("Vous", user_input))
         st.session_state.chat_history.append(("Assistant", response))
+    elif user_input and job is not None and job["status"] in ("queued", "running"):
+        st.warning("Le document est encore en cours d'indexation.")
     elif user_input:
         st.warning("Veuillez importer un document PDF d'abord.")
 
-    for sender, message in st.session_state.chat_history:
-        with st.chat_message(sender):
-            st.markdown(message)
+    show_latency_breakdown(st.session_state.get("last_trace"))
+
+
+def show_model_status(models):
+    # Modèles Ollama chargés en mémoire, dans la barre latérale.
+    status = get_model_manager().status(models)
+    with st.sidebar.expander(f"🧠 Modèles Ollama ({status['max_resident']} en mémoire au plus)"):
+        st.dataframe(
+            [{"Modèle": row["model"], "Chargé": "✅" if row["loaded"] else "—", "Épinglé": "📌" if row["pinned"] else "",
+              "Requêtes": row["active"], "Mo": row["size_mb"]} for row in status["models"]],
+            hide_index=True,
+        )
+        if status["queued"]:
+            st.caption(f"⏳ {status['queued']} requêtes en attente d'un modèle")
 
 
 def main():
     st.set_page_config(page_title="Patent Assistant", layout="wide")
+    # The chat and embedding models are loaded while the first page is shown.
+    preload_models([CHAT_MODEL])
     page = st.sidebar.selectbox("Navigation", ["🔍 Rechercher des brevets", "💬 Chatbot"])
+    show_populate_status()
+    show_model_status([CHAT_MODEL, EMBEDDING_MODEL])
     if page == "🔍 Rechercher des brevets":
         search_page()
     elif page == "💬 Chatbot":
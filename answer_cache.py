@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from session_store import split_store_ref
+
+
+ANSWER_CACHE_PATH = os.path.join("cache", "answers.sqlite3")
+SIMILARITY_THRESHOLD = 0.95
+ANSWER_TTL_SECONDS = 7 * 24 * 3600
+MAX_ANSWERS = 2000
+
+VERSION_FILE = "collection_version"
+
+
+# ------------ Collection version ---------------
+# Every write to a Chroma store bumps a version kept next to it, so answers
+# computed against an older state of the collection are never served. The
+# version is a timestamp so it never repeats, even after the store is deleted.
+
+def version_path(db_path):
+    # Collections of a shared store each get their own version file.
+    directory, collection = split_store_ref(db_path)
+    return os.path.join(directory, f"{VERSION_FILE}.{collection}" if collection else VERSION_FILE)
+
+
+def get_collection_version(db_path):
+    try:
+        with open(version_path(db_path), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_collection_version(db_path):
+    path = version_path(db_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = max(time.time_ns(), get_collection_version(db_path) + 1)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(version))
+    os.replace(tmp_path, path)
+    return version
+
+
+def remove_collection_version(db_path):
+    try:
+        os.remove(version_path(db_path))
+    except OSError:
+        pass
+
+
+def store_state(db_paths, where=None):
+    # Cache key and version of a query spanning several stores. Versions are
+    # timestamps, so a write to any of the stores raises the maximum. A
+    # metadata filter is part of the key: filtered answers are cached apart.
+    if isinstance(db_paths, str):
+        db_paths = [db_paths]
+    key = "+".join(db_paths)
+    if where:
+        key += "?" + json.dumps(where, sort_keys=True)
+    return key, max(get_collection_version(db_path) for db_path in db_paths)
+
+
+# ------------ Answer cache ---------------
+
+class AnswerCache:
+    # Answers keyed by the query embedding: a new question is served from the
+    # cache when its cosine similarity with a cached question of the same
+    # store and collection version reaches the threshold.
+
+    def __init__(self, path=ANSWER_CACHE_PATH, threshold=SIMILARITY_THRESHOLD,
+                 ttl_seconds=ANSWER_TTL_SECONDS, max_entries=MAX_ANSWERS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, db_path TEXT NOT NULL, version INTEGER NOT NULL,"
+            " question TEXT NOT NULL, vector BLOB NOT NULL, answer TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_store ON answers(db_path, version)")
+        self._conn.commit()
+
+    def lookup(self, db_path, query_vector, where=None):
+        # db_path: one store reference or a list of them.
+        db_path, version = store_state(db_path, where)
+        now = time.time()
+        with self._lock:
+            # Drop answers computed on an older collection or past their TTL.
+            self._conn.execute(
+                "DELETE FROM answers WHERE db_path = ? AND (version != ? OR created < ?)",
+                (db_path, version, now - self.ttl_seconds),
+            )
+            rows = self._conn.execute(
+                "SELECT id, vector, answer FROM answers WHERE db_path = ? AND version = ?",
+                (db_path, version),
+            ).fetchall()
+
+            best_id, best_answer, best_score = None, None, -1.0
+            if rows:
+                query = np.asarray(query_vector, dtype=np.float32)
+                matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+                norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+                scores = matrix @ query / np.where(norms == 0, 1.0, norms)
+                best = int(np.argmax(scores))
+                best_id, best_answer, best_score = rows[best][0], rows[best][2], float(scores[best])
+
+            if best_id is not None and best_score >= self.threshold:
+                self._conn.execute(
+                    "UPDATE answers SET last_used = ?, hits = hits + 1 WHERE id = ?", (now, best_id)
+                )
+                self._conn.commit()
+                self.hits += 1
+                return best_answer
+
+            self._conn.commit()
+            self.misses += 1
+            return None
+
+    def store(self, db_path, question, query_vector, answer, where=None):
+        db_path, version = store_state(db_path, where)
+        now = time.time()
+        blob = array("f", query_vector).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (db_path, version, question, vector, answer, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (db_path, version, question, blob, answer, now, now),
+            )
+            # Keep only the most recently used entries.
+            self._conn.execute(
+                "DELETE FROM answers WHERE id NOT IN"
+                " (SELECT id FROM answers ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
@@ -0,0 +1,336 @@
+import asyncio
+import os
+import re
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from doc_metadata import build_where
+from get_embedding_function import EMBEDDING_MODEL
+from ingest_jobs import SPOOL_DIR, describe_job, get_job_queue
+from model_manager import get_model_manager, preload_models
+from patent_fetch import get_lens_client, get_patentsview_client, patentsview_record, search_both
+from patent_store import get_patent_store
+from rag import LLM_MODEL, query_rag_stream
+from resources import registry
+from session_store import get_session_stores
+
+
+# Headless HTTP service over the same RAG, fetch and ingestion code as the
+# Streamlit pages, so several UIs or batch jobs can share one warm process.
+#   uvicorn api_server:app --host 127.0.0.1 --port 8000
+
+# Generations running at once against the local LLM, and requests allowed to
+# wait for a slot before new ones are refused with 503.
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("PATENTBOT_MAX_GENERATIONS", 2))
+MAX_QUEUED_GENERATIONS = int(os.environ.get("PATENTBOT_MAX_QUEUED", 8))
+QUEUE_TIMEOUT_SECONDS = 60
+ASK_TIMEOUT_SECONDS = 300
+SEARCH_TIMEOUT_SECONDS = 120
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+RETRY_AFTER_SECONDS = 5
+FILTER_FIELDS = ["files", "api_sources", "doc_types", "patent_ids", "date_from", "date_to"]
+# Uploads written to the main corpus get their chunk sources under this prefix.
+CORPUS_UPLOAD_PREFIX = "upload/"
+MAX_FILENAME_CHARS = 100
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    # At most `limit` holders at once and at most `max_queued` waiters; beyond
+    # that acquire() fails at once so that clients back off instead of piling
+    # up behind a saturated LLM.
+
+    def __init__(self, limit, max_queued):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        # Created lazily, inside the server's event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def acquire(self, timeout):
+        semaphore = self._get_semaphore()
+        if semaphore.locked() and self.waiting >= self.max_queued:
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._get_semaphore().release()
+
+    def stats(self):
+        return {"active": self.active, "waiting": self.waiting,
+                "limit": self.limit, "max_queued": self.max_queued}
+
+
+llm_limiter = ConcurrencyLimiter(MAX_CONCURRENT_GENERATIONS, MAX_QUEUED_GENERATIONS)
+
+
+def error(message, status, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+def int_field(payload, name, default, low, high):
+    # Client-given integer clamped to [low, high]; None when it is not one.
+    value = payload.get(name, default)
+    if isinstance(value, bool):
+        return None
+    try:
+        return max(low, min(int(value), high))
+    except (TypeError, ValueError):
+        return None
+
+
+def upload_source_name(filename, db_path):
+    # The chunk source and ID prefix ("source:page:chunk") of an uploaded
+    # file: no directories or ID separators from the client, and a prefix
+    # of its own in the main corpus, so it cannot replace a data/ file.
+    name = re.sub(r"[^\w.\- ]", "_", os.path.basename((filename or "").replace("\\", "/"))).strip(" .")
+    name = name[-MAX_FILENAME_CHARS:] or f"{uuid.uuid4().hex}.pdf"
+    return CORPUS_UPLOAD_PREFIX + name if db_path == "chroma" else name
+
+
+def close_generator(generator):
+    # Runs in the threadpool. A token may still be produced in another
+    # thread: close() fails until it is done, then runs the generator's
+    # finally blocks (model slot, trace).
+    while True:
+        try:
+            generator.close()
+            return
+        except ValueError:
+            time.sleep(0.05)
+
+
+def allowed_store(ref):
+    # Clients may only name the main corpus or a live session collection,
+    # never an arbitrary directory to open or write.
+    if ref == "chroma":
+        return True
+    try:
+        return isinstance(ref, str) and get_session_stores().is_live(ref)
+    except ValueError:
+        return False
+
+
+async def read_json(request):
+    try:
+        payload = await request.json()
+    except ValueError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+# ------------ /ask ---------------
+
+async def ask(request):
+    # {"question": str, "db_paths": ["chroma", ...], "stream": true,
+    #  "filters": {"files": [...], "api_sources": [...], "doc_types": [...],
+    #              "patent_ids": [...], "date_from": "2015", "date_to": "2020-06"}}
+    payload = await read_json(request)
+    if not payload or not str(payload.get("question", "")).strip():
+        return error("question is required", 400)
+    question = payload["question"].strip()
+    db_paths = payload.get("db_paths") or ["chroma"]
+    if isinstance(db_paths, str):
+        db_paths = [db_paths]
+    if not isinstance(db_paths, list) or not all(allowed_store(ref) for ref in db_paths):
+        return error("db_paths accepts only \"chroma\" and session stores returned by /ingest", 400)
+    filters = payload.get("filters") or {}
+    if not isinstance(filters, dict) or set(filters) - set(FILTER_FIELDS):
+        return error(f"filters accepts only {', '.join(FILTER_FIELDS)}", 400)
+    where = build_where(**filters)
+
+    try:
+        await llm_limiter.acquire(QUEUE_TIMEOUT_SECONDS)
+    except Overloaded:
+        return error("LLM saturé, réessayez plus tard", 503, RETRY_AFTER_SECONDS)
+
+    deadline = time.monotonic() + ASK_TIMEOUT_SECONDS
+    generator = query_rag_stream(question, db_paths, where=where)
+    tokens = iterate_in_threadpool(generator)
+
+    async def stream():
+        # The slot is held until the last token, or until the client goes
+        # away or the request runs out of time. The generation is then
+        # closed, so it stops holding the model slot and generating.
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield "\n[timeout]"
+                    return
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    yield "\n[timeout]"
+                    return
+                yield token
+        finally:
+            try:
+                await run_in_threadpool(close_generator, generator)
+            finally:
+                llm_limiter.release()
+
+    # The first token is awaited before answering, so errors still get a
+    # status code and the generator is started (its finally then runs even if
+    # the client disconnects before reading anything).
+    tokens_out = stream()
+    try:
+        first = await tokens_out.__anext__()
+    except StopAsyncIteration:
+        first = ""
+    except Exception as e:
+        return error(f"generation failed: {e}", 502)
+
+    if not payload.get("stream", True):
+        answer = first + "".join([token async for token in tokens_out])
+        return JSONResponse({"question": question, "answer": answer})
+
+    async def body():
+        yield first
+        async for token in tokens_out:
+            yield token
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+# ------------ /search-patents ---------------
+
+async def search_patents(request):
+    # {"keyword": str, "pv_pages": 3, "lens_count": 100, "index": false}
+    payload = await read_json(request)
+    if not payload or not str(payload.get("keyword", "")).strip():
+        return error("keyword is required", 400)
+    keyword = payload["keyword"].strip()
+    pv_pages = int_field(payload, "pv_pages", 3, 1, 20)
+    lens_count = int_field(payload, "lens_count", 100, 0, 1000)
+    if pv_pages is None or lens_count is None:
+        return error("pv_pages and lens_count must be integers", 400)
+
+    def run():
+        pv, lens, errors = search_both(get_patentsview_client(), get_lens_client(), keyword, pv_pages, lens_count)
+        store = get_patent_store()
+        keys = store.upsert_records(pv + lens)
+        # Saved in the shape the Lens search page reads back from cached_search.
+        store.save_search(keyword, {"pv_pages": pv_pages, "lens_count": lens_count},
+                          {"PatentsView": [patentsview_record(patent) for patent in pv], "The Lens": lens},
+                          complete=not errors)
+        return pv, lens, errors, list(dict.fromkeys(keys))
+
+    try:
+        pv, lens, errors, keys = await asyncio.wait_for(run_in_threadpool(run), SEARCH_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return error("search timed out", 504)
+
+    response = {"PatentsView": pv, "The Lens": lens, "errors": errors, "keys": keys}
+    if payload.get("index"):
+        response["job_id"] = get_job_queue().submit("index_patents", {"keys": keys, "db_path": "chroma"})
+    return JSONResponse(response)
+
+
+# ------------ /ingest ---------------
+
+async def ingest(request):
+    # multipart "file" (PDF) -> new session collection, or the store given in
+    # the "db_path" field; without a file, refreshes the main corpus from data/.
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        job_id = get_job_queue().submit("populate_database", {})
+        return JSONResponse({"job_id": job_id, "db_path": "chroma"}, status_code=202)
+
+    form = await request.form()
+    upload = form.get("file")
+    if upload is None or not hasattr(upload, "read"):
+        return error("file is required", 400)
+    db_path = form.get("db_path")
+    if db_path and not allowed_store(db_path):
+        return error("db_path accepts only \"chroma\" and session stores returned by /ingest", 400)
+    data = await upload.read()
+    if len(data) > MAX_UPLOAD_BYTES:
+        return error("file too large", 413)
+
+    # Spooled like the Streamlit uploads, so the job can resume after a restart.
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    if not db_path:
+        db_path = get_session_stores().create()
+    job_id = get_job_queue().submit("upload_pdf", {
+        "path": path,
+        "db_path": db_path,
+        "source_name": upload_source_name(upload.filename, db_path),
+        "session": db_path != "chroma",
+    })
+    return JSONResponse({"job_id": job_id, "db_path": db_path}, status_code=202)
+
+
+async def job_status(request):
+    job = get_job_queue().get(request.path_params["job_id"])
+    if job is None:
+        return error("unknown job", 404)
+    job["description"] = describe_job(job)
+    return JSONResponse(job)
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", "llm": llm_limiter.stats()})
+
+
+async def models(request):
+    # Loaded/unloaded status of the configured Ollama models.
+    status = await run_in_threadpool(get_model_manager().status, [LLM_MODEL, EMBEDDING_MODEL])
+    return JSONResponse(status)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    preload_models([LLM_MODEL])
+    yield
+    registry.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/ask", ask, methods=["POST"]),
+        Route("/search-patents", search_patents, methods=["POST"]),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status, methods=["GET"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/models", models, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get("PATENTBOT_HOST", "127.0.0.1"),
+                port=int(os.environ.get("PATENTBOT_PORT", 8000)))
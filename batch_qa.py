@@ -0,0 +1,213 @@
+import argparse
+import contextvars
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chunking import parent_limit
+from model_manager import model_slot
+from parent_store import expand_to_parents
+from populate_database import CHROMA_PATH, DATA_PATH
+from rag import LLM_MODEL, NO_CONTEXT_ANSWER, prompt_from_results
+from reranker import RERANK_CANDIDATES, get_reranker
+from resources import get_embeddings, get_llm, vector_store
+from retrieval import FETCH_K, RETRIEVAL_K, batch_dense_search, fuse_with_keywords
+from tracing import span, start_trace
+
+
+# Runs a file of questions against the RAG store without the chatbot:
+#   python batch_qa.py questions.csv --output answers.jsonl --parallel 2
+#
+# Questions: .txt (one per line), .csv (columns "question" and optional
+# "source") or .jsonl ({"question": ..., "source": ...}). "source" restricts
+# retrieval to one document ("welding.pdf" or "data/welding.pdf").
+# Results are appended as they complete (.jsonl or .csv); running the same
+# command again skips the questions already answered.
+#
+# Several generations only run in parallel if Ollama allows it
+# (OLLAMA_NUM_PARALLEL on the server).
+
+DEFAULT_PARALLEL = 2
+CSV_FIELDS = ["id", "question", "source", "answer", "context_chunks", "context_tokens", "seconds"]
+
+
+def question_id(question, source):
+    return hashlib.sha1(f"{source or ''}\0{question}".encode("utf-8")).hexdigest()[:16]
+
+
+def read_questions(path):
+    extension = os.path.splitext(path)[1].lower()
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        if extension == ".csv":
+            rows = [{"question": row.get("question", ""), "source": row.get("source") or None}
+                    for row in csv.DictReader(f)]
+        elif extension == ".jsonl":
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    rows.append({"question": item.get("question", ""), "source": item.get("source") or None})
+        else:
+            rows = [{"question": line, "source": None} for line in f]
+
+    questions = []
+    for row in rows:
+        question = row["question"].strip()
+        if question:
+            questions.append({"id": question_id(question, row["source"]), "question": question,
+                              "source": row["source"]})
+    return questions
+
+
+def source_filter(source):
+    if not source:
+        return None
+    return {"source": {"$in": list(dict.fromkeys([source, os.path.join(DATA_PATH, source)]))}}
+
+
+class ResultWriter:
+    # Appends one row per answered question, flushed at once, so an
+    # interrupted run loses nothing that was already answered.
+
+    def __init__(self, path):
+        self.path = path
+        self.csv = os.path.splitext(path)[1].lower() == ".csv"
+        self._lock = threading.Lock()
+
+    def truncate_partial_row(self):
+        # A run killed mid-write leaves a cut-off last row: the file is cut
+        # back to the end of the last complete one before appending. CSV rows
+        # end with "\r\n" (answers only hold "\n"); JSON lines with "\n".
+        terminator = b"\r\n" if self.csv else b"\n"
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(terminator):
+                end = data.rfind(terminator)
+                f.truncate(end + len(terminator) if end >= 0 else 0)
+
+    def done_ids(self):
+        if not os.path.exists(self.path):
+            return set()
+        self.truncate_partial_row()
+        with open(self.path, "r", encoding="utf-8", newline="") as f:
+            if self.csv:
+                return {row["id"] for row in csv.DictReader(f)}
+            return {json.loads(line)["id"] for line in f if line.strip()}
+
+    def write(self, result):
+        with self._lock:
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                if self.csv:
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+                    if is_new:
+                        writer.writeheader()
+                    writer.writerow(result)
+                else:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+def retrieve_all(db, db_path, questions, vectors, k=RETRIEVAL_K, fetch_k=FETCH_K):
+    # Questions sharing a scope go to Chroma in one query; the keyword side
+    # and the fusion then run per question.
+    results = {}
+    by_scope = {}
+    for item, vector in zip(questions, vectors):
+        by_scope.setdefault(item["source"], []).append((item, vector))
+    for source, items in by_scope.items():
+        where = source_filter(source)
+        with span("vector_search", questions=len(items), source=source or ""):
+            dense_lists = batch_dense_search(db, [vector for _, vector in items], k=fetch_k, where=where)
+        for (item, _), dense in zip(items, dense_lists):
+            results[item["id"]] = fuse_with_keywords(db, db_path, item["question"], dense, k=k, fetch_k=fetch_k,
+                                                     where=where)
+    return results
+
+
+def answer(item, results, model, reranker=None, k=RETRIEVAL_K, db_path=CHROMA_PATH):
+    start = time.perf_counter()
+    if reranker is not None:
+        results = reranker.rerank(item["question"], results, top_n=k)
+    with span("parent_expand"):
+        results = expand_to_parents(results, db_path, limit=parent_limit())
+    prompt, context_report = prompt_from_results(item["question"], results)
+    if prompt is None:
+        text, context_report = NO_CONTEXT_ANSWER, {}
+    else:
+        with span("generation"):
+            with model_slot(LLM_MODEL):
+                text = model.invoke(prompt)
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "source": item["source"] or "",
+        "answer": text,
+        "context_chunks": context_report.get("context_chunks", 0),
+        "context_tokens": context_report.get("context_tokens", 0),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def run_batch(questions_path, output_path, db_path=CHROMA_PATH, parallel=DEFAULT_PARALLEL, k=RETRIEVAL_K):
+    questions = read_questions(questions_path)
+    writer = ResultWriter(output_path)
+    done = writer.done_ids()
+    todo = list({item["id"]: item for item in questions if item["id"] not in done}.values())
+    print(f"👉 {len(questions)} questions, {len(questions) - len(todo)} already answered, {len(todo)} to run")
+    if not todo:
+        return 0
+
+    failures = 0
+    with start_trace("batch_qa", questions=len(todo)):
+        # Every question embedded up front, as a query like query_rag does.
+        with span("query_embedding", questions=len(todo)):
+            vectors = get_embeddings().embed_queries([item["question"] for item in todo])
+
+        # With a re-ranker, each worker narrows a wider candidate set down to k.
+        reranker = get_reranker()
+        candidates = max(k, RERANK_CANDIDATES) if reranker is not None else k
+        with vector_store(db_path) as db:
+            retrieved = retrieve_all(db, db_path, todo, vectors, k=candidates, fetch_k=max(FETCH_K, candidates))
+
+        model = get_llm(LLM_MODEL)
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+            # Each worker runs in a copy of the current context, so its spans join the trace.
+            futures = {pool.submit(contextvars.copy_context().run, answer, item, retrieved[item["id"]], model,
+                                   reranker, k, db_path): item
+                       for item in todo}
+            for count, future in enumerate(as_completed(futures), 1):
+                item = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Not written: the question is retried on the next run.
+                    failures += 1
+                    print(f"❌ [{count}/{len(todo)}] {item['question'][:60]} : {e}")
+                    continue
+                writer.write(result)
+                print(f"✅ [{count}/{len(todo)}] {item['question'][:60]} ({result['seconds']}s)")
+
+    if failures:
+        print(f"⚠️ {failures} questions failed; run the same command again to retry them.")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions", help="Question file (.txt, .csv or .jsonl).")
+    parser.add_argument("--output", "-o", default="answers.jsonl", help="Result file (.jsonl or .csv).")
+    parser.add_argument("--db", default=CHROMA_PATH, help="Vector store to query.")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL, help="Generations run at once.")
+    parser.add_argument("--k", type=int, default=RETRIEVAL_K, help="Chunks retrieved per question.")
+    args = parser.parse_args()
+
+    failures = run_batch(args.questions, args.output, db_path=args.db, parallel=args.parallel, k=args.k)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# Cost of the default "parent" chunking profile (chunking.py) against the
+# "flat" one (800-character chunks, 80 overlap, chunks sent to the LLM as
+# they are): chunks and characters embedded, embedding HTTP calls during
+# ingestion, and context/prompt tokens of query_rag. Other child/parent
+# sizes and parent counts can be compared:
+#   python -m benchmarks.bench_chunking --child-sizes 200 300 400 --parent-max-chars 1200 1600 --parent-k 2 3
+#
+# Only costs are measured: the stub's embeddings say nothing about retrieval
+# quality, which needs the real model.
+#
+# Each scheme ingests the same PDFs of data/ into its own temporary working
+# directory, against the Ollama stub.
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_servers import ollama_stub
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+EMBED_PATHS = ("/api/embed", "/api/embeddings")
+
+QUESTIONS = [
+    "What are the main types of welding processes?",
+    "Which materials are used in 3D printing?",
+    "What are the benefits of renewable energies?",
+    "What is the economic impact of tourism?",
+    "How do photovoltaic solar panels convert light into electricity?",
+    "How many planets are in the solar system?",
+]
+
+
+def embedded_texts(calls):
+    texts = []
+    for path, payload in calls:
+        if path == "/api/embeddings":
+            texts.append(payload.get("prompt", ""))
+        elif path == "/api/embed":
+            inputs = payload.get("input", [])
+            texts.extend([inputs] if isinstance(inputs, str) else inputs)
+    return texts
+
+
+def run_scheme(name, files, server, questions, profile):
+    workdir = tempfile.mkdtemp(prefix="bench_chunking_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for path in files:
+        shutil.copy(path, os.path.join(workdir, "data"))
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        import chunking
+        import populate_database
+        import rag
+        import answer_cache
+        import embedding_cache
+        from answer_cache import bump_collection_version
+        from keyword_index import drop_keyword_index
+        from parent_store import drop_parent_store, get_parent_store
+        from resources import get_vector_store, registry
+        from streaming import StreamMetrics
+
+        default_profile = chunking.CHUNKING_PROFILE
+        chunking.CHUNKING_PROFILES["bench"] = profile
+        chunking.CHUNKING_PROFILE = "bench"
+        try:
+            calls = server.calls
+            start_calls = len(calls)
+            start = time.perf_counter()
+            populate_database.update_database()
+            ingest_seconds = time.perf_counter() - start
+            ingest_calls = [call for call in calls[start_calls:] if call[0] in EMBED_PATHS]
+            texts = embedded_texts(ingest_calls)
+
+            bump_collection_version("chroma")
+            context_tokens, context_chunks, prompt_chars = [], [], []
+            for question in questions:
+                metrics = StreamMetrics()
+                query_start = len(calls)
+                "".join(rag.query_rag_stream(question, "chroma", metrics))
+                report = metrics.context_report or {}
+                context_tokens.append(report.get("context_tokens", 0))
+                context_chunks.append(report.get("context_chunks", 0))
+                prompt_chars.extend(len(payload.get("prompt", "")) for path, payload in calls[query_start:]
+                                    if path == "/api/generate")
+            row = {
+                "chunks": get_vector_store("chroma")._collection.count(),
+                "parents": get_parent_store("chroma").count(),
+                "embedded_texts": len(texts),
+                "embedded_chars": sum(len(text) for text in texts),
+                "embed_http_calls": len(ingest_calls),
+                "ingest_seconds": ingest_seconds,
+                "context_chunks_mean": statistics.fmean(context_chunks),
+                "context_tokens_mean": statistics.fmean(context_tokens),
+                # Same estimate as the stub's prompt_eval_count.
+                "prompt_tokens_mean": statistics.fmean((chars + 3) // 4 for chars in prompt_chars) if prompt_chars else 0,
+            }
+            # Each scheme has its own store: handles opened on "chroma" are closed.
+            registry.close()
+            drop_keyword_index("chroma")
+            drop_parent_store("chroma")
+            answer_cache.get_answer_cache().close()
+            answer_cache._answer_cache = None
+            # Nor are embeddings shared between schemes.
+            for cache in embedding_cache._caches.values():
+                cache.close()
+            embedding_cache._caches.clear()
+        finally:
+            chunking.CHUNKING_PROFILE = default_profile
+            del chunking.CHUNKING_PROFILES["bench"]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{name:<22} {row['chunks']:>7} {row['parents']:>8} {row['embedded_chars']:>10} "
+          f"{row['embed_http_calls']:>6} {row['context_chunks_mean']:>8.1f} {row['context_tokens_mean']:>8.0f} "
+          f"{row['prompt_tokens_mean']:>8.0f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-files", type=int, default=4, help="PDFs of data/ to ingest.")
+    parser.add_argument("--queries", type=int, default=12)
+    parser.add_argument("--child-sizes", type=int, nargs="+", default=None,
+                        help="Child chunk sizes to compare (default: the parent profile's).")
+    parser.add_argument("--parent-max-chars", type=int, nargs="+", default=None,
+                        help="Parent section sizes to compare (default: the parent profile's).")
+    parser.add_argument("--parent-k", type=int, nargs="+", default=None,
+                        help="Parent sections sent to the LLM (default: the parent profile's).")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(REPO_DIR, "data", "*.pdf")))[:args.max_files]
+    questions = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(args.queries)]
+    metrics = {}
+    with ollama_stub() as server:
+        # Must be set before the pipeline modules are imported.
+        os.environ["OLLAMA_BASE_URL"] = server.url
+        sys.path.insert(0, REPO_DIR)
+        import chunking
+
+        parent = chunking.CHUNKING_PROFILES["parent"]
+        child_sizes = args.child_sizes or [parent["chunk_size"]]
+        parent_sizes = args.parent_max_chars or [parent["parent_max_chars"]]
+        parent_ks = args.parent_k or [parent["parent_k"]]
+        print(f"👉 {len(files)} PDFs, {len(questions)} questions")
+        print(f"{'':<22} {'chunks':>7} {'parents':>8} {'emb chars':>10} {'calls':>6} "
+              f"{'ctx chk':>8} {'ctx tok':>8} {'prompt':>8}")
+        metrics["flat"] = run_scheme("flat 800/80", files, server, questions, chunking.CHUNKING_PROFILES["flat"])
+        for parent_k in parent_ks:
+            for parent_size in parent_sizes:
+                for size in child_sizes:
+                    profile = dict(parent, chunk_size=size, parent_max_chars=parent_size, parent_k=parent_k)
+                    metrics[f"child{size}.parent{parent_size}.k{parent_k}"] = run_scheme(
+                        f"{size}/{parent_size}, k={parent_k}", files, server, questions, profile)
+
+    result = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "metrics": metrics}
+    output = args.output or os.path.join(RESULTS_DIR, f"chunking-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Follow-up latency of the conversation-aware chatbot pipeline
+# (rag.query_conversation_stream) against the previous stateless one
+# (rag.query_rag_stream, Ollama's default keep-alive): time to first token
+# and retrieval time per turn, and how often a follow-up reuses the chunks
+# of an earlier turn.
+#   python -m benchmarks.bench_conversation --think-time 3 --load-latency 4
+#
+# The Ollama stub unloads a model after `--stub-keep-alive` idle seconds
+# unless the request asks for longer (a scaled-down stand-in for Ollama's
+# 5 minutes), charges `--load-latency` to load it, only charges the prompt
+# tokens after the prefix shared with the previous prompt, and embeds texts
+# as sums of word vectors, so related questions get similar vectors.
+# Runs in a temporary working directory.
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_servers import ollama_stub
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+CONVERSATIONS = [
+    ["What are the main types of welding processes?", "Which one is used for thin sheets?",
+     "What are its drawbacks?"],
+    ["Which materials are used in 3D printing?", "Which of them is the cheapest?", "How strong are they?"],
+    ["What are the benefits of renewable energies?", "And their drawbacks?", "Which one grows fastest?"],
+    ["How do photovoltaic solar panels convert light into electricity?", "How efficient are they?",
+     "What do they cost?"],
+]
+
+
+def stage_ms(trace, names):
+    return sum(ms for stage, ms in trace.breakdown() if stage.strip() in names)
+
+
+def run_mode(name, conversations, think_time, conversation, threshold=None):
+    import rag
+    from answer_cache import bump_collection_version
+    from conversation import (REUSE_SIMILARITY, ConversationCache, conversation_prefix, next_prompt_prefix,
+                              recent_turns, warm_model)
+    from streaming import StreamMetrics
+
+    # A new collection version, so no answer comes from an earlier mode.
+    bump_collection_version("chroma")
+    rows = {"first": [], "follow_up": []}
+    hits = 0
+    for questions in conversations:
+        history = []
+        cache = ConversationCache(threshold=threshold or REUSE_SIMILARITY)
+        if conversation:
+            warm_model(rag.LLM_MODEL, conversation_prefix([])).join()
+        for turn, question in enumerate(questions):
+            # The user reads the answer and types the next question.
+            time.sleep(think_time)
+            metrics = StreamMetrics()
+            if conversation:
+                stream = rag.query_conversation_stream(question, recent_turns(history), "chroma", cache, metrics)
+            else:
+                stream = rag.query_rag_stream(question, "chroma", metrics)
+            answer = "".join(stream)
+            history += [("user", question), ("assistant", answer)]
+            if conversation:
+                warm = warm_model(rag.LLM_MODEL, next_prompt_prefix(history, cache))
+            rows["first" if turn == 0 else "follow_up"].append({
+                "ttft_ms": (metrics.time_to_first_token or 0.0) * 1000,
+                "total_ms": metrics.total_time * 1000,
+                "retrieval_ms": stage_ms(metrics.trace, {"store_open", "vector_search", "parent_expand"}),
+            })
+        if conversation:
+            warm.join()
+        hits += cache.hits
+
+    result = {"reused_follow_ups": hits}
+    for kind, samples in rows.items():
+        for metric in ("ttft_ms", "total_ms", "retrieval_ms"):
+            result[f"{kind}.{metric}_mean"] = statistics.fmean(sample[metric] for sample in samples)
+    print(f"{name:<34} {result['first.ttft_ms_mean']:>10.0f} {result['follow_up.ttft_ms_mean']:>10.0f} "
+          f"{result['follow_up.retrieval_ms_mean']:>10.1f} {hits:>5}/{len(rows['follow_up'])}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-files", type=int, default=4, help="PDFs of data/ to ingest.")
+    parser.add_argument("--think-time", type=float, default=3.0, help="Seconds between an answer and the next question.")
+    parser.add_argument("--load-latency", type=float, default=4.0, help="Stub model load time (s).")
+    parser.add_argument("--stub-keep-alive", type=float, default=2.0,
+                        help="Stub idle unload delay when a request sets no keep_alive (s).")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.005,
+                        help="Stub prompt evaluation time per token (s).")
+    parser.add_argument("--reuse-similarity", type=float, default=None,
+                        help="conversation.REUSE_SIMILARITY for this run.")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(REPO_DIR, "data", "*.pdf")))[:args.max_files]
+    workdir = tempfile.mkdtemp(prefix="bench_conversation_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for path in files:
+        shutil.copy(path, os.path.join(workdir, "data"))
+
+    stub = ollama_stub(load_latency=args.load_latency, default_keep_alive=args.stub_keep_alive,
+                       prompt_token_latency=args.prompt_token_latency, first_token_latency=0.05,
+                       prefix_cache=True, semantic_embeddings=True)
+    cwd = os.getcwd()
+    metrics = {}
+    try:
+        with stub as server:
+            # Must be set before the pipeline modules are imported.
+            os.environ["OLLAMA_BASE_URL"] = server.url
+            os.chdir(workdir)
+            sys.path.insert(0, REPO_DIR)
+            import populate_database
+            import rag
+            from langchain_community.llms.ollama import Ollama
+
+            print(f"👉 Ingesting {len(files)} PDFs")
+            populate_database.update_database()
+
+            print(f"\n{'':<34} {'ttft 1st':>10} {'ttft next':>10} {'retr next':>10} {'reuse':>11}")
+            get_llm = rag.get_llm
+            # Before: no keep_alive, so the stub unloads the model between turns.
+            rag.get_llm = lambda model: Ollama(model=model, base_url=server.url)
+            metrics["stateless"] = run_mode("stateless, default keep-alive", CONVERSATIONS, args.think_time, False)
+            rag.get_llm = get_llm
+            metrics["conversation"] = run_mode("conversation + warm-up", CONVERSATIONS, args.think_time, True,
+                                            args.reuse_similarity)
+
+            from resources import registry
+            registry.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "metrics": metrics}
+    output = args.output or os.path.join(RESULTS_DIR, f"conversation-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 {output}")
+
+
+if __name__ == "__main__":
+    main()
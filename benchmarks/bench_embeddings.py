@@ -0,0 +1,34 @@
+# Compare embedding throughput for several batch sizes / worker counts
+# against the local Ollama stub.
+#   python -m benchmarks.bench_embeddings --texts 500 --latency 0.02
+
+import argparse
+import time
+
+from benchmarks.stub_servers import ollama_stub
+from get_embedding_function import get_embedding_function
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub latency per request (s).")
+    args = parser.parse_args()
+
+    texts = [f"patent chunk number {i}" for i in range(args.texts)]
+
+    with ollama_stub(embed_latency=args.latency) as server:
+        for batch_size, workers in [(args.texts, 1), (32, 1), (32, 4), (32, 8)]:
+            embeddings = get_embedding_function(
+                base_url=server.url, batch_size=batch_size, max_workers=workers, use_cache=False
+            )
+            start = time.perf_counter()
+            embeddings.embed_documents(texts)
+            elapsed = time.perf_counter() - start
+            stats = embeddings.stats.as_dict()
+            print(f"batch={batch_size:<5} workers={workers:<2} {elapsed:6.2f}s "
+                  f"{stats['throughput_texts_per_s']:8.1f} texts/s retries={stats['retries']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Wall time of the former serial PatentsView + Lens loops against the
+# concurrent, rate-limited fetch engine, both talking to a local mock API.
+#   python -m benchmarks.bench_fetch --pv-pages 5 --lens-count 200 --latency 0.3
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from time import sleep
+
+import requests
+
+from benchmarks.stub_servers import patent_api_stub
+from http_cache import ResponseCache
+from patent_fetch import ApiClient, search_both
+
+
+def serial_fetch(url, keyword, pv_pages, lens_count, delay):
+    # Same request pattern as the original PatentFetcher / LensFetcher loops.
+    headers = {"Content-Type": "application/json"}
+    pv, lens = [], []
+    for page in range(1, pv_pages + 1):
+        query = {"q": {"_text_any": {"patent_title": keyword}}, "o": {"page": page, "per_page": 100}}
+        response = requests.post(url, headers=headers, data=json.dumps(query), timeout=20)
+        if response.status_code != 200:
+            break
+        patents = response.json().get("patents", [])
+        if not patents:
+            break
+        pv.extend(patents)
+        sleep(delay)
+    for offset in range(0, lens_count, 25):
+        response = requests.post(url, headers=headers, json={"from": offset, "size": 25})
+        if response.status_code != 200:
+            break
+        data = response.json().get("data", [])
+        if not data:
+            break
+        lens.extend(data)
+    return pv, lens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pv-pages", type=int, default=5)
+    parser.add_argument("--lens-count", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock API latency per request (s).")
+    parser.add_argument("--delay", type=float, default=0.6, help="PatentsView delay between pages (s).")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer 429 every N requests.")
+    args = parser.parse_args()
+
+    with patent_api_stub(latency=args.latency, total_records=1000) as server:
+        start = time.perf_counter()
+        pv, lens = serial_fetch(server.url, "solar", args.pv_pages, args.lens_count, args.delay)
+        serial_time = time.perf_counter() - start
+        print(f"serial : {serial_time:6.2f}s  PatentsView={len(pv)} Lens={len(lens)}")
+
+    with patent_api_stub(latency=args.latency, total_records=1000,
+                         throttle_every=args.throttle_every) as server:
+        pv_client = ApiClient("PatentsView", server.url, {}, rate=1 / args.delay, burst=3, max_in_flight=4)
+        lens_client = ApiClient("The Lens", server.url, {}, rate=2, burst=4, max_in_flight=4)
+        start = time.perf_counter()
+        pv, lens, errors = search_both(pv_client, lens_client, "solar", args.pv_pages, args.lens_count)
+        engine_time = time.perf_counter() - start
+        print(f"engine : {engine_time:6.2f}s  PatentsView={len(pv)} Lens={len(lens)} "
+              f"errors={len(errors)} requests={len(server.calls)}")
+
+    print(f"speedup: {serial_time / engine_time:.1f}x")
+
+    # Same search twice through the response cache: the second run costs no request.
+    with patent_api_stub(latency=args.latency, total_records=1000) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, "http.sqlite3"))
+        pv_client = ApiClient("PatentsView", server.url, {}, rate=1 / args.delay, burst=3,
+                              max_in_flight=4, cache=cache)
+        lens_client = ApiClient("The Lens", server.url, {}, rate=2, burst=4, max_in_flight=4, cache=cache)
+        for run in ("cold", "warm"):
+            before = len(server.calls)
+            start = time.perf_counter()
+            search_both(pv_client, lens_client, "Solar", args.pv_pages, args.lens_count)
+            print(f"cached {run}: {time.perf_counter() - start:6.2f}s  requests={len(server.calls) - before}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
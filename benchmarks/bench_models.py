@@ -0,0 +1,164 @@
+# Ollama model lifecycle (model_manager.py) against the stub:
+#  - cold start: time to first token of the first question asked
+#    `--think-time` seconds after the app starts, with and without the
+#    models being preloaded at start;
+#  - residency: `--workers` threads sending requests to three models at
+#    once, unmanaged and through the manager with MAX_RESIDENT_MODELS slots:
+#    peak number of loaded models, loads, and wall time.
+#   python -m benchmarks.bench_models --load-latency 4 --max-resident 2
+#
+# Runs in a temporary working directory.
+
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_servers import ollama_stub
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+MODELS = ["mistral", "llama3.2", "mxbai-embed-large:latest"]
+
+
+def reset_stub(server):
+    # Nothing loaded, as after an Ollama restart or a long idle period.
+    with server.handler.lock:
+        server.state["loaded"].clear()
+        server.state["prompts"].clear()
+        server.state.update(loads=0, unloads=0, peak_loaded=0)
+
+
+def cold_start(name, server, think_time, preload):
+    import rag
+    from answer_cache import bump_collection_version
+    from get_embedding_function import EMBEDDING_MODEL
+    from model_manager import get_model_manager
+    from resources import registry
+    from streaming import StreamMetrics
+
+    reset_stub(server)
+    registry.evict(("model_manager",), force=True)
+    bump_collection_version("chroma")
+    manager = get_model_manager()
+    if preload:
+        manager.preload_in_background([rag.LLM_MODEL], [EMBEDDING_MODEL])
+    # The user opens the app and types a question.
+    time.sleep(think_time)
+    metrics = StreamMetrics()
+    # A question of its own, so its embedding is not in the cache.
+    "".join(rag.query_rag_stream(f"What are the main types of welding processes? ({name})", "chroma", metrics))
+    row = {"ttft_ms": (metrics.time_to_first_token or 0.0) * 1000, "loads": server.state["loads"]}
+    print(f"{name:<28} {row['ttft_ms']:>10.0f} {row['loads']:>6}")
+    return row
+
+
+def residency(name, server, workers, requests_per_worker, max_resident=None):
+    from get_embedding_function import OLLAMA_KEEP_ALIVE
+    from model_manager import ModelManager
+
+    reset_stub(server)
+    manager = ModelManager(base_url=server.url, max_resident=max_resident) if max_resident else None
+    session = requests.Session()
+
+    def call(model):
+        if "embed" in model:
+            payload = {"model": model, "input": ["a patent abstract"], "keep_alive": OLLAMA_KEEP_ALIVE}
+            path = "/api/embed"
+        else:
+            payload = {"model": model, "prompt": "Summarise the claims.", "stream": False,
+                       "keep_alive": OLLAMA_KEEP_ALIVE}
+            path = "/api/generate"
+        session.post(f"{server.url}{path}", json=payload, timeout=120).raise_for_status()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(requests_per_worker):
+            model = rng.choice(MODELS)
+            if manager is None:
+                call(model)
+            else:
+                with manager.use(model, embedding="embed" in model):
+                    call(model)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, range(workers)))
+    row = {
+        "wall_seconds": time.perf_counter() - start,
+        "peak_loaded": server.state["peak_loaded"],
+        "loads": server.state["loads"],
+        "unloads": server.state["unloads"],
+    }
+    print(f"{name:<28} {row['peak_loaded']:>6} {row['loads']:>6} {row['unloads']:>8} {row['wall_seconds']:>8.1f}")
+    if manager is not None:
+        manager.close()
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-files", type=int, default=2, help="PDFs of data/ to ingest.")
+    parser.add_argument("--think-time", type=float, default=6.0,
+                        help="Seconds between the app start and the first question.")
+    parser.add_argument("--load-latency", type=float, default=4.0, help="Stub model load time (s).")
+    parser.add_argument("--max-resident", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=6, help="Requests per worker.")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(REPO_DIR, "data", "*.pdf")))[:args.max_files]
+    workdir = tempfile.mkdtemp(prefix="bench_models_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for path in files:
+        shutil.copy(path, os.path.join(workdir, "data"))
+
+    stub = ollama_stub(load_latency=args.load_latency, first_token_latency=0.05, token_latency=0.01)
+    cwd = os.getcwd()
+    metrics = {}
+    try:
+        with stub as server:
+            # Must be set before the pipeline modules are imported.
+            os.environ["OLLAMA_BASE_URL"] = server.url
+            os.chdir(workdir)
+            sys.path.insert(0, REPO_DIR)
+            import populate_database
+
+            print(f"👉 Ingesting {len(files)} PDFs")
+            populate_database.update_database()
+
+            print(f"\n{'cold start':<28} {'ttft ms':>10} {'loads':>6}")
+            metrics["cold.no_preload"] = cold_start("no preload", server, args.think_time, False)
+            metrics["cold.preload"] = cold_start("preloaded at start", server, args.think_time, True)
+
+            print(f"\n{'residency':<28} {'peak':>6} {'loads':>6} {'unloads':>8} {'wall s':>8}")
+            metrics["residency.unmanaged"] = residency("unmanaged", server, args.workers, args.requests)
+            metrics["residency.managed"] = residency(f"manager, {args.max_resident} slots", server, args.workers,
+                                                     args.requests, args.max_resident)
+
+            from resources import registry
+            registry.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "metrics": metrics}
+    output = args.output or os.path.join(RESULTS_DIR, f"models-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 {output}")
+
+
+if __name__ == "__main__":
+    main()
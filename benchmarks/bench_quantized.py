@@ -0,0 +1,133 @@
+# Recall and latency of the quantized memory-mapped backend against Chroma
+# (HNSW), on a synthetic clustered collection: recall@k against an exact
+# float search, query latency per re-rank factor, and disk/scan footprint.
+#   python -m benchmarks.bench_quantized --size 50000 --rerank-factors 1 4 10
+#
+# Runs in a temporary directory; no Ollama needed (vectors are generated).
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stub_servers import EMBEDDING_DIM
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+CLUSTERS = 200
+# Chunks are spread over this many files; filtered queries keep one.
+SYNTHETIC_FILES = 20
+
+
+def clustered_vectors(count, rng, dim=EMBEDDING_DIM):
+    # Topics (cluster centres) plus per-chunk noise, closer to real embeddings
+    # than uniformly random vectors.
+    centres = rng.standard_normal((CLUSTERS, dim)).astype(np.float32)
+    labels = rng.integers(0, CLUSTERS, size=count)
+    vectors = centres[labels] + 0.8 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill_chroma(directory, count, rng, batch_size=5000):
+    from langchain_community.vectorstores import Chroma
+    from resources import get_embeddings
+
+    db = Chroma(persist_directory=directory, embedding_function=get_embeddings())
+    vectors = clustered_vectors(count, rng)
+    for offset in range(0, count, batch_size):
+        stop = min(count, offset + batch_size)
+        db._collection.add(
+            ids=[f"synthetic:{i}:0" for i in range(offset, stop)],
+            embeddings=vectors[offset:stop].tolist(),
+            documents=[f"Synthetic chunk {i}" for i in range(offset, stop)],
+            metadatas=[{"source": "synthetic", "page": i, "file": f"synthetic{i % SYNTHETIC_FILES}.pdf"}
+                       for i in range(offset, stop)],
+        )
+    return db
+
+
+def filtered_p50_ms(search, queries, k):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query.tolist(), k=k, filter={"file": "synthetic0.pdf"})
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples)[len(samples) // 2]
+
+
+def directory_mb(path, names):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in names
+               if os.path.exists(os.path.join(path, name))) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factors", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--quantizations", nargs="+", default=["int8", "pq"], choices=["int8", "pq"])
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_quantized_")
+    cwd = os.getcwd()
+    metrics = {}
+    try:
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_DIR)
+        import migrate_vectors
+        from quantized_index import QUANTIZED_DIR, QuantizedStore
+        from resources import get_embeddings, registry
+
+        print(f"👉 Filling Chroma with {args.size} vectors")
+        start = time.perf_counter()
+        fill_chroma("store", args.size, np.random.default_rng(0))
+        metrics["chroma.fill_seconds"] = time.perf_counter() - start
+
+        for quantization in args.quantizations:
+            start = time.perf_counter()
+            chroma = migrate_vectors.migrate("store", quantization=quantization)
+            metrics[f"{quantization}.migrate_seconds"] = time.perf_counter() - start
+            path = os.path.join("store", QUANTIZED_DIR)
+            store = QuantizedStore(path, get_embeddings())
+            results = migrate_vectors.evaluate(chroma, store, args.queries, args.k, args.rerank_factors)
+            migrate_vectors.print_evaluation(results, store, args.k)
+            for name, row in results.items():
+                prefix = "chroma" if name == "chroma" else name.replace(" ", ".")
+                for metric, value in row.items():
+                    metrics[f"{prefix}.{metric}"] = value
+            # One file out of SYNTHETIC_FILES through a metadata filter.
+            queries = migrate_vectors.sample_queries(store, args.queries)
+            metrics["chroma.filtered.p50_ms"] = filtered_p50_ms(
+                chroma.similarity_search_by_vector_with_relevance_scores, queries, args.k)
+            metrics[f"{quantization}.filtered.p50_ms"] = filtered_p50_ms(
+                store.similarity_search_by_vector_with_relevance_scores, queries, args.k)
+            print(f"Filtered (1/{SYNTHETIC_FILES} of the rows) p50: chroma {metrics['chroma.filtered.p50_ms']:.2f} ms, "
+                  f"{quantization} {metrics[f'{quantization}.filtered.p50_ms']:.2f} ms")
+            metrics[f"{quantization}.scan_bytes_per_vector"] = store.index.memory_bytes_per_vector()
+            metrics[f"{quantization}.codes_mb"] = directory_mb(path, ["codes.bin", "scales.bin", "codebook.npy"])
+            metrics[f"{quantization}.floats_mb"] = directory_mb(path, ["floats.bin"])
+            store.close()
+        metrics["float32.scan_bytes_per_vector"] = EMBEDDING_DIM * 4
+        registry.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "metrics": metrics}
+    output = args.output or os.path.join(RESULTS_DIR, f"quantized-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 {output}")
+
+
+if __name__ == "__main__":
+    main()
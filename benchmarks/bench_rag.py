@@ -0,0 +1,269 @@
+# Offline RAG performance suite: ingestion throughput of populate_database,
+# retrieval latency percentiles at growing collection sizes, end-to-end
+# query_rag latency and peak RSS, against the local Ollama stub. Results are
+# written as JSON and compared with a saved baseline.
+#   python -m benchmarks.bench_rag --sizes 1000 5000 20000 --save-baseline
+#   python -m benchmarks.bench_rag --baseline benchmarks/baseline.json
+#
+# Everything runs in a temporary working directory (copy of data/), so the
+# real chroma/ and cache/ directories are never touched.
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from benchmarks.stub_servers import EMBEDDING_DIM, ollama_stub
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+DEFAULT_TOLERANCE = 0.15
+# Latency changes smaller than this are noise, whatever their relative size.
+MIN_DELTA_MS = 2.0
+# Synthetic chunks are spread over this many files; filtered queries keep one.
+SYNTHETIC_FILES = 20
+
+QUESTIONS = [
+    "What are the main types of welding processes?",
+    "How do photovoltaic solar panels convert light into electricity?",
+    "Which materials are used in 3D printing?",
+    "What are the benefits of renewable energies?",
+    "How many planets are in the solar system?",
+    "What is the economic impact of tourism?",
+    "Which patents describe solar cell efficiency improvements?",
+    "How is football governed internationally?",
+]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(samples):
+    values = sorted(samples)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    return {
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "mean_ms": statistics.fmean(values) * 1000,
+    }
+
+
+# ------------ Stages ---------------
+
+def bench_ingestion(files):
+    import populate_database
+
+    pages = 0
+    size = 0
+    for path in files:
+        with fitz.open(path) as doc:
+            pages += doc.page_count
+        size += os.path.getsize(path)
+
+    start = time.perf_counter()
+    populate_database.update_database()
+    elapsed = time.perf_counter() - start
+
+    from resources import get_vector_store
+    chunks = get_vector_store(populate_database.CHROMA_PATH)._collection.count()
+    return {
+        "ingest.files": len(files),
+        "ingest.pages": pages,
+        "ingest.chunks": chunks,
+        "ingest.seconds": elapsed,
+        "ingest.pages_per_s": pages / elapsed,
+        "ingest.chunks_per_s": chunks / elapsed,
+        "ingest.mb_per_s": size / (1024 * 1024) / elapsed,
+    }
+
+
+def fill_collection(db, count, start, rng, batch_size=5000):
+    # Synthetic chunks with random unit vectors; only the search cost is measured.
+    for offset in range(start, count, batch_size):
+        stop = min(count, offset + batch_size)
+        vectors = rng.standard_normal((stop - offset, EMBEDDING_DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        db._collection.add(
+            ids=[f"synthetic:{i}:0" for i in range(offset, stop)],
+            embeddings=vectors.tolist(),
+            documents=[f"Synthetic chunk {i} about patents, energy and materials." for i in range(offset, stop)],
+            metadatas=[{"source": "synthetic", "page": i, "file": f"synthetic{i % SYNTHETIC_FILES}.pdf"}
+                       for i in range(offset, stop)],
+        )
+
+
+def bench_retrieval(sizes, queries, k):
+    from resources import get_vector_store
+
+    db = get_vector_store("bench_retrieval")
+    rng = np.random.default_rng(0)
+    metrics = {}
+    filled = 0
+    for size in sorted(sizes):
+        fill_collection(db, size, filled, rng)
+        filled = size
+        db.similarity_search_with_score("warm up", k=k)
+
+        # Unfiltered, then restricted to one file with a metadata filter.
+        for label, where in (("", None), (".filtered", {"file": "synthetic0.pdf"})):
+            samples = []
+            for i in range(queries):
+                question = f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+                start = time.perf_counter()
+                db.similarity_search_with_score(question, k=k, filter=where)
+                samples.append(time.perf_counter() - start)
+            for name, value in percentiles(samples).items():
+                metrics[f"retrieval.{size}{label}.{name}"] = value
+    return metrics
+
+
+def bench_query_rag(queries):
+    try:
+        from rag import query_rag
+    except ImportError as e:
+        print(f"⚠️ query_rag skipped: {e}")
+        return {}
+
+    samples = []
+    for i in range(queries):
+        question = f"{QUESTIONS[i % len(QUESTIONS)]} (run {i})"
+        start = time.perf_counter()
+        query_rag(question, "chroma")
+        samples.append(time.perf_counter() - start)
+    return {f"query_rag.{name}": value for name, value in percentiles(samples).items()}
+
+
+# ------------ Baseline comparison ---------------
+
+def higher_is_better(name):
+    return name.endswith("_per_s")
+
+
+def compare(metrics, baseline, tolerance, min_delta_ms=MIN_DELTA_MS):
+    # Returns [(name, baseline, current, change, regressed)] for the metrics
+    # present in both runs. Counts (files, pages, chunks) are not compared.
+    rows = []
+    for name, current in sorted(metrics.items()):
+        if name not in baseline or not (higher_is_better(name) or name.endswith(("_ms", "_mb", ".seconds"))):
+            continue
+        previous = baseline[name]
+        if not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = change < -tolerance if higher_is_better(name) else change > tolerance
+        if name.endswith("_ms") and current - previous < min_delta_ms:
+            regressed = False
+        rows.append((name, previous, current, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000],
+                        help="Collection sizes for the retrieval latency.")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per retrieval size.")
+    parser.add_argument("--rag-queries", type=int, default=10, help="End-to-end query_rag calls.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-files", type=int, default=None, help="Only ingest the first N PDFs of data/.")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Stub latency per embedding request (s).")
+    parser.add_argument("--first-token-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative change above which a metric counts as a regression.")
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_MS)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(REPO_DIR, "data", "*.pdf")))[:args.max_files]
+    workdir = tempfile.mkdtemp(prefix="bench_rag_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for path in files:
+        shutil.copy(path, os.path.join(workdir, "data"))
+
+    stub = ollama_stub(embed_latency=args.embed_latency, first_token_latency=args.first_token_latency,
+                       token_latency=args.token_latency, answer_tokens=args.answer_tokens)
+    cwd = os.getcwd()
+    metrics = {}
+    try:
+        with stub as server:
+            # Must be set before the pipeline modules are imported.
+            os.environ["OLLAMA_BASE_URL"] = server.url
+            os.chdir(workdir)
+            sys.path.insert(0, REPO_DIR)
+            local_files = sorted(glob.glob(os.path.join("data", "*.pdf")))
+
+            print(f"👉 Ingesting {len(local_files)} PDFs")
+            metrics.update(bench_ingestion(local_files))
+            metrics["ingest.peak_rss_mb"] = peak_rss_mb()
+
+            print(f"👉 Retrieval at sizes {args.sizes}")
+            metrics.update(bench_retrieval(args.sizes, args.queries, args.k))
+            metrics["retrieval.peak_rss_mb"] = peak_rss_mb()
+
+            print(f"👉 {args.rag_queries} query_rag calls")
+            metrics.update(bench_query_rag(args.rag_queries))
+            metrics["peak_rss_mb"] = peak_rss_mb()
+
+            from resources import registry
+            registry.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "metrics": metrics,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"rag-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    for name, value in sorted(metrics.items()):
+        print(f"{name:<40} {value:12.2f}")
+    print(f"📄 {output}")
+
+    exit_code = 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"📌 Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        print(f"\nComparison with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        for name, previous, current, change, regressed in compare(metrics, baseline, args.tolerance, args.min_delta_ms):
+            flag = "❌ regression" if regressed else ""
+            print(f"{name:<40} {previous:12.2f} → {current:12.2f} {change:+7.1%} {flag}")
+            if regressed:
+                exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
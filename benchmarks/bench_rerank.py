@@ -0,0 +1,150 @@
+# Net end-to-end effect of the cross-encoder re-ranking stage on query_rag:
+# re-ranking costs CPU time but sends fewer chunks to the LLM, so prompt
+# evaluation (the stub's `prompt_token_latency`) gets shorter.
+#   python -m benchmarks.bench_rerank --prompt-token-latency 0.01
+#
+# Uses the real cross-encoder when sentence-transformers is installed, else
+# (or with --scorer lexical) a word-overlap scorer costing --pair-latency
+# seconds per pair, in the range of a MiniLM cross-encoder on one CPU core.
+# Runs in a temporary working directory against the Ollama stub.
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_servers import ollama_stub
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+QUESTIONS = [
+    "What are the main types of welding processes?",
+    "Which materials are used in 3D printing?",
+    "What are the benefits of renewable energies?",
+    "What is the economic impact of tourism?",
+    "How do photovoltaic solar panels convert light into electricity?",
+    "How many planets are in the solar system?",
+]
+
+
+def lexical_scorer(pair_latency):
+    def score(pairs, batch_size):
+        time.sleep(pair_latency * len(pairs))
+        scores = []
+        for query, text in pairs:
+            query_words = set(re.findall(r"\w{3,}", query.lower()))
+            text_words = set(re.findall(r"\w{3,}", text.lower()))
+            scores.append(4.0 * len(query_words & text_words) / max(1, len(query_words)) - 2.0)
+        return scores
+    return score
+
+
+def run_pass(name, questions, reranker):
+    import rag
+    from answer_cache import bump_collection_version
+    from streaming import StreamMetrics
+
+    # A new collection version, so no answer comes from the answer cache.
+    bump_collection_version("chroma")
+    rag.get_reranker = lambda: reranker
+    totals, ttfts, context_tokens, rerank_ms = [], [], [], []
+    for question in questions:
+        metrics = StreamMetrics()
+        "".join(rag.query_rag_stream(question, "chroma", metrics))
+        totals.append(metrics.total_time * 1000)
+        ttfts.append((metrics.time_to_first_token or 0.0) * 1000)
+        context_tokens.append((metrics.context_report or {}).get("context_tokens", 0))
+        rerank_ms.append(sum(ms for stage, ms in metrics.trace.breakdown() if stage.strip() == "rerank"))
+    row = {
+        "total_p50_ms": statistics.median(totals),
+        "total_mean_ms": statistics.fmean(totals),
+        "ttft_mean_ms": statistics.fmean(ttfts),
+        "rerank_mean_ms": statistics.fmean(rerank_ms),
+        "context_tokens_mean": statistics.fmean(context_tokens),
+    }
+    print(f"{name:<24} {row['total_mean_ms']:>10.0f} {row['ttft_mean_ms']:>10.0f} "
+          f"{row['rerank_mean_ms']:>10.0f} {row['context_tokens_mean']:>10.0f}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-files", type=int, default=4, help="PDFs of data/ to ingest.")
+    parser.add_argument("--queries", type=int, default=12)
+    parser.add_argument("--scorer", choices=["auto", "cross-encoder", "lexical"], default="auto")
+    parser.add_argument("--pair-latency", type=float, default=0.003, help="Lexical scorer cost per pair (s).")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.01,
+                        help="Stub prompt evaluation time per token (s).")
+    parser.add_argument("--first-token-latency", type=float, default=0.05)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--budget", type=float, default=None, help="Re-rank latency budget (s).")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(REPO_DIR, "data", "*.pdf")))[:args.max_files]
+    workdir = tempfile.mkdtemp(prefix="bench_rerank_")
+    os.makedirs(os.path.join(workdir, "data"))
+    for path in files:
+        shutil.copy(path, os.path.join(workdir, "data"))
+
+    stub = ollama_stub(first_token_latency=args.first_token_latency, prompt_token_latency=args.prompt_token_latency)
+    cwd = os.getcwd()
+    metrics = {}
+    try:
+        with stub as server:
+            # Must be set before the pipeline modules are imported.
+            os.environ["OLLAMA_BASE_URL"] = server.url
+            os.chdir(workdir)
+            sys.path.insert(0, REPO_DIR)
+            import populate_database
+            from reranker import RERANK_BUDGET_SECONDS, RERANK_MODEL, Reranker, RerankScoreCache, load_cross_encoder
+
+            print(f"👉 Ingesting {len(files)} PDFs")
+            populate_database.update_database()
+
+            scorer, scorer_name = None, "lexical"
+            if args.scorer != "lexical":
+                scorer, scorer_name = load_cross_encoder(RERANK_MODEL), RERANK_MODEL
+                if scorer is None and args.scorer == "cross-encoder":
+                    sys.exit(1)
+            if scorer is None:
+                scorer, scorer_name = lexical_scorer(args.pair_latency), "lexical"
+            budget = args.budget if args.budget is not None else RERANK_BUDGET_SECONDS
+
+            print(f"\nScorer: {scorer_name}, budget {budget}s")
+            print(f"{'':<24} {'total ms':>10} {'ttft ms':>10} {'rerank ms':>10} {'ctx tokens':>10}")
+            questions = [f"{QUESTIONS[i % len(QUESTIONS)]} ({i})" for i in range(args.queries)]
+            metrics["baseline"] = run_pass("no re-ranking", questions, None)
+            for batch_size in args.batch_sizes:
+                cache = RerankScoreCache(os.path.join("cache", f"rerank_{batch_size}.sqlite3"))
+                reranker = Reranker(scorer, scorer_name, cache, batch_size=batch_size, budget_seconds=budget)
+                metrics[f"rerank.batch{batch_size}"] = run_pass(f"re-rank, batch {batch_size}", questions, reranker)
+                # Same questions again: the scores come from the cache.
+                metrics[f"rerank.batch{batch_size}.cached"] = run_pass(
+                    f"re-rank, batch {batch_size}, cached", questions, reranker)
+                cache.close()
+
+            from resources import registry
+            registry.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args), "metrics": metrics}
+    output = args.output or os.path.join(RESULTS_DIR, f"rerank-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📄 {output}")
+
+
+if __name__ == "__main__":
+    main()
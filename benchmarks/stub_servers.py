@@ -0,0 +1,309 @@
+# Local stand-ins for the services the RAG pipeline talks to, so the
+# pipeline can be exercised offline with a configurable latency.
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+EMBEDDING_DIM = 1024
+
+
+def fake_vector(text, dim=EMBEDDING_DIM):
+    # Deterministic pseudo-embedding: the same text always maps to the same vector.
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    values = []
+    while len(values) < dim:
+        seed = hashlib.sha256(seed).digest()
+        values.extend((b - 127.5) / 127.5 for b in seed)
+    return values[:dim]
+
+
+def word_vector(text, dim=EMBEDDING_DIM):
+    # Sum of the fake vectors of the words: texts sharing words get similar
+    # vectors, which the conversation benchmark needs.
+    total = [0.0] * dim
+    for word in set(re.findall(r"\w{3,}", text.lower())):
+        for i, value in enumerate(fake_vector(word, dim)):
+            total[i] += value
+    return total
+
+
+def parse_keep_alive(value, default):
+    # Ollama durations: a number of seconds, or a string with a unit ("30s",
+    # "5m", "1h"), as Go's time.ParseDuration reads it: a string without one
+    # ("-1", "3600") is rejected, only "0" may omit it. Negative keeps the
+    # model loaded. Raises ValueError, answered with a 400 like Ollama does.
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if text == "0":
+        return 0.0
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh])", text)
+    if match is None:
+        raise ValueError(f'time: missing unit in duration "{text}"' if re.fullmatch(r"-?[\d.]+", text)
+                         else f'time: invalid duration "{text}"')
+    return float(match.group(1)) * {"s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+def ollama_name(model):
+    return model if ":" in model else f"{model}:latest"
+
+
+def common_prefix_length(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class StubServer:
+    def __init__(self, handler_class, **settings):
+        handler = type(handler_class.__name__, (handler_class,), {
+            "settings": settings, "calls": [], "lock": threading.Lock(),
+            "state": {"loaded": {}, "prompts": {}, "loads": 0, "unloads": 0, "peak_loaded": 0},
+        })
+        self.handler = handler
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def calls(self):
+        return self.handler.calls
+
+    @property
+    def state(self):
+        return self.handler.state
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    settings = {}
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OllamaStubHandler(JsonHandler):
+    # Implements the subset of the Ollama HTTP API used by langchain:
+    # /api/embeddings (one prompt), /api/embed (a list of inputs) and
+    # /api/generate, /api/chat (NDJSON token stream). Generation waits
+    # `first_token_latency` plus `prompt_token_latency` per prompt token
+    # (prompt evaluation), then `token_latency` per token, for
+    # `answer_tokens` tokens.
+    # Optional: `load_latency` when the model is not loaded (first use, or
+    # idle longer than the request's keep_alive, `default_keep_alive`
+    # seconds if unset), `prefix_cache` to only charge the prompt tokens after
+    # the prefix shared with the model's previous prompt, as Ollama reuses
+    # its KV cache, and `semantic_embeddings` for word_vector embeddings.
+    # Model management: GET /api/tags lists `models`, GET /api/ps the loaded
+    # ones (`model_size_mb` each); an empty prompt or input only loads a
+    # model and keep_alive 0 unloads it. state["loads"], ["unloads"] and
+    # ["peak_loaded"] count what happened.
+
+    def loaded_models(self, now):
+        # Called with the lock held.
+        return {model: expires for model, expires in self.state["loaded"].items() if expires < 0 or expires > now}
+
+    def load_model(self, payload):
+        # Returns the load delay and marks the model loaded until its keep_alive expires.
+        model = ollama_name(payload.get("model") or "")
+        now = time.time()
+        keep_alive = parse_keep_alive(payload.get("keep_alive"), self.settings.get("default_keep_alive", 300))
+        with self.lock:
+            loaded = model in self.loaded_models(now)
+            if keep_alive == 0:
+                self.state["loaded"].pop(model, None)
+                self.state["prompts"].pop(model, None)
+                self.state["unloads"] += loaded
+                return 0.0
+            self.state["loaded"][model] = -1 if keep_alive < 0 else now + keep_alive
+            if not loaded:
+                self.state["prompts"].pop(model, None)
+                self.state["loads"] += 1
+                self.state["peak_loaded"] = max(self.state["peak_loaded"], len(self.loaded_models(now)))
+        return 0.0 if loaded else self.settings.get("load_latency", 0.0)
+
+    def do_GET(self):
+        now = time.time()
+        size = self.settings.get("model_size_mb", 4000) * 2**20
+        if self.path == "/api/tags":
+            models = self.settings.get("models", ["mistral:latest", "llama3.2:latest", "mxbai-embed-large:latest"])
+            self.send_json({"models": [{"name": ollama_name(model), "model": ollama_name(model), "size": size}
+                                       for model in models]})
+        elif self.path == "/api/ps":
+            with self.lock:
+                loaded = self.loaded_models(now)
+            self.send_json({"models": [{
+                "name": model, "model": model, "size": size, "size_vram": 0,
+                "expires_at": "2318-01-01T00:00:00Z" if expires < 0
+                else time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(expires)),
+            } for model, expires in loaded.items()]})
+        else:
+            self.send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+    def prompt_delay(self, model, prompt):
+        prompt_tokens = (len(prompt) + 3) // 4
+        if self.settings.get("prefix_cache"):
+            with self.lock:
+                previous = self.state["prompts"].get(model, "")
+                self.state["prompts"][model] = prompt
+            prompt_tokens -= common_prefix_length(previous, prompt) // 4
+        return self.settings.get("prompt_token_latency", 0.0) * prompt_tokens
+
+    def stream_tokens(self, payload, chat=False):
+        tokens = self.settings.get("answer_tokens", 20)
+        num_predict = (payload.get("options") or {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            tokens = min(tokens, num_predict)
+        streaming = payload.get("stream", True)
+        words = [f"token{i} " for i in range(tokens)]
+
+        def message(text, done):
+            line = {"model": payload.get("model"), "created_at": "2024-01-01T00:00:00Z", "done": done}
+            if chat:
+                line["message"] = {"role": "assistant", "content": text}
+            else:
+                line["response"] = text
+            if done:
+                line.update({"done_reason": "stop", "eval_count": tokens, "prompt_eval_count": prompt_tokens})
+            return line
+
+        if chat:
+            prompt = " ".join(str(m.get("content", "")) for m in payload.get("messages", []))
+        else:
+            prompt = payload.get("prompt", "")
+        prompt_tokens = (len(prompt) + 3) // 4
+        time.sleep(self.load_model(payload) + self.settings.get("first_token_latency", 0.0)
+                   + self.prompt_delay(ollama_name(payload.get("model") or ""), prompt))
+        if not streaming:
+            time.sleep(self.settings.get("token_latency", 0.0) * max(0, tokens - 1))
+            self.send_json(message("".join(words), True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.settings.get("token_latency", 0.0))
+            self.wfile.write((json.dumps(message(word, False)) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write((json.dumps(message("", True)) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        payload = self.read_json()
+        self.calls.append((self.path, payload))
+        try:
+            parse_keep_alive(payload.get("keep_alive"), 0)
+        except ValueError as e:
+            self.send_json({"error": str(e)}, status=400)
+            return
+        dim = self.settings.get("dim", EMBEDDING_DIM)
+        embed = word_vector if self.settings.get("semantic_embeddings") else fake_vector
+
+        if self.path == "/api/embeddings":
+            time.sleep(self.load_model(payload) + self.settings.get("embed_latency", 0.0))
+            self.send_json({"embedding": embed(payload.get("prompt", ""), dim)})
+        elif self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            time.sleep(self.load_model(payload) + (self.settings.get("embed_latency", 0.0) if inputs else 0.0))
+            self.send_json({"model": payload.get("model"), "embeddings": [embed(t, dim) for t in inputs]})
+        elif self.path == "/api/generate" and not payload.get("prompt") and "images" not in payload:
+            # Load or unload only.
+            time.sleep(self.load_model(payload))
+            self.send_json({"model": payload.get("model"), "response": "", "done": True,
+                            "done_reason": "unload" if payload.get("keep_alive") == 0 else "load"})
+        elif self.path == "/api/generate":
+            self.stream_tokens(payload)
+        elif self.path == "/api/chat":
+            self.stream_tokens(payload, chat=True)
+        else:
+            self.send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+
+
+def ollama_stub(**settings):
+    return StubServer(OllamaStubHandler, **settings)
+
+
+class PatentApiStubHandler(JsonHandler):
+    # Answers both the PatentsView ("o": {"page", "per_page"}) and the Lens
+    # ("from"/"size") search payloads with synthetic records. Every
+    # `throttle_every`-th request gets a 429 with a Retry-After header.
+
+    _counter_lock = threading.Lock()
+
+    def do_POST(self):
+        payload = self.read_json()
+        with self._counter_lock:
+            self.calls.append((self.path, payload))
+            call_number = len(self.calls)
+
+        time.sleep(self.settings.get("latency", 0.0))
+        throttle_every = self.settings.get("throttle_every")
+        if throttle_every and call_number % throttle_every == 0:
+            self.send_json({"error": "rate limited"}, status=429,
+                           headers={"Retry-After": str(self.settings.get("retry_after", 0.2))})
+            return
+
+        total = self.settings.get("total_records", 500)
+        if "o" in payload:
+            per_page = payload["o"].get("per_page", 100)
+            start = (payload["o"].get("page", 1) - 1) * per_page
+            patents = [{
+                "patent_id": str(10000000 + i),
+                "patent_title": f"Patent {i}",
+                "patent_abstract": f"Abstract of patent {i} about {self.settings.get('topic', 'solar cells')}.",
+                "patent_date": "2020-01-01",
+            } for i in range(start, min(start + per_page, total))]
+            self.send_json({"patents": patents, "count": len(patents), "total_hits": total})
+        else:
+            start = payload.get("from", 0)
+            size = payload.get("size", 25)
+            data = [{
+                "lens_id": f"000-000-{i:06d}",
+                "biblio": {"invention_title": [{"lang": "en", "text": f"Lens patent {i}"}]},
+                "abstract": [{"lang": "en", "text": f"Abstract of Lens patent {i}."}],
+            } for i in range(start, min(start + size, total))]
+            self.send_json({"data": data, "total": total})
+
+
+def patent_api_stub(**settings):
+    return StubServer(PatentApiStubHandler, **settings)
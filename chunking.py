@@ -0,0 +1,105 @@
+import os
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from doc_metadata import METADATA_VERSION
+from pdf_pipeline import iter_chunks, page_chunk_id
+
+
+# Chunking profiles, shared by every ingestion path (populate_database, the
+# upload jobs, patent indexing and the PatentView app) and picked with
+# PATENTBOT_CHUNKING:
+#   parent  (default) small-to-big: 400-character children are embedded and
+#           searched, so a match is scored on a couple of sentences rather
+#           than on a page fragment mixing several topics; the parent section
+#           they were cut from (a PDF page, or a 1600-character part of a long
+#           one, or a whole patent) is kept in parent_store.py and is what
+#           the LLM reads, at most parent_k of them.
+#   flat    800-character chunks with 80 overlap, embedded and sent to the
+#           LLM as they are (the layout of stores built before profiles).
+# The manifest and patent_store record the profile each file or patent was
+# chunked with, so switching profiles re-chunks them on the next populate run.
+CHUNKING_PROFILES = {
+    "flat": {"chunk_size": 800, "chunk_overlap": 80, "parent_max_chars": 0, "parent_k": None},
+    "parent": {"chunk_size": 400, "chunk_overlap": 50, "parent_max_chars": 1600, "parent_k": 3},
+}
+CHUNKING_PROFILE = os.environ.get("PATENTBOT_CHUNKING", "parent")
+
+
+def profile_name():
+    # Read at call time, so benchmarks can switch profiles.
+    if CHUNKING_PROFILE not in CHUNKING_PROFILES:
+        raise ValueError(f"Unknown chunking profile: {CHUNKING_PROFILE}")
+    return CHUNKING_PROFILE
+
+
+def chunking_profile():
+    return CHUNKING_PROFILES[profile_name()]
+
+
+def uses_parents():
+    return bool(chunking_profile()["parent_max_chars"])
+
+
+def parent_limit():
+    # Sections passed to the prompt after expand_to_parents (None: the
+    # retrieved chunks are kept as they are).
+    return chunking_profile()["parent_k"]
+
+
+def index_version():
+    # Written with every indexed patent (patent_store): a change of the
+    # metadata fields or of the profile re-indexes it.
+    return f"{METADATA_VERSION}:{profile_name()}"
+
+
+def get_child_splitter():
+    profile = chunking_profile()
+    return RecursiveCharacterTextSplitter(chunk_size=profile["chunk_size"], chunk_overlap=profile["chunk_overlap"])
+
+
+def get_parent_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=chunking_profile()["parent_max_chars"], chunk_overlap=0)
+
+
+def iter_child_chunks(pages, parents, child_splitter=None, parent_splitter=None):
+    # Splits page by page, like pdf_pipeline.iter_chunks, with the active
+    # profile. With parents, every section cut into several children is added
+    # to `parents` (parent ID -> Document) and its children get its ID as
+    # "parent_id"; a section that fits in one child needs no parent. Chunk IDs
+    # are set here, page by page, as in pdf_pipeline.iter_chunks.
+    child_splitter = child_splitter or get_child_splitter()
+    if not uses_parents():
+        yield from iter_chunks(pages, child_splitter)
+        return
+    parent_max_chars = chunking_profile()["parent_max_chars"]
+    parent_splitter = parent_splitter or get_parent_splitter()
+    for page in pages:
+        if not page.page_content.strip():
+            continue
+        page_id = f"{page.metadata.get('source')}:{page.metadata.get('page')}"
+        if len(page.page_content) <= parent_max_chars:
+            sections = [page]
+        else:
+            sections = parent_splitter.split_documents([page])
+        chunk_index = 0
+        for index, section in enumerate(sections):
+            children = child_splitter.split_documents([section])
+            if len(children) > 1:
+                parent_id = f"{page_id}:s{index}"
+                parents[parent_id] = Document(page_content=section.page_content,
+                                              metadata=dict(section.metadata, id=parent_id))
+                for child in children:
+                    child.metadata["parent_id"] = parent_id
+            for child in children:
+                child.metadata["id"] = page_chunk_id(page, chunk_index)
+                chunk_index += 1
+            yield from children
+
+
+def take_parents(parents, chunks):
+    # Removes from `parents` and returns the parents of a batch of children,
+    # so each one is written with the first batch that needs it.
+    parent_ids = dict.fromkeys(chunk.metadata.get("parent_id") for chunk in chunks)
+    return [parents.pop(parent_id) for parent_id in parent_ids if parent_id in parents]
@@ -0,0 +1,148 @@
+import re
+
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# Tokens of retrieved context allowed in the prompt, per model.
+MODEL_CONTEXT_BUDGETS = {
+    "mistral": 1500,
+    "llama3.2": 1500,
+}
+DEFAULT_CONTEXT_BUDGET = 1500
+
+# Chunks scoring below this fraction of the best score are dropped (for
+# re-ranker scores; rag.min_relative_score). Without a re-ranker the cutoff
+# is retrieval.DENSE_MAX_DISTANCE_RATIO, applied before fusion.
+MIN_RELATIVE_SCORE = 0.5
+# Word 3-gram Jaccard similarity above which two chunks are near-duplicates.
+NEAR_DUPLICATE_THRESHOLD = 0.8
+MAX_OVERLAP_CHARS = 300
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def estimate_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def context_budget(model):
+    return MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET)
+
+
+def shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def merge_overlap(first, second):
+    # Joins two consecutive chunks, dropping the overlap the splitter repeated.
+    limit = min(MAX_OVERLAP_CHARS, len(first), len(second))
+    for size in range(limit, 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return first + "\n" + second
+
+
+def chunk_position(doc):
+    # (source, page, chunk index) from "source:page:chunk" IDs, else None.
+    chunk_id = doc.metadata.get("id") or ""
+    parts = chunk_id.rsplit(":", 2)
+    if len(parts) != 3 or not parts[2].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2])
+
+
+def merge_adjacent(ranked):
+    # ranked: [(text, doc)] best first. Consecutive chunks of the same
+    # source/page are merged into one entry placed at the best rank.
+    by_position = {}
+    for rank, (text, doc) in enumerate(ranked):
+        position = chunk_position(doc)
+        if position is not None:
+            by_position[position] = rank
+
+    merged_into = {}
+    texts = {rank: text for rank, (text, _) in enumerate(ranked)}
+    for (source, page, index), rank in sorted(by_position.items()):
+        previous = by_position.get((source, page, index - 1))
+        if previous is None:
+            continue
+        head = merged_into.get(previous, previous)
+        texts[head] = merge_overlap(texts[head], texts.pop(rank))
+        merged_into[rank] = head
+
+    # Keep each merged group at the rank of its best member.
+    best_rank = {}
+    for rank in range(len(ranked)):
+        head = merged_into.get(rank, rank)
+        best_rank[head] = min(best_rank.get(head, rank), rank)
+    return [texts[head] for head in sorted(texts, key=lambda head: best_rank[head])]
+
+
+def assemble_context(results, model=None, budget=None, min_relative_score=MIN_RELATIVE_SCORE,
+                     near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD, separator=CONTEXT_SEPARATOR):
+    # results: [(Document, score)] best first, higher scores better.
+    # Returns (context_text, report) where report compares the prompt context
+    # with the plain join of every retrieved chunk.
+    if budget is None:
+        budget = context_budget(model)
+    naive_tokens = estimate_tokens(separator.join(doc.page_content for doc, _ in results))
+
+    # 1. Score cutoff relative to the best hit.
+    kept = list(results)
+    if kept and min_relative_score:
+        best = max(score for _, score in kept)
+        if best > 0:
+            kept = [(doc, score) for doc, score in kept if score >= best * min_relative_score]
+
+    # 2. Merge chunks that follow each other in the same page.
+    texts = merge_adjacent([(doc.page_content, doc) for doc, _ in kept])
+
+    # 3. Drop near-identical chunks (e.g. the same abstract from two sources).
+    unique = []
+    unique_shingles = []
+    for text in texts:
+        text_shingles = shingles(text)
+        if any(text in other or jaccard(text_shingles, other_shingles) >= near_duplicate_threshold
+               for other, other_shingles in zip(unique, unique_shingles)):
+            continue
+        unique.append(text)
+        unique_shingles.append(text_shingles)
+
+    # 4. Fill the token budget in rank order; the best chunk is always kept.
+    selected = []
+    used = 0
+    separator_tokens = estimate_tokens(separator)
+    for text in unique:
+        tokens = estimate_tokens(text) + (separator_tokens if selected else 0)
+        if selected and used + tokens > budget:
+            continue
+        selected.append(text)
+        used += tokens
+
+    context_text = separator.join(selected)
+    context_tokens = estimate_tokens(context_text)
+    report = {
+        "retrieved_chunks": len(results),
+        "context_chunks": len(selected),
+        "naive_tokens": naive_tokens,
+        "context_tokens": context_tokens,
+        "tokens_saved": max(0, naive_tokens - context_tokens),
+        "budget": budget,
+    }
+    return context_text, report
@@ -0,0 +1,214 @@
+import os
+import re
+import threading
+
+import numpy as np
+import requests
+from langchain_core.prompts import ChatPromptTemplate
+
+from model_manager import ModelWaitTimeout, model_slot
+from resources import OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
+
+
+# Conversation-aware retrieval for the chatbot (rag.query_conversation_stream):
+# a follow-up question is condensed with the previous turns into a
+# standalone search query, the chunks retrieved for an earlier turn are
+# reused while the conversation stays on the same topic, and the LLM is kept
+# loaded while the user types, with the next prompt already evaluated up to
+# the question on the guess that the follow-up reuses the last context.
+
+# Previous exchanges given to the LLM and used to condense a follow-up.
+CONVERSATION_TURNS = 3
+HISTORY_ANSWER_CHARS = 600
+# Condense follow-ups with the LLM (one extra generation) instead of
+# prepending the previous question.
+CONDENSE_WITH_LLM = os.environ.get("PATENTBOT_CONDENSE_LLM", "0") == "1"
+# Cosine similarity between search queries above which the chunks of an
+# earlier turn are reused instead of searching again.
+REUSE_SIMILARITY = 0.8
+CACHED_TURNS = 5
+# Questions with one of these pronouns refer to earlier turns. Words that
+# standalone questions use too ("this", "il y a", "qu'est-ce que", "also",
+# "même") are left out: condensing such a question would search for the
+# previous topic.
+FOLLOW_UP_WORDS = {
+    "it", "they", "them", "these", "those",
+    "elle", "elles", "ils", "eux", "lui", "ceci",
+}
+# A possessive refers to an earlier turn unless the question names a thing
+# of its own before it ("How does this panel improve its efficiency?").
+FOLLOW_UP_POSSESSIVES = {"its", "their", "sa", "son", "ses", "leur", "leurs"}
+DETERMINERS = {
+    "the", "a", "an", "this", "that",
+    "le", "la", "les", "l", "un", "une", "des", "du", "ce", "cet", "cette", "ces",
+}
+FOLLOW_UP_PATTERN = re.compile(
+    # French demonstratives only refer back with -ci / -là ("celle-ci").
+    r"\b(?:celui|celle|ceux|celles)-(?:ci|là)\b"
+    # Elliptical questions: "Et ceux de LG ?", "And Toyota?", "What about its claims?".
+    r"|^\s*(?:et|and|what about|how about|qu'en est-il)\b"
+    # An ordinal standing for an item of the last answer: "Résume le premier", "the last one".
+    r"|\b(?:le|la|les|the)\s+(?:premier|première|premiers|premières|second|seconde|deuxième|troisième|dernier"
+    r"|dernière|derniers|dernières|précédent|précédente|first|second|third|last|former|latter|previous)"
+    r"(?:\s+(?:one|ones|of them|d'entre eux|d'entre elles))?\s*[?.!]*\s*$"
+    r"|\bthe\s+(?:first|second|third|last|previous)\s+ones?\b"
+)
+WARM_TIMEOUT_SECONDS = 120
+
+CONVERSATION_INSTRUCTIONS = (
+    "You are an assistant who is an expert in patents. Answer the question based only on the following "
+    "context; the conversation so far only tells what the question refers to."
+)
+
+CONDENSE_PROMPT = ChatPromptTemplate.from_template("""
+Given the conversation below, rewrite the follow-up question as a standalone question. Reply with the question only.
+
+{history}
+
+Follow-up question: {question}
+""")
+
+
+def recent_turns(history, turns=CONVERSATION_TURNS):
+    # history: the chatbot's [(sender, message)] list. Returns the last
+    # answered [(question, answer)] pairs, oldest first; failed answers are
+    # left out.
+    pairs = []
+    question = None
+    for sender, message in history:
+        if sender == "user":
+            question = message
+        elif question is not None:
+            if not message.startswith("❌"):
+                pairs.append((question, message))
+            question = None
+    return pairs[-turns:] if turns else []
+
+
+def format_history(turns):
+    lines = []
+    for question, answer in turns:
+        if len(answer) > HISTORY_ANSWER_CHARS:
+            answer = answer[:HISTORY_ANSWER_CHARS] + "…"
+        lines.append(f"User: {question}\nAssistant: {answer}")
+    return "\n\n".join(lines)
+
+
+def conversation_prefix(turns, context=None):
+    # Everything before the question. The context comes first: a follow-up
+    # that reuses the chunks of the previous turn shares all of it with the
+    # prefix evaluated by warm_model, so Ollama reuses its KV cache.
+    if context is None:
+        return f"{CONVERSATION_INSTRUCTIONS}\n\n"
+    history = f"Conversation so far:\n\n{format_history(turns)}\n\n---\n\n" if turns else ""
+    return f"{CONVERSATION_INSTRUCTIONS}\n\nContext:\n\n{context}\n\n---\n\n{history}"
+
+
+def conversation_prompt(turns, context, question):
+    return f"{conversation_prefix(turns, context)}Question: {question}\n"
+
+
+def next_prompt_prefix(history, cache):
+    # Prefix of the next prompt if the follow-up reuses the last context.
+    return conversation_prefix(recent_turns(history), cache.last_context)
+
+
+def has_antecedent(words):
+    # words: the question up to a possessive. In "the date of its filing"
+    # the noun before "of" is what the possessive qualifies, not what it
+    # refers to.
+    if words and words[-1] in ("of", "de", "d"):
+        determiners = [i for i, word in enumerate(words) if word in DETERMINERS]
+        words = words[:determiners[-1]] if determiners else []
+    return any(word in DETERMINERS for word in words)
+
+
+def is_follow_up(question):
+    text = re.sub(r"\bqu'est-ce qu", " ", question.lower().replace("’", "'"))
+    if FOLLOW_UP_PATTERN.search(text):
+        return True
+    words = re.findall(r"\w+", text)
+    if FOLLOW_UP_WORDS.intersection(words):
+        return True
+    return any(word in FOLLOW_UP_POSSESSIVES and not has_antecedent(words[:i]) for i, word in enumerate(words))
+
+
+def condense_question(question, turns, llm=None):
+    # Search query for the question. A standalone question is kept as it is;
+    # for a follow-up, the LLM rewrites it when given, otherwise the previous
+    # question is prepended, which is enough for the embedding search.
+    if not turns or not is_follow_up(question):
+        return question
+    if llm is not None:
+        try:
+            lines = llm.invoke(CONDENSE_PROMPT.format(history=format_history(turns), question=question)).split("\n")
+            condensed = next((line.strip().strip('"') for line in lines if line.strip()), "")
+            if condensed:
+                return condensed
+        except Exception as e:
+            print(f"⚠️ Could not condense the question: {e}")
+    return f"{turns[-1][0]} {question}"
+
+
+class ConversationCache:
+    # Chunks retrieved for the recent turns of one chat session, with the
+    # search vector and store state (answer_cache.store_state) of each turn.
+    # Kept in st.session_state, so it is never shared between sessions.
+
+    def __init__(self, max_turns=CACHED_TURNS, threshold=REUSE_SIMILARITY):
+        self.max_turns = max_turns
+        self.threshold = threshold
+        self.entries = []
+        # Context text of the last answer, for next_prompt_prefix.
+        self.last_context = None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, query_vector, state):
+        # Results of the closest earlier turn on the same stores, filter and
+        # collection version; None below the threshold.
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        best, best_score = None, self.threshold
+        for entry in self.entries:
+            if entry["state"] != state:
+                continue
+            score = float(entry["vector"] @ query)
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best["results"]
+
+    def add(self, query_vector, state, results):
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        self.entries.append({"vector": vector, "state": state, "results": results})
+        del self.entries[:-self.max_turns]
+
+    def clear(self):
+        self.entries.clear()
+        self.last_context = None
+
+
+def warm_model(model, prefix="", keep_alive=OLLAMA_KEEP_ALIVE):
+    # Loads the model in the background (an empty prompt only loads it) and
+    # evaluates `prefix`, so the next prompt starting with it only pays for
+    # the rest. Returns the thread.
+    def run():
+        try:
+            with model_slot(model):
+                requests.post(
+                    f"{OLLAMA_BASE_URL}/api/generate",
+                    json={"model": model, "prompt": prefix, "stream": False, "keep_alive": keep_alive,
+                          "options": {"num_predict": 1}},
+                    timeout=WARM_TIMEOUT_SECONDS,
+                )
+        except (requests.RequestException, ModelWaitTimeout) as e:
+            print(f"⚠️ Could not warm up {model}: {e}")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
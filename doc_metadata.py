@@ -0,0 +1,103 @@
+import os
+import re
+from itertools import combinations
+
+from pdf_pipeline import open_pdf
+
+
+# Structured metadata stored on every chunk, so questions can be scoped with
+# a Chroma `where` filter instead of searching the whole collection:
+#   doc_type      "pdf" or "patent"
+#   api_source    "data" (populate_database), "upload" (chatbot / API) or the
+#                 patent APIs, comma-joined when a patent came from both
+#   file          PDF file name ("" for patents)
+#   patent_id     PatentsView ID, lens_id the Lens ID ("" for PDFs)
+#   publish_date  YYYYMMDD as an int (0 when unknown), so ranges are $gte/$lte
+
+# Bumped when the fields change: populate_database then re-tags every file.
+METADATA_VERSION = 1
+
+DOC_TYPE_PDF = "pdf"
+DOC_TYPE_PATENT = "patent"
+SOURCE_DATA = "data"
+SOURCE_UPLOAD = "upload"
+PATENT_API_SOURCES = ["PatentsView", "The Lens"]
+
+
+def date_to_int(value, fill="0"):
+    # "2020-01-15", "2020-01", "2020", PDF dates ("D:20200115103000+01'00'")
+    # -> 20200115, 20200100, 20200000; 0 when there is no date. With
+    # fill="9" a partial date gives the end of its period (20209999).
+    digits = re.sub(r"\D", "", str(value or ""))[:8]
+    if len(digits) < 4:
+        return 0
+    return int(digits.ljust(8, fill))
+
+
+def pdf_date(source):
+    # Creation date from the PDF info dictionary; source as for open_pdf.
+    try:
+        with open_pdf(source) as doc:
+            info = doc.metadata or {}
+    except Exception:
+        return 0
+    return date_to_int(info.get("creationDate") or info.get("modDate"))
+
+
+def pdf_metadata(source, source_name=None, api_source=SOURCE_DATA):
+    if source_name is None:
+        source_name = str(source) if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "upload")
+    return {
+        "doc_type": DOC_TYPE_PDF,
+        "api_source": api_source,
+        "file": os.path.basename(source_name),
+        "patent_id": "",
+        "publish_date": pdf_date(source),
+    }
+
+
+def tag_chunks(chunks, metadata):
+    for chunk in chunks:
+        chunk.metadata.update(metadata)
+    return chunks
+
+
+# ------------ Filters ---------------
+
+def api_source_values(sources):
+    # A patent found by both APIs is stored as "PatentsView,The Lens", so
+    # every stored combination containing a selected source is matched.
+    sources = set(sources)
+    values = [source for source in sources if source not in PATENT_API_SOURCES]
+    for size in range(1, len(PATENT_API_SOURCES) + 1):
+        for combination in combinations(sorted(PATENT_API_SOURCES), size):
+            if sources & set(combination):
+                values.append(",".join(combination))
+    return values
+
+
+def build_where(files=None, api_sources=None, doc_types=None, patent_ids=None, date_from=None, date_to=None):
+    # Chroma metadata filter from the chatbot filters; None when nothing is set.
+    # List filters also accept a single string; dates accept anything
+    # date_to_int reads.
+    files, api_sources, doc_types, patent_ids = (
+        [value] if isinstance(value, str) else value for value in (files, api_sources, doc_types, patent_ids)
+    )
+    clauses = []
+    if files:
+        clauses.append({"file": {"$in": [os.path.basename(name) for name in files]}})
+    if api_sources:
+        clauses.append({"api_source": {"$in": api_source_values(api_sources)}})
+    if doc_types:
+        clauses.append({"doc_type": {"$in": list(doc_types)}})
+    if patent_ids:
+        clauses.append({"$or": [{"patent_id": {"$in": list(patent_ids)}}, {"lens_id": {"$in": list(patent_ids)}}]})
+    if date_from or date_to:
+        # Undated documents (0) are left out of any date range.
+        clauses.append({"publish_date": {"$gte": max(1, date_to_int(date_from))}})
+    if date_to:
+        # "2020" or "2020-06" include the whole year or month.
+        clauses.append({"publish_date": {"$lte": date_to_int(date_to, fill="9")}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
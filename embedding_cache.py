@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from tracing import span
+
+
+CACHE_PATH = os.path.join("cache", "embeddings.sqlite3")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+def cache_key(model, text, kind="document"):
+    # Documents and queries are embedded with different instruction prefixes,
+    # so the same text has one vector per kind.
+    return hashlib.sha256(f"{model}\0{kind}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # Content-addressed store: (model, kind, normalized text hash) -> float32 vector
+    # blob in SQLite. When the blobs exceed `max_bytes` the least recently
+    # used entries are evicted.
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys):
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+            )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model, items):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, model, array("f", vector).tobytes(), now) for key, vector in items]
+        with self._lock:
+            keys = [row[0] for row in rows]
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                self._bytes -= self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._bytes += sum(len(row[2]) for row in rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop the least recently used entries down to 90% of the budget.
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            dropped = []
+            for key, size in rows:
+                if self._bytes <= target:
+                    break
+                dropped.append((key,))
+                self._bytes -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", dropped)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path=CACHE_PATH):
+    # One connection per cache file for the whole process.
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
+
+
+class CachedEmbeddings(Embeddings):
+    # Looks every text up in the cache first and only sends the misses to the
+    # wrapped embedding function.
+
+    def __init__(self, embeddings, model, cache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    @property
+    def stats(self):
+        return getattr(self.embeddings, "stats", None)
+
+    def _embed_many(self, texts, kind, embed, span_name):
+        keys = [cache_key(self.model, text, kind) for text in texts]
+        with span(span_name, texts=len(texts)) as current:
+            found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+            # Embed each missing text once, even if it appears several times.
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+            if current is not None:
+                current["attributes"]["cache_misses"] = len(missing)
+            if missing:
+                vectors = embed(list(missing.values()))
+                computed = list(zip(missing.keys(), vectors))
+                self.cache.put_many(self.model, computed)
+                found.update(computed)
+
+            return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed_many(list(texts), "document", self.embeddings.embed_documents, "embed_documents")
+
+    def embed_queries(self, texts):
+        # Batch counterpart of embed_query (batch_qa).
+        if hasattr(self.embeddings, "embed_queries"):
+            embed = self.embeddings.embed_queries
+        else:
+            embed = lambda texts: [self.embeddings.embed_query(text) for text in texts]
+        return self._embed_many(list(texts), "query", embed, "embed_queries")
+
+    def embed_query(self, text):
+        key = cache_key(self.model, text, "query")
+        with span("embed_query") as current:
+            found = self.cache.get_many([key])
+            if current is not None:
+                current["attributes"]["cache_hit"] = key in found
+            if key in found:
+                return found[key]
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(self.model, [(key, vector)])
+            return vector
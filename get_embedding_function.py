@@ -1,5 +1,179 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
 from langchain_community.embeddings.ollama import OllamaEmbeddings  # Pour Bedrock
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+
+
+EMBEDDING_MODEL = "mxbai-embed-large:latest"
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+
+
+def parse_keep_alive(value):
+    # Ollama reads a string keep_alive as a Go duration, which needs a unit:
+    # a plain number of seconds ("3600", "-1") is sent as a number instead.
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+# keep_alive sent with every request (Ollama duration, e.g. "30m", or
+# seconds). The default -1m pins the models: they stay loaded until
+# model_manager.py unloads one to stay within its limit of resident models.
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.environ.get("OLLAMA_KEEP_ALIVE", "-1m"))
+
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_MAX_WORKERS = 4
+EMBEDDING_MAX_RETRIES = 3
+
+
+def model_slot(base_url=None):
+    # The embedding model's slot in the model manager of its server (imported
+    # here, as model_manager imports this module).
+    from model_manager import model_slot as manager_slot
+
+    return manager_slot(EMBEDDING_MODEL, embedding=True, base_url=base_url)
+
+
+class EmbeddingStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.batches = 0
+        self.retries = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def record_batch(self, size, seconds):
+        with self._lock:
+            self.texts += size
+            self.batches += 1
+            self.busy_seconds += seconds
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def record_call(self, seconds):
+        with self._lock:
+            self.wall_seconds += seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "texts": self.texts,
+                "batches": self.batches,
+                "retries": self.retries,
+                "failures": self.failures,
+                "avg_batch_latency_s": self.busy_seconds / self.batches if self.batches else 0.0,
+                "throughput_texts_per_s": self.texts / self.wall_seconds if self.wall_seconds else 0.0,
+            }
+
+
+class KeepAliveOllamaEmbeddings(OllamaEmbeddings):
+    # OllamaEmbeddings sends no keep_alive, so every embedding request would
+    # reset the model to Ollama's default and unpin it.
+    keep_alive: Optional[Union[int, str]] = None
+
+    @property
+    def _default_params(self):
+        return {**super()._default_params, "keep_alive": self.keep_alive}
+
+
+class BatchedEmbeddings(Embeddings):
+    # Wraps an embedding client: splits the texts into batches, keeps at most
+    # `max_workers` batches in flight and retries failed batches with
+    # exponential backoff.
+
+    def __init__(self, client, batch_size=EMBEDDING_BATCH_SIZE, max_workers=EMBEDDING_MAX_WORKERS,
+                 max_retries=EMBEDDING_MAX_RETRIES, backoff=0.5):
+        self.client = client
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = EmbeddingStats()
+        self.base_url = getattr(client, "base_url", None)
+
+    def _with_retry(self, fn, *args):
+        attempt = 0
+        while True:
+            try:
+                return fn(*args)
+            except Exception:
+                if attempt >= self.max_retries:
+                    self.stats.record_failure()
+                    raise
+                self.stats.record_retry()
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+                attempt += 1
+
+    def _embed_batch(self, batch):
+        start = time.perf_counter()
+        with model_slot(self.base_url):
+            vectors = self._with_retry(self.client.embed_documents, batch)
+        self.stats.record_batch(len(batch), time.perf_counter() - start)
+        return vectors
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_workers == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                results = list(pool.map(self._embed_batch, batches))
+        self.stats.record_call(time.perf_counter() - start)
+
+        return [vector for batch in results for vector in batch]
+
+    def _embed_query(self, text):
+        start = time.perf_counter()
+        with model_slot(self.base_url):
+            vector = self._with_retry(self.client.embed_query, text)
+        self.stats.record_batch(1, time.perf_counter() - start)
+        return vector
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        vector = self._embed_query(text)
+        self.stats.record_call(time.perf_counter() - start)
+        return vector
+
+    def embed_queries(self, texts):
+        # Many questions embedded as queries (with the query instruction, not
+        # the passage one), at most `max_workers` at once.
+        texts = list(texts)
+        if not texts:
+            return []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(texts))) as pool:
+            vectors = list(pool.map(self._embed_query, texts))
+        self.stats.record_call(time.perf_counter() - start)
+        return vectors
+
 
-def get_embedding_function():
-    
-    return OllamaEmbeddings(model="mxbai-embed-large:latest")
+def get_embedding_function(base_url=None, batch_size=EMBEDDING_BATCH_SIZE, max_workers=EMBEDDING_MAX_WORKERS,
+                           use_cache=True):
+    client = KeepAliveOllamaEmbeddings(model=EMBEDDING_MODEL, base_url=base_url or OLLAMA_BASE_URL,
+                                       keep_alive=OLLAMA_KEEP_ALIVE)
+    embeddings = BatchedEmbeddings(client, batch_size=batch_size, max_workers=max_workers)
+    if use_cache:
+        embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, get_embedding_cache())
+    return embeddings
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+HTTP_CACHE_PATH = os.path.join("cache", "http.sqlite3")
+HTTP_CACHE_TTL_SECONDS = 24 * 3600
+HTTP_CACHE_STALE_SECONDS = 7 * 24 * 3600
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def normalize_payload(value):
+    # Keyword case and spacing do not change the API results.
+    if isinstance(value, dict):
+        return {key: normalize_payload(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [normalize_payload(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+def request_key(url, payload):
+    canonical = json.dumps(normalize_payload(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{url}\0{canonical}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # On-disk cache of JSON API responses, one entry per request payload
+    # (so per page / offset). Entries younger than `ttl` are fresh; up to
+    # `ttl + stale_seconds` they may be served stale while a refresh runs in
+    # the background. The total size is bounded with LRU eviction.
+
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL_SECONDS,
+                 stale_seconds=HTTP_CACHE_STALE_SECONDS, max_bytes=HTTP_CACHE_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, url TEXT NOT NULL, body TEXT NOT NULL,"
+            " created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self._bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key):
+        # Returns (data, age_seconds) or (None, None).
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl + self.stale_seconds:
+                self.misses += 1
+                return None, None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            age = now - row[1]
+            if age <= self.ttl:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return json.loads(row[0]), age
+
+    def put(self, key, url, data):
+        body = json.dumps(data)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if old:
+                self._bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, url, body, now, now)
+            )
+            self._bytes += len(body)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(body) FROM responses ORDER BY last_used LIMIT 200"
+            ).fetchall()
+            if not rows:
+                self._bytes = 0
+                break
+            dropped = []
+            for key, size in rows:
+                if self._bytes <= target:
+                    break
+                dropped.append((key,))
+                self._bytes -= size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", dropped)
+
+    def is_stale(self, age):
+        return age is not None and age > self.ttl
+
+    def start_refresh(self, key, refresh):
+        # Runs refresh() in a background thread, once per key at a time.
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                print(f"⚠️ Background refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
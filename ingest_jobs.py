@@ -0,0 +1,365 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from answer_cache import bump_collection_version
+from chunking import iter_child_chunks, take_parents
+from doc_metadata import SOURCE_UPLOAD, pdf_metadata
+from keyword_index import get_keyword_index
+from parent_store import get_parent_store
+from pdf_pipeline import batched, iter_pdf_pages_parallel
+from session_store import get_session_stores, split_store_ref
+from tracing import span, start_trace, traced_iter
+
+
+JOBS_PATH = os.path.join("cache", "jobs.sqlite3")
+# Store written by the jobs whose params have no "db_path".
+DEFAULT_DB_PATH = "chroma"
+SPOOL_DIR = os.path.join("cache", "jobs")
+MAX_WORKERS = 2
+INGEST_BATCH_SIZE = 64
+
+# queued -> running -> done | failed | cancelled
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    # Handed to the job handlers to report progress and honour cancellation.
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    def add_progress(self, parsed=0, embedded=0, written=0):
+        self.queue._add_progress(self.job_id, parsed, embedded, written)
+
+    def check_cancelled(self):
+        if self.queue._cancel_requested(self.job_id):
+            raise JobCancelled()
+
+
+class JobQueue:
+    # Persistent ingestion queue (SQLite) served by a bounded thread pool
+    # shared by every Streamlit session of the process. Jobs left "running"
+    # by a crash are queued again on start; every handler is idempotent
+    # (deterministic chunk IDs, manifest, embedded flags), so they resume.
+    # Jobs on the same store run one at a time: two of them would load and
+    # save its manifest concurrently and lose each other's updates.
+
+    def __init__(self, path=JOBS_PATH, max_workers=MAX_WORKERS, handlers=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.handlers = dict(HANDLERS if handlers is None else handlers)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL,"
+            " parsed INTEGER NOT NULL DEFAULT 0, embedded INTEGER NOT NULL DEFAULT 0,"
+            " written INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " attempts INTEGER NOT NULL DEFAULT 0, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+        self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self._conn.commit()
+
+        # Job ID -> store of the running jobs.
+        self._running = {}
+        self._slots = threading.Semaphore(max_workers)
+        self._wakeup = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._stopped = False
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+
+    # ------------ Public API ---------------
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params), now, now),
+            )
+            self._conn.commit()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def list_jobs(self, limit=20):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def cancel(self, job_id):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status = 'queued'",
+                (now, job_id),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, updated = ? WHERE id = ? AND status = 'running'",
+                (now, job_id),
+            )
+            self._conn.commit()
+
+    def wait(self, job_id, timeout=None, poll=0.2):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                return job
+            if deadline is not None and time.time() > deadline:
+                return job
+            time.sleep(poll)
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------ Worker side ---------------
+
+    def _claim_next(self):
+        # Oldest queued job whose store no running job writes.
+        with self._lock:
+            busy = set(self._running.values())
+            rows = self._conn.execute("SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created").fetchall()
+            row = next((row for row in rows if job_db_path(json.loads(row["params"])) not in busy), None)
+            if row is None:
+                return None
+            self._running[row["id"]] = job_db_path(json.loads(row["params"]))
+            # Progress restarts from zero when a job is resumed.
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1,"
+                " parsed = 0, embedded = 0, written = 0, updated = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+            self._conn.commit()
+            return row["id"]
+
+    def _dispatch(self):
+        while not self._stopped:
+            self._slots.acquire()
+            job_id = self._claim_next()
+            if job_id is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            self._pool.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        try:
+            job = self.get(job_id)
+            handler = self.handlers[job["kind"]]
+            try:
+                handler(JobContext(self, job_id), job["params"])
+            except JobCancelled:
+                self._finish(job_id, "cancelled")
+            except Exception as e:
+                self._finish(job_id, "failed", str(e))
+            else:
+                self._finish(job_id, "done")
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+            self._slots.release()
+            # A job waiting for this store can start.
+            self._wakeup.set()
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def _add_progress(self, job_id, parsed, embedded, written):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET parsed = parsed + ?, embedded = embedded + ?, written = written + ?,"
+                " updated = ? WHERE id = ?",
+                (parsed, embedded, written, time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def _cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row["cancel_requested"])
+
+
+# ------------ Job handlers ---------------
+
+def job_db_path(params):
+    return params.get("db_path", DEFAULT_DB_PATH)
+
+
+class NoTextError(Exception):
+    pass
+
+
+def ingest_pdf(path, db_path, source_name=None, job=None, batch_size=INGEST_BATCH_SIZE):
+    # Streams one PDF into the store at db_path. Chunk IDs are
+    # "source:page:chunk" (set by chunking.iter_child_chunks), so a resumed
+    # job overwrites what it already wrote.
+    from resources import vector_store
+
+    metadata = pdf_metadata(path, source_name, api_source=SOURCE_UPLOAD)
+
+    def pages():
+        for page in iter_pdf_pages_parallel(path):
+            if source_name is not None:
+                page.metadata["source"] = source_name
+            page.metadata.update(metadata)
+            yield page
+
+    parents = {}
+    os.makedirs(split_store_ref(db_path)[0], exist_ok=True)
+    # Holds a reference on the store, so it is not closed while being written.
+    with vector_store(db_path) as db:
+        text_length = 0
+        chunk_count = 0
+        pending = []
+        try:
+            for batch in traced_iter(batched(iter_child_chunks(pages(), parents), batch_size), "extract_split"):
+                if job is not None:
+                    job.check_cancelled()
+                    job.add_progress(parsed=len(batch))
+                # Nothing is written until the document proves to have real text.
+                text_length += sum(len(chunk.page_content.strip()) for chunk in batch)
+                if text_length < 50:
+                    pending.extend(batch)
+                    continue
+                batch, pending = pending + batch, []
+                with span("write_batch", chunks=len(batch)):
+                    db.add_documents(batch, ids=[chunk.metadata["id"] for chunk in batch])
+                with span("keyword_index", chunks=len(batch)):
+                    get_keyword_index(db_path).add_documents(batch)
+                with span("parent_store"):
+                    get_parent_store(db_path).add_documents(take_parents(parents, batch))
+                chunk_count += len(batch)
+                if job is not None:
+                    job.add_progress(embedded=len(batch), written=len(batch))
+        finally:
+            if chunk_count:
+                db.persist()
+                bump_collection_version(db_path)
+
+    if text_length < 50:
+        raise NoTextError("Impossible d'extraire du texte sélectionnable. Le PDF semble illisible ou scanné.")
+    return chunk_count
+
+
+def run_upload_pdf(job, params):
+    # The spooled file goes whether the job succeeds, fails or is cancelled.
+    try:
+        with start_trace("upload_pdf", source=params.get("source_name") or params["path"]):
+            ingest_pdf(params["path"], params["db_path"], source_name=params.get("source_name"), job=job)
+        if params.get("session"):
+            get_session_stores().refresh_size(params["db_path"])
+    finally:
+        if params.get("delete_after", True) and os.path.exists(params["path"]):
+            os.remove(params["path"])
+
+
+def run_populate_database(job, params):
+    from populate_database import update_database
+
+    update_database(job=job)
+
+
+def run_index_patents(job, params):
+    from patent_indexing import index_patents
+    from patent_store import get_patent_store
+    from resources import vector_store
+
+    store = get_patent_store()
+    records = store.not_embedded(params["keys"])
+    job.add_progress(parsed=len(records))
+    if not records:
+        return
+
+    db_path = job_db_path(params)
+
+    def on_batch(keys, chunk_count):
+        store.mark_embedded(keys)
+        job.add_progress(embedded=chunk_count, written=chunk_count)
+        job.check_cancelled()
+
+    with vector_store(db_path) as db:
+        try:
+            with start_trace("index_patents", patents=len(records)):
+                index_patents(db, records, on_batch=on_batch, keyword_index=get_keyword_index(db_path),
+                              parent_store=get_parent_store(db_path))
+        finally:
+            db.persist()
+            bump_collection_version(db_path)
+
+
+HANDLERS = {
+    "upload_pdf": run_upload_pdf,
+    "populate_database": run_populate_database,
+    "index_patents": run_index_patents,
+}
+
+
+def describe_job(job):
+    counts = f"{job['parsed']} segments lus · {job['embedded']} vectorisés · {job['written']} écrits"
+    labels = {
+        "queued": "⏳ En attente",
+        "running": "⚙️ En cours",
+        "done": "✅ Terminé",
+        "failed": "❌ Échec",
+        "cancelled": "⛔ Annulé",
+    }
+    return f"{labels.get(job['status'], job['status'])} — {counts}"
+
+
+def spool_upload(uploaded_file):
+    # Uploads only live in the Streamlit session; the job needs a file on disk
+    # so that it can be resumed after a restart.
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}.pdf")
+    with open(path, "wb") as f:
+        f.write(uploaded_file.getvalue())
+    return path
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
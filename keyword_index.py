@@ -0,0 +1,130 @@
+import os
+import re
+import sqlite3
+import threading
+
+from session_store import split_store_ref
+
+
+KEYWORD_INDEX_FILE = "keyword_index.sqlite3"
+TOKEN_PATTERN = re.compile(r"\w[\w-]*", re.UNICODE)
+
+
+def fts_query(text):
+    # Any of the query terms, each quoted so that user input can never be
+    # parsed as FTS5 syntax.
+    terms = dict.fromkeys(term.lower() for term in TOKEN_PATTERN.findall(text))
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+class KeywordIndex:
+    # BM25 inverted index (SQLite FTS5) stored next to a Chroma store and
+    # updated by every ingestion path with the same chunk IDs. Collections of
+    # a shared store ("directory#collection") get one table each.
+
+    def __init__(self, db_path):
+        directory, collection = split_store_ref(db_path)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, KEYWORD_INDEX_FILE)
+        self.table = f"chunks_{collection}" if collection else "chunks"
+        self._lock = threading.Lock()
+        # Set once the index is known to hold every chunk of its store.
+        self._covered = False
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            " id UNINDEXED, content, tokenize = \"unicode61 tokenchars '-_'\")"
+        )
+        self._conn.commit()
+
+    def upsert(self, ids, texts):
+        rows = list(zip(ids, texts))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(chunk_id,) for chunk_id, _ in rows])
+            self._conn.executemany(f"INSERT INTO {self.table} (id, content) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def add_documents(self, docs, ids=None):
+        if ids is None:
+            ids = [doc.metadata["id"] for doc in docs]
+        self.upsert(ids, [doc.page_content for doc in docs])
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+
+    def search(self, query_text, k=20):
+        # Returns [(chunk_id, bm25_score)], best first (FTS5 bm25 is negative).
+        match = fts_query(query_text)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, bm25({self.table}) AS score FROM {self.table}"
+                f" WHERE {self.table} MATCH ? ORDER BY score LIMIT ?",
+                (match, k),
+            ).fetchall()
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def ensure_covered(self, db):
+        # Chunks written before the keyword index existed are backfilled the
+        # first time the index is used in this process; afterwards every
+        # ingestion path keeps it in sync.
+        if self._covered:
+            return
+        store_count = db.count() if hasattr(db, "count") else db._collection.count()
+        if self.count() < store_count:
+            self.rebuild_from_store(db)
+        self._covered = True
+
+    def rebuild_from_store(self, db, batch_size=1000):
+        # For stores filled before the keyword index existed. Chunks already
+        # indexed are rewritten as they are.
+        offset = 0
+        while True:
+            items = db.get(include=["documents"], limit=batch_size, offset=offset)
+            if not items["ids"]:
+                break
+            self.upsert(items["ids"], items["documents"])
+            offset += len(items["ids"])
+
+    def drop_table(self):
+        with self._lock:
+            self._conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_keyword_index(db_path):
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = KeywordIndex(db_path)
+        return _indexes[db_path]
+
+
+def drop_keyword_index(db_path):
+    with _indexes_lock:
+        index = _indexes.pop(db_path, None)
+    if index is not None:
+        index.close()
+
+
+def delete_keyword_index(db_path):
+    # Removes the index of a dropped session collection.
+    index = get_keyword_index(db_path)
+    index.drop_table()
+    drop_keyword_index(db_path)
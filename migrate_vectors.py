@@ -0,0 +1,242 @@
+import argparse
+import os
+import shutil
+import time
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+
+from answer_cache import bump_collection_version
+from populate_database import CHROMA_PATH
+from quantized_index import (
+    DEFAULT_QUANTIZATION, DEFAULT_RERANK_FACTOR, PQ_SUBVECTORS, PQ_TRAIN_SAMPLE, QUANTIZED_DIR, SCAN_BLOCK_ROWS,
+    VECTOR_BACKEND_FILE, QuantizedStore, normalize_rows, read_backend, write_backend,
+)
+from resources import evict_vector_store, get_embeddings
+
+
+# Converts a Chroma store to the quantized memory-mapped backend, then
+# compares both on sample queries (recall@k against an exact search, and
+# latency):
+#   python migrate_vectors.py --db chroma --quantization int8 --rerank-factor 10
+#   python migrate_vectors.py --db chroma --disable     # back to Chroma
+#   python migrate_vectors.py --db chroma --compact     # drop deleted vectors now
+#
+# The Chroma files are kept but no longer updated once the store is migrated:
+# after --disable, run populate_database.py --reset to bring them up to date.
+
+MIGRATE_BATCH_SIZE = 5000
+DEFAULT_EVAL_QUERIES = 200
+DEFAULT_EVAL_K = 10
+
+
+def iter_chroma(db, batch_size=MIGRATE_BATCH_SIZE):
+    offset = 0
+    while True:
+        items = db._collection.get(include=["embeddings", "documents", "metadatas"],
+                                   limit=batch_size, offset=offset)
+        if not len(items["ids"]):
+            return
+        yield items
+        offset += len(items["ids"])
+
+
+def reservoir_sample(batches, size, seed=0):
+    # Uniform sample of at most `size` rows from a stream of row batches,
+    # holding no more than `size` rows in memory (algorithm R).
+    rng = np.random.default_rng(seed)
+    sample = None
+    seen = 0
+    for batch in batches:
+        batch = np.asarray(batch, dtype=np.float32)
+        if sample is None:
+            sample = np.empty((size, batch.shape[1]), dtype=np.float32)
+        fill = min(len(batch), max(0, size - seen))
+        sample[seen:seen + fill] = batch[:fill]
+        rest = batch[fill:]
+        if len(rest):
+            # Row i (0-based, over the whole stream) replaces a random slot
+            # with probability size / (i + 1).
+            slots = (rng.random(len(rest)) * (seen + fill + np.arange(1, len(rest) + 1))).astype(np.int64)
+            keep = slots < size
+            sample[slots[keep]] = rest[keep]
+        seen += len(batch)
+    return None if sample is None else sample[:min(seen, size)]
+
+
+def migrate(directory, quantization=DEFAULT_QUANTIZATION, rerank_factor=DEFAULT_RERANK_FACTOR,
+            pq_subvectors=PQ_SUBVECTORS):
+    chroma = Chroma(persist_directory=directory, embedding_function=get_embeddings())
+    target = os.path.join(directory, QUANTIZED_DIR)
+    building = target + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    store = QuantizedStore(building, get_embeddings(), quantization=quantization,
+                           rerank_factor=rerank_factor, pq_subvectors=pq_subvectors)
+
+    if quantization == "pq":
+        # The codebook is trained before encoding, on a sample of the whole
+        # collection drawn as it is read.
+        sample = reservoir_sample((items["embeddings"] for items in iter_chroma(chroma)), PQ_TRAIN_SAMPLE)
+        if sample is not None:
+            store.index.train(sample)
+
+    count = 0
+    start = time.perf_counter()
+    for items in iter_chroma(chroma):
+        store.add_vectors(items["ids"], items["embeddings"], items["documents"],
+                          [metadata or {} for metadata in items["metadatas"]])
+        count += len(items["ids"])
+        print(f"👉 {count} vectors migrated")
+    store.close()
+
+    evict_vector_store(directory)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(building, target)
+    write_backend(directory, quantization=quantization, rerank_factor=rerank_factor, pq_subvectors=pq_subvectors)
+    bump_collection_version(directory)
+    print(f"✅ {count} vectors migrated in {time.perf_counter() - start:.1f}s ({quantization})")
+    return chroma
+
+
+def disable(directory):
+    evict_vector_store(directory)
+    if read_backend(directory) is None:
+        print("✅ The store already uses Chroma")
+        return
+    os.remove(os.path.join(directory, VECTOR_BACKEND_FILE))
+    shutil.rmtree(os.path.join(directory, QUANTIZED_DIR), ignore_errors=True)
+    bump_collection_version(directory)
+    print("✅ Back to Chroma; run populate_database.py --reset if documents were added since the migration")
+
+
+def compact(directory):
+    # Stores also compact themselves once COMPACT_DELETED_RATIO of their rows
+    # are deleted; this forces it, e.g. after a large --reset of some sources.
+    if read_backend(directory) is None:
+        print("✅ The store uses Chroma, nothing to compact")
+        return
+    evict_vector_store(directory)
+    store = QuantizedStore(os.path.join(directory, QUANTIZED_DIR), get_embeddings())
+    removed = store.compact()
+    size = len(store.index)
+    store.close()
+    print(f"✅ {removed} deleted vectors removed, {size} left")
+
+
+# ------------ Evaluation ---------------
+
+def sample_queries(store, count, seed=0):
+    # Midpoints of two random stored vectors: close to real chunks without
+    # being one of them.
+    floats = store.index._map("floats.bin", np.float32, store.index.dim)
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(floats), size=(count, 2))
+    return normalize_rows(np.asarray(floats[pairs[:, 0]]) + np.asarray(floats[pairs[:, 1]]))
+
+
+def exact_neighbours(store, queries, k):
+    # Brute force over the float vectors, block by block: the ground truth
+    # for recall.
+    floats = store.index._map("floats.bin", np.float32, store.index.dim)
+    live = store._live_mask()
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(floats), SCAN_BLOCK_ROWS):
+        stop = min(len(floats), start + SCAN_BLOCK_ROWS)
+        scores = queries @ np.asarray(floats[start:stop]).T
+        scores[:, ~live[start:stop]] = -np.inf
+        rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        keep = np.argsort(-best_scores, axis=1)[:, :k]
+        best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    ids = {row: chunk_id for row, chunk_id in store._conn.execute("SELECT row, id FROM documents")}
+    return [[ids[int(row)] for row, score in zip(rows, scores) if np.isfinite(score)]
+            for rows, scores in zip(best_rows, best_scores)]
+
+
+def measure(search, queries, truth, k):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found) & set(expected))
+    latencies.sort()
+    return {
+        "recall": hits / max(1, sum(len(expected) for expected in truth)),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+
+def chroma_search(chroma):
+    def search(query, k):
+        found = chroma._collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        return found["ids"][0]
+    return search
+
+
+def quantized_search(store, rerank_factor):
+    def search(query, k):
+        hits = store.index.search(query, k, rerank_factor, store._live_mask())
+        rows = [row for row, _ in hits]
+        found = dict(store._conn.execute(
+            f"SELECT row, id FROM documents WHERE row IN ({','.join('?' * len(rows)) or 'NULL'})", rows))
+        return [found[row] for row in rows if row in found]
+    return search
+
+
+def evaluate(chroma, store, queries=DEFAULT_EVAL_QUERIES, k=DEFAULT_EVAL_K, rerank_factors=None):
+    # Returns {name: {"recall", "p50_ms", "p95_ms"}} for Chroma (HNSW) and the
+    # quantized index at each re-rank factor.
+    if store.count() == 0:
+        return {}
+    vectors = sample_queries(store, queries)
+    truth = exact_neighbours(store, vectors, k)
+    results = {"chroma": measure(chroma_search(chroma), vectors, truth, k)}
+    for factor in rerank_factors or [1, store.rerank_factor]:
+        results[f"{store.index.quantization} x{factor}"] = measure(quantized_search(store, factor), vectors, truth, k)
+    return results
+
+
+def print_evaluation(results, store, k):
+    print(f"\n{'':<14} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, row in results.items():
+        print(f"{name:<14} {row['recall']:>10.3f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+    print(f"Scanned bytes per vector: {store.index.memory_bytes_per_vector()} "
+          f"(float32: {store.index.dim * 4})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=CHROMA_PATH, help="Store directory to migrate.")
+    parser.add_argument("--quantization", choices=["int8", "pq"], default=DEFAULT_QUANTIZATION)
+    parser.add_argument("--rerank-factor", type=int, default=DEFAULT_RERANK_FACTOR,
+                        help="Candidates re-ranked with the float vectors = k * factor.")
+    parser.add_argument("--pq-subvectors", type=int, default=PQ_SUBVECTORS,
+                        help="PQ bytes per vector (must divide the embedding size).")
+    parser.add_argument("--eval-queries", type=int, default=DEFAULT_EVAL_QUERIES)
+    parser.add_argument("--k", type=int, default=DEFAULT_EVAL_K)
+    parser.add_argument("--disable", action="store_true", help="Go back to the Chroma backend.")
+    parser.add_argument("--compact", action="store_true", help="Remove the vectors of deleted chunks.")
+    args = parser.parse_args()
+
+    if args.disable:
+        disable(args.db)
+        return
+    if args.compact:
+        compact(args.db)
+        return
+
+    chroma = migrate(args.db, args.quantization, args.rerank_factor, args.pq_subvectors)
+    if args.eval_queries:
+        store = QuantizedStore(os.path.join(args.db, QUANTIZED_DIR), get_embeddings(),
+                               rerank_factor=args.rerank_factor)
+        print_evaluation(evaluate(chroma, store, args.eval_queries, args.k), store, args.k)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from get_embedding_function import EMBEDDING_MODEL, OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE
+from resources import registry
+
+
+# Lifecycle of the Ollama models used by the apps (the chat LLMs and the
+# embedding model). The configured models are preloaded at start and pinned
+# with keep_alive, so the first question after idle does not pay a model
+# load; at most MAX_RESIDENT_MODELS stay loaded: a request for another model
+# unloads the least recently used idle one, or waits until one is idle, so
+# several models never thrash RAM on a CPU-only box. The limit applies to
+# the requests of this process; Ollama's /api/ps is read to count the models
+# already loaded elsewhere. Those are left for Ollama to unload when they
+# expire, except pinned ones, which never would: they are unloaded like idle
+# models of this process, once none of these is left.
+
+MAX_RESIDENT_MODELS = int(os.environ.get("PATENTBOT_MAX_MODELS", 2))
+REQUEST_TIMEOUT_SECONDS = 10
+LOAD_TIMEOUT_SECONDS = 300
+# How often a request waiting on foreign models reads /api/ps again.
+FOREIGN_RECHECK_SECONDS = 5
+# Longest wait for a model slot before the request fails.
+MODEL_WAIT_TIMEOUT_SECONDS = int(os.environ.get("PATENTBOT_MODEL_WAIT_TIMEOUT", 600))
+# /api/ps is read at most this often for status(), which the apps call on
+# every page rerun.
+STATUS_CACHE_SECONDS = 5
+
+
+class ModelWaitTimeout(TimeoutError):
+    pass
+
+
+def model_name(name):
+    # Ollama names a model without a tag "<name>:latest".
+    return name if ":" in name else f"{name}:latest"
+
+
+def is_pinned(expires_at):
+    # A negative keep_alive shows in /api/ps as an expiry centuries away.
+    try:
+        return int(str(expires_at)[:4]) > time.gmtime().tm_year + 1
+    except ValueError:
+        return False
+
+
+class ModelManager:
+    def __init__(self, base_url=OLLAMA_BASE_URL, max_resident=MAX_RESIDENT_MODELS, keep_alive=OLLAMA_KEEP_ALIVE):
+        self.base_url = base_url
+        self.max_resident = max(1, max_resident)
+        self.keep_alive = keep_alive
+        self._session = requests.Session()
+        self._cond = threading.Condition()
+        # Model -> {"embedding", "last_used", "foreign", "pinned"}, requests in
+        # flight per model, and unload requests in flight.
+        self._resident = {}
+        self._active = {}
+        self._unloading = 0
+        self._waiting = 0
+        self.loads = 0
+        self.unloads = 0
+        self._synced = False
+        self._status_cache = (0.0, None)
+
+    # ------------ Ollama API ---------------
+
+    def loaded_models(self):
+        # /api/ps: {name: entry} of the models Ollama has in memory.
+        response = self._session.get(f"{self.base_url}/api/ps", timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return {entry["name"]: entry for entry in response.json().get("models", [])}
+
+    def available_models(self):
+        # /api/tags: names of the models pulled on the Ollama server.
+        response = self._session.get(f"{self.base_url}/api/tags", timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return [entry["name"] for entry in response.json().get("models", [])]
+
+    def _post_keep_alive(self, model, embedding, keep_alive, timeout):
+        # An empty request only loads (or, with keep_alive 0, unloads) the model.
+        if embedding:
+            payload = {"model": model, "input": [], "keep_alive": keep_alive}
+            path = "/api/embed"
+        else:
+            payload = {"model": model, "prompt": "", "stream": False, "keep_alive": keep_alive}
+            path = "/api/generate"
+        response = self._session.post(f"{self.base_url}{path}", json=payload, timeout=timeout)
+        response.raise_for_status()
+
+    def _sync(self, force=False):
+        # Models loaded by another process, or before this one started, count
+        # towards the limit: a request that waits on them reads /api/ps again
+        # until Ollama lets them expire. Only pinned ones are unloaded from here.
+        with self._cond:
+            if self._synced and not force:
+                return
+            self._synced = True
+        try:
+            loaded = self.loaded_models()
+        except requests.RequestException as e:
+            print(f"⚠️ Could not list the loaded Ollama models: {e}")
+            return
+        with self._cond:
+            for name, model in loaded.items():
+                entry = self._resident.setdefault(name, {"embedding": "embed" in name, "last_used": 0.0, "foreign": True})
+                if entry["foreign"]:
+                    entry["pinned"] = is_pinned(model.get("expires_at"))
+            for name in [name for name, entry in self._resident.items() if entry["foreign"] and name not in loaded]:
+                del self._resident[name]
+            self._cond.notify_all()
+
+    def _claim(self, name, embedding):
+        # Called with the lock held.
+        entry = self._resident.get(name)
+        if entry is None:
+            self.loads += 1
+            entry = self._resident[name] = {"embedding": embedding}
+        # A foreign model used here is kept alive by this process from now on.
+        entry["foreign"] = False
+        entry["last_used"] = time.time()
+        self._active[name] = self._active.get(name, 0) + 1
+
+    def _unload(self, name, entry):
+        # Called without the lock, once `name` has left _resident and is
+        # counted in _unloading: its slot is given to another model only
+        # after Ollama has freed it.
+        try:
+            self._post_keep_alive(name, entry["embedding"], 0, REQUEST_TIMEOUT_SECONDS)
+            unloaded = True
+        except requests.RequestException as e:
+            print(f"⚠️ Could not unload {name}: {e}")
+            unloaded = False
+        with self._cond:
+            self._unloading -= 1
+            self.unloads += unloaded
+            self._cond.notify_all()
+
+    # ------------ Slots ---------------
+
+    @contextmanager
+    def use(self, model, embedding=False):
+        # Held around every request to `model`. Waits while the model is not
+        # loaded and every loaded model is in use or foreign and not pinned,
+        # at most MODEL_WAIT_TIMEOUT_SECONDS.
+        name = model_name(model)
+        self._sync()
+        deadline = time.monotonic() + MODEL_WAIT_TIMEOUT_SECONDS
+        with self._cond:
+            self._waiting += 1
+        try:
+            recheck = False
+            while True:
+                if recheck:
+                    self._sync(force=True)
+                victim = None
+                with self._cond:
+                    if name in self._resident or len(self._resident) + self._unloading < self.max_resident:
+                        self._claim(name, embedding)
+                        break
+                    idle = [other for other, entry in self._resident.items()
+                            if not entry["foreign"] and not self._active.get(other)]
+                    if not idle:
+                        idle = [other for other, entry in self._resident.items()
+                                if entry["foreign"] and entry.get("pinned")]
+                    if idle:
+                        victim = min(idle, key=lambda other: self._resident[other]["last_used"])
+                        entry = self._resident.pop(victim)
+                        self._unloading += 1
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise ModelWaitTimeout(
+                                f"{name} waited {MODEL_WAIT_TIMEOUT_SECONDS}s for a model slot "
+                                f"({len(self._resident)} of {self.max_resident} models loaded)"
+                            )
+                        foreign = [other for other, entry in self._resident.items() if entry["foreign"]]
+                        if foreign and not recheck:
+                            print(f"⏳ {name} waits for models loaded outside this app: {', '.join(foreign)}")
+                        timeout = min(remaining, FOREIGN_RECHECK_SECONDS) if foreign else remaining
+                        notified = self._cond.wait(timeout)
+                        recheck = bool(foreign) and not notified
+                if victim is not None:
+                    self._unload(victim, entry)
+        finally:
+            with self._cond:
+                self._waiting -= 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[name] -= 1
+                if name in self._resident:
+                    self._resident[name]["last_used"] = time.time()
+                self._cond.notify_all()
+
+    def preload(self, model, embedding=False):
+        with self.use(model, embedding):
+            self._post_keep_alive(model_name(model), embedding, self.keep_alive, LOAD_TIMEOUT_SECONDS)
+
+    def preload_in_background(self, models, embedding_models=()):
+        # Loads the models one after the other without blocking the app start.
+        def run():
+            for model, embedding in [(model, False) for model in models] + [(model, True) for model in embedding_models]:
+                try:
+                    self.preload(model, embedding)
+                except (requests.RequestException, ModelWaitTimeout) as e:
+                    print(f"⚠️ Could not preload {model}: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def unload(self, model):
+        # Only a model this process loaded or used, and when it is idle.
+        name = model_name(model)
+        with self._cond:
+            entry = self._resident.get(name)
+            if entry is None or entry["foreign"] or self._active.get(name):
+                return
+            del self._resident[name]
+            self._unloading += 1
+        self._unload(name, entry)
+
+    def close(self):
+        self._session.close()
+
+    # ------------ Status ---------------
+
+    def _cached_loaded_models(self):
+        checked, loaded = self._status_cache
+        if loaded is None or time.monotonic() - checked > STATUS_CACHE_SECONDS:
+            try:
+                loaded = self.loaded_models()
+            except requests.RequestException as e:
+                print(f"⚠️ Could not list the loaded Ollama models: {e}")
+                loaded = {}
+            self._status_cache = (time.monotonic(), loaded)
+        return loaded
+
+    def status(self, models=()):
+        # One row per configured or loaded model, as Ollama reported it at
+        # most STATUS_CACHE_SECONDS ago.
+        loaded = self._cached_loaded_models()
+        with self._cond:
+            names = list(dict.fromkeys([model_name(model) for model in models] + list(self._resident) + list(loaded)))
+            rows = []
+            for name in names:
+                entry = loaded.get(name, {})
+                rows.append({
+                    "model": name,
+                    "loaded": name in loaded,
+                    "pinned": is_pinned(entry.get("expires_at")),
+                    "expires_at": entry.get("expires_at"),
+                    "size_mb": round(entry.get("size", 0) / 2**20),
+                    "active": self._active.get(name, 0),
+                })
+            return {
+                "models": rows,
+                "max_resident": self.max_resident,
+                "queued": self._waiting,
+                "loads": self.loads,
+                "unloads": self.unloads,
+            }
+
+
+def get_model_manager(base_url=None):
+    # One manager per Ollama server.
+    base_url = base_url or OLLAMA_BASE_URL
+    return registry.get(("model_manager", base_url), lambda: ModelManager(base_url=base_url))
+
+
+def model_slot(model, embedding=False, base_url=None):
+    return get_model_manager(base_url).use(model, embedding)
+
+
+def preload_models(models, embedding_models=(EMBEDDING_MODEL,)):
+    # Once per process: Streamlit re-runs the page on every interaction.
+    manager = get_model_manager()
+    return registry.get(("model_preload",), lambda: manager.preload_in_background(models, embedding_models))
@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+from session_store import split_store_ref
+
+
+PARENT_STORE_FILE = "parent_store.sqlite3"
+
+
+class ParentStore:
+    # Key-value store of the parent sections (a PDF page, a whole patent
+    # abstract) whose small child chunks are embedded in the vector store.
+    # Children carry the parent ID in their "parent_id" metadata; parents are
+    # expanded at query time. Kept next to the Chroma store, one table per
+    # collection like the keyword index.
+
+    def __init__(self, db_path):
+        directory, collection = split_store_ref(db_path)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, PARENT_STORE_FILE)
+        self.table = f"parents_{collection}" if collection else "parents"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            " id TEXT PRIMARY KEY, source TEXT NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_source ON {self.table}(source)")
+        self._conn.commit()
+
+    def add_documents(self, docs):
+        rows = [(doc.metadata["id"], str(doc.metadata.get("source", "")), doc.page_content, json.dumps(doc.metadata))
+                for doc in docs]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (id, source, content, metadata) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def get_many(self, ids):
+        # Returns {parent_id: Document}.
+        found = {}
+        ids = list(dict.fromkeys(ids))
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                for parent_id, content, metadata in self._conn.execute(
+                    f"SELECT id, content, metadata FROM {self.table} WHERE id IN ({','.join('?' * len(part))})", part
+                ):
+                    found[parent_id] = Document(page_content=content, metadata=json.loads(metadata))
+        return found
+
+    def delete_sources(self, sources):
+        # Parents of files being re-ingested or removed.
+        with self._lock:
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE source = ?", [(source,) for source in sources])
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def drop_table(self):
+        with self._lock:
+            self._conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_parent_store(db_path):
+    with _stores_lock:
+        if db_path not in _stores:
+            _stores[db_path] = ParentStore(db_path)
+        return _stores[db_path]
+
+
+def drop_parent_store(db_path):
+    with _stores_lock:
+        store = _stores.pop(db_path, None)
+    if store is not None:
+        store.close()
+
+
+def delete_parent_store(db_path):
+    # Removes the parents of a dropped session collection.
+    store = get_parent_store(db_path)
+    store.drop_table()
+    drop_parent_store(db_path)
+
+
+def expand_to_parents(results, db_paths, limit=None):
+    # results: [(child Document, score)] best first. Each child is replaced
+    # by its parent section, once, at the rank of its best child; children
+    # without a parent (a single-chunk page or patent, or chunks written
+    # before parents existed) are kept as they are.
+    if isinstance(db_paths, str):
+        db_paths = [db_paths]
+    wanted = [doc.metadata["parent_id"] for doc, _ in results if doc.metadata.get("parent_id")]
+    parents = {}
+    for db_path in db_paths:
+        missing = [parent_id for parent_id in wanted if parent_id not in parents]
+        if not missing:
+            break
+        parents.update(get_parent_store(db_path).get_many(missing))
+
+    expanded = []
+    seen = set()
+    for doc, score in results:
+        parent_id = doc.metadata.get("parent_id")
+        key = parent_id if parent_id in parents else doc.metadata.get("id") or doc.page_content
+        if key in seen:
+            continue
+        seen.add(key)
+        expanded.append((parents[parent_id] if parent_id in parents else doc, score))
+        if limit is not None and len(expanded) >= limit:
+            break
+    return expanded
@@ -0,0 +1,321 @@
+import email.utils
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import request_key
+
+
+PATENTSVIEW_URL = "https://search.patentsview.org/api/v1/patent/"
+LENS_URL = "https://api.lens.org/patent/search"
+PATENTSVIEW_API_KEY = os.environ.get("PATENTSVIEW_API_KEY", "CQSd3FBT.8vmxye4Np3EBjNgPMwadolmTjQhg5TJr")
+LENS_API_TOKEN = os.environ.get("LENS_API_TOKEN", "NKKdKUVJetizjiuFBqyltBQGWg9OWSdtwxJNtcz68FieAHDoX8mc")
+PATENTSVIEW_DELAY = 0.6
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, source, message, status=None):
+        super().__init__(f"{source}: {message}")
+        self.source = source
+        self.status = status
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts of `capacity`.
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Used on Retry-After: nobody gets a token before `seconds` have passed.
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def retry_after_seconds(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiClient:
+    # One pooled keep-alive session per API, a token bucket for its rate limit
+    # and a cap on the number of requests in flight. With a ResponseCache,
+    # repeated payloads are answered from disk without using API quota.
+
+    def __init__(self, name, url, headers, rate, burst=1, max_in_flight=4,
+                 max_retries=4, backoff=1.0, timeout=20, cache=None, stale_while_revalidate=True):
+        self.name = name
+        self.cache = cache
+        self.stale_while_revalidate = stale_while_revalidate
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_in_flight = max_in_flight
+        self.bucket = TokenBucket(rate, burst)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post_json(self, payload):
+        if self.cache is None:
+            return self._post_json(payload)
+
+        key = request_key(self.url, payload)
+        data, age = self.cache.get(key)
+        if data is not None:
+            if not self.cache.is_stale(age):
+                return data
+            if self.stale_while_revalidate:
+                self.cache.start_refresh(key, lambda: self.cache.put(key, self.url, self._post_json(payload)))
+                return data
+
+        data = self._post_json(payload)
+        self.cache.put(key, self.url, data)
+        return data
+
+    def _post_json(self, payload):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self._in_flight:
+                try:
+                    response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                except requests.RequestException as e:
+                    response, error = None, e
+                else:
+                    error = None
+
+            if response is not None and response.status_code == 200:
+                return response.json()
+
+            retryable = response is None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt >= self.max_retries:
+                if response is None:
+                    raise FetchError(self.name, str(error))
+                raise FetchError(self.name, f"Erreur {response.status_code}: {response.text[:500]}",
+                                 response.status_code)
+
+            wait = None
+            if response is not None:
+                wait = retry_after_seconds(response.headers.get("Retry-After"))
+            if wait is not None:
+                self.bucket.pause(wait)
+            else:
+                wait = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            time.sleep(wait)
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+# ------------ PatentsView ---------------
+
+def patentsview_query(keyword, page, per_page=100):
+    return {
+        "q": {
+            "_or": [
+                {"_text_any": {"patent_title": keyword}},
+                {"_text_any": {"patent_abstract": keyword}}
+            ]
+        },
+        "f": ["patent_id", "patent_title", "patent_abstract", "patent_date"],
+        "o": {"page": page, "per_page": per_page}
+    }
+
+
+def parse_patentsview(data):
+    return data.get("patents", [])
+
+
+def patentsview_record(patent):
+    # A PatentsView result in the shape of the parse_lens records, as the
+    # search page displays it and patent_store.save_search keeps it.
+    return {
+        "source": "PatentsView",
+        "title": patent.get("patent_title", "Sans titre"),
+        "abstract": patent.get("patent_abstract", "Non disponible"),
+        "date": patent.get("patent_date", "Inconnue"),
+        "id": patent.get("patent_id", ""),
+    }
+
+
+def patentsview_jobs(keyword, page_start, page_end):
+    return [patentsview_query(keyword, page) for page in range(page_start, page_end + 1)]
+
+
+# ------------ The Lens ---------------
+
+def extract_english_text(field):
+    if isinstance(field, list):
+        for item in field:
+            if isinstance(item, dict) and item.get("lang") == "en":
+                return item.get("text", "")
+        return None
+    if isinstance(field, dict):
+        return None
+    return None
+
+
+def lens_payload(keyword, offset, size):
+    return {
+        "query": {
+            "match": {"title": keyword}
+        },
+        "size": size,
+        "from": offset,
+        "include": [
+            "lens_id",
+            "jurisdiction",
+            "doc_number",
+            "date_published",
+            "biblio.invention_title",
+            "abstract"
+        ]
+    }
+
+
+def parse_lens(data):
+    # Lens returns an empty page when there is nothing left; keep the raw
+    # count so a page of non-English records does not end the pagination.
+    records = data.get("data", [])
+    patents = []
+    for patent in records:
+        title_en = extract_english_text(patent.get("biblio", {}).get("invention_title", []))
+        abstract_en = extract_english_text(patent.get("abstract", []))
+        if title_en and abstract_en:
+            patents.append({
+                "source": "The Lens",
+                "title": title_en,
+                "abstract": abstract_en,
+                "id": patent.get("lens_id", ""),
+                "jurisdiction": patent.get("jurisdiction", ""),
+                "doc_number": patent.get("doc_number", ""),
+                "date": patent.get("date_published", "")
+            })
+    return patents, len(records)
+
+
+def lens_jobs(keyword, total_to_fetch, batch_size=25):
+    return [lens_payload(keyword, offset, min(batch_size, total_to_fetch - offset))
+            for offset in range(0, total_to_fetch, batch_size)]
+
+
+# ------------ Shared clients ---------------
+# One pooled, rate-limited client per API and process, whether it is used by
+# a Streamlit page or by the HTTP service.
+
+def get_patentsview_client(api_key=PATENTSVIEW_API_KEY):
+    from http_cache import get_response_cache
+    from resources import registry
+
+    headers = {"Content-Type": "application/json", "X-Api-Key": api_key}
+    return registry.get(("api", "PatentsView", PATENTSVIEW_URL), lambda: ApiClient(
+        "PatentsView", PATENTSVIEW_URL, headers, rate=1 / PATENTSVIEW_DELAY, burst=3, max_in_flight=4,
+        cache=get_response_cache()
+    ))
+
+
+def get_lens_client(api_token=LENS_API_TOKEN):
+    from http_cache import get_response_cache
+    from resources import registry
+
+    headers = {"Authorization": f"Bearer {api_token}", "Content-Type": "application/json"}
+    return registry.get(("api", "The Lens", LENS_URL), lambda: ApiClient(
+        "The Lens", LENS_URL, headers, rate=2, burst=4, max_in_flight=4, cache=get_response_cache()
+    ))
+
+
+# ------------ Engine ---------------
+
+def run_jobs(jobs, on_progress=None):
+    # jobs: {source_name: (client, [payload, ...], parse)}.
+    # Every page of every source is requested concurrently (each client
+    # enforces its own rate limit and in-flight cap). Results are put back in
+    # page order and cut at the first empty or failed page, like the serial
+    # loops did. on_progress(done, total) runs in the calling thread.
+    total = sum(len(payloads) for _, payloads, _ in jobs.values())
+    workers = sum(min(client.max_in_flight, len(payloads)) for client, payloads, _ in jobs.values())
+    pages = {name: [None] * len(payloads) for name, (_, payloads, _) in jobs.items()}
+    errors = []
+    if total == 0:
+        return {name: [] for name in jobs}, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {}
+        for name, (client, payloads, parse) in jobs.items():
+            for index, payload in enumerate(payloads):
+                futures[pool.submit(client.post_json, payload)] = (name, index, parse)
+
+        done = 0
+        for future in as_completed(futures):
+            name, index, parse = futures[future]
+            try:
+                pages[name][index] = parse(future.result())
+            except Exception as e:
+                pages[name][index] = e
+            done += 1
+            if on_progress is not None:
+                on_progress(done, total)
+
+    results = {}
+    for name, name_pages in pages.items():
+        records = []
+        for page in name_pages:
+            if isinstance(page, Exception):
+                errors.append(str(page))
+                break
+            if isinstance(page, tuple):
+                page, raw_count = page
+            else:
+                raw_count = len(page)
+            if not raw_count:
+                break
+            records.extend(page)
+        results[name] = records
+    return results, errors
+
+
+def search_both(pv_client, lens_client, keyword, pv_pages, lens_count, on_progress=None):
+    results, errors = run_jobs({
+        "PatentsView": (pv_client, patentsview_jobs(keyword, 1, pv_pages), parse_patentsview),
+        "The Lens": (lens_client, lens_jobs(keyword, lens_count), parse_lens),
+    }, on_progress)
+    return results["PatentsView"], results["The Lens"], errors
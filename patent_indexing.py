@@ -0,0 +1,108 @@
+from langchain_core.documents import Document
+
+from chunking import chunking_profile, get_child_splitter, take_parents, uses_parents
+from doc_metadata import DOC_TYPE_PATENT, date_to_int
+from tracing import span
+
+
+INDEX_BATCH_SIZE = 64
+
+
+def patent_header(record):
+    lines = [f"Titre: {record['title']}"]
+    if record.get("date"):
+        lines.append(f"Date: {record['date']}")
+    return "\n".join(lines)
+
+
+def patent_text(record, abstract=None):
+    return f"{patent_header(record)}\nRésumé: {record['abstract'] if abstract is None else abstract}"
+
+
+def patent_metadata(record):
+    # Chroma only accepts str/int/float/bool metadata values. The filter
+    # fields are described in doc_metadata.py.
+    source = record.get("sources") or record.get("source") or ""
+    return {
+        "key": record["key"],
+        "doc_type": DOC_TYPE_PATENT,
+        "api_source": source,
+        "file": "",
+        "patent_id": record.get("patent_id") or "",
+        "lens_id": record.get("lens_id") or "",
+        "source": source,
+        "date": record.get("date") or "",
+        "publish_date": date_to_int(record.get("date")),
+        "title": record.get("title") or "",
+    }
+
+
+def iter_patent_documents(records, splitter=None, parents=None):
+    # One Document per patent; only a long abstract is split, always within
+    # the same patent and with the title/date header repeated on each piece.
+    # IDs are "<store key>:<chunk index>", so re-indexing a patent overwrites
+    # its chunks instead of duplicating them. When a patent is split and the
+    # chunking profile has parents, its whole text is added to `parents`
+    # under its store key (chunking.py).
+    if splitter is None:
+        splitter = get_child_splitter()
+    if not uses_parents():
+        parents = None
+    chunk_size = chunking_profile()["chunk_size"]
+
+    for record in records:
+        text = patent_text(record)
+        if len(text) <= chunk_size:
+            pieces = [text]
+        else:
+            pieces = [patent_text(record, part) for part in splitter.split_text(record["abstract"])]
+        if len(pieces) > 1 and parents is not None:
+            parents[record["key"]] = Document(page_content=text, metadata=dict(patent_metadata(record), id=record["key"]))
+        for index, piece in enumerate(pieces):
+            metadata = patent_metadata(record)
+            metadata["id"] = f"{record['key']}:{index}"
+            if len(pieces) > 1 and parents is not None:
+                metadata["parent_id"] = record["key"]
+            yield Document(page_content=piece, metadata=metadata)
+
+
+def index_patents(db, records, batch_size=INDEX_BATCH_SIZE, on_batch=None, keyword_index=None, parent_store=None):
+    # Streams the documents into the store in batches. on_batch(keys, count)
+    # is called after each batch with the store keys of its patents and its
+    # number of chunks. Batches end on a patent boundary, so a patent reported
+    # by on_batch has all its chunks written.
+    batch = []
+    parents = {}
+    written = 0
+
+    def flush():
+        nonlocal written
+        if not batch:
+            return
+        # A re-indexed patent may now have fewer chunks: its other ones go.
+        keys = list(dict.fromkeys(doc.metadata["key"] for doc in batch))
+        stale_ids = set(db.get(where={"key": {"$in": keys}}, include=[])["ids"])
+        stale_ids -= {doc.metadata["id"] for doc in batch}
+        if stale_ids:
+            db.delete(ids=list(stale_ids))
+            if keyword_index is not None:
+                keyword_index.delete(stale_ids)
+        with span("write_batch", chunks=len(batch)):
+            db.add_documents(batch, ids=[doc.metadata["id"] for doc in batch])
+        if keyword_index is not None:
+            with span("keyword_index", chunks=len(batch)):
+                keyword_index.add_documents(batch)
+        if parent_store is not None:
+            with span("parent_store"):
+                parent_store.add_documents(take_parents(parents, batch))
+        written += len(batch)
+        if on_batch is not None:
+            on_batch(keys, len(batch))
+        batch.clear()
+
+    for doc in iter_patent_documents(records, parents=parents if parent_store is not None else None):
+        if len(batch) >= batch_size and doc.metadata["key"] != batch[-1].metadata["key"]:
+            flush()
+        batch.append(doc)
+    flush()
+    return written
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from chunking import index_version
+
+PATENT_STORE_PATH = os.path.join("cache", "patents.sqlite3")
+SEARCH_MAX_AGE_SECONDS = 24 * 3600
+
+
+def normalize_words(text):
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+
+def title_hash(title):
+    return hashlib.sha1(normalize_words(title).encode("utf-8")).hexdigest()
+
+
+def abstract_fingerprint(abstract):
+    return normalize_words(abstract)[:200]
+
+
+def normalize_record(patent):
+    # Maps the PatentsView and Lens result dicts used by search_page onto one
+    # schema. US Lens records carry their publication number, which is the
+    # PatentsView patent_id.
+    source = patent.get("source", "PatentsView")
+    record = {
+        "patent_id": "",
+        "lens_id": "",
+        "title": patent.get("title") or patent.get("patent_title") or "",
+        "abstract": patent.get("abstract") or patent.get("patent_abstract") or "",
+        "date": patent.get("date") or patent.get("patent_date") or "",
+        "source": source,
+    }
+    if source == "The Lens":
+        record["lens_id"] = patent.get("id", "")
+        if patent.get("jurisdiction") == "US" and patent.get("doc_number"):
+            record["patent_id"] = str(patent["doc_number"]).lstrip("0")
+    else:
+        record["patent_id"] = patent.get("id") or patent.get("patent_id") or ""
+    if record["date"] in ("Inconnue", "Unknown"):
+        record["date"] = ""
+    return record
+
+
+class PatentStore:
+    # Local SQLite copy of every patent returned by a search, one row per
+    # patent whichever source(s) returned it.
+
+    def __init__(self, path=PATENT_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS patents (
+                key TEXT PRIMARY KEY,
+                patent_id TEXT,
+                lens_id TEXT,
+                title TEXT NOT NULL,
+                title_hash TEXT NOT NULL,
+                abstract TEXT NOT NULL,
+                date TEXT,
+                sources TEXT NOT NULL,
+                embedded INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS patents_patent_id ON patents(patent_id);
+            CREATE INDEX IF NOT EXISTS patents_lens_id ON patents(lens_id);
+            CREATE INDEX IF NOT EXISTS patents_date ON patents(date);
+            CREATE INDEX IF NOT EXISTS patents_title_hash ON patents(title_hash);
+            CREATE TABLE IF NOT EXISTS searches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                keyword TEXT NOT NULL,
+                params TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS searches_keyword ON searches(keyword, params);
+            CREATE TABLE IF NOT EXISTS search_hits (
+                search_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS search_hits_search ON search_hits(search_id);
+        """)
+        self._conn.commit()
+
+    def _find_duplicate(self, record):
+        if record["patent_id"]:
+            row = self._conn.execute(
+                "SELECT * FROM patents WHERE patent_id = ?", (record["patent_id"],)
+            ).fetchone()
+            if row:
+                return row
+        if record["lens_id"]:
+            row = self._conn.execute(
+                "SELECT * FROM patents WHERE lens_id = ?", (record["lens_id"],)
+            ).fetchone()
+            if row:
+                return row
+        # Same title and same beginning of abstract: the same patent seen by
+        # the other source.
+        fingerprint = abstract_fingerprint(record["abstract"])
+        for row in self._conn.execute(
+            "SELECT * FROM patents WHERE title_hash = ?", (title_hash(record["title"]),)
+        ):
+            if abstract_fingerprint(row["abstract"]) == fingerprint:
+                return row
+        return None
+
+    def _upsert(self, record):
+        now = time.time()
+        row = self._find_duplicate(record)
+        if row is None:
+            key = f"pv:{record['patent_id']}" if record["patent_id"] else f"lens:{record['lens_id']}"
+            if key in ("pv:", "lens:"):
+                key = "title:" + title_hash(record["title"])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO patents"
+                " (key, patent_id, lens_id, title, title_hash, abstract, date, sources, embedded, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                (key, record["patent_id"], record["lens_id"], record["title"], title_hash(record["title"]),
+                 record["abstract"], record["date"], record["source"], now),
+            )
+            return key
+
+        sources = set(row["sources"].split(","))
+        sources.add(record["source"])
+        self._conn.execute(
+            "UPDATE patents SET patent_id = ?, lens_id = ?, date = ?, sources = ?, updated = ? WHERE key = ?",
+            (row["patent_id"] or record["patent_id"], row["lens_id"] or record["lens_id"],
+             row["date"] or record["date"], ",".join(sorted(sources)), now, row["key"]),
+        )
+        return row["key"]
+
+    def upsert_records(self, patents):
+        # Returns the store key of each input record, duplicates included.
+        with self._lock:
+            keys = [self._upsert(normalize_record(patent)) for patent in patents]
+            self._conn.commit()
+        return keys
+
+    def get(self, keys):
+        rows = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                for row in self._conn.execute(
+                    f"SELECT * FROM patents WHERE key IN ({','.join('?' * len(part))})", part
+                ):
+                    rows[row["key"]] = dict(row)
+        return [rows[key] for key in dict.fromkeys(keys) if key in rows]
+
+    # "embedded" holds the chunking.index_version() the patent's chunks were
+    # written with (0: not in the vector store), so a metadata or chunking
+    # change re-indexes them. Rows from before versions existed hold 1.
+
+    def not_embedded(self, keys):
+        version = index_version()
+        return [record for record in self.get(keys) if record["embedded"] != version]
+
+    def stale_embedded(self):
+        # Patents in the vector store with chunks of an older version.
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                "SELECT * FROM patents WHERE embedded != 0 AND embedded != ?", (index_version(),)
+            )]
+
+    def mark_embedded(self, keys, embedded=True):
+        version = index_version() if embedded else 0
+        with self._lock:
+            self._conn.executemany("UPDATE patents SET embedded = ? WHERE key = ?", [(version, key) for key in keys])
+            self._conn.commit()
+
+    def reset_embedded(self):
+        # Called when the vector store is cleared.
+        with self._lock:
+            self._conn.execute("UPDATE patents SET embedded = 0")
+            self._conn.commit()
+
+    # ------------ Keyword searches ---------------
+
+    def save_search(self, keyword, params, results, complete=True):
+        # results: {source: [result dict, ...]} exactly as displayed. The
+        # records are always stored, but a search that hit fetch errors is not
+        # served again by cached_search. Searches past SEARCH_MAX_AGE_SECONDS,
+        # or replaced by this one, are pruned with their hits.
+        keyword, params = normalize_words(keyword), json.dumps(params, sort_keys=True)
+        with self._lock:
+            if not complete:
+                for patents in results.values():
+                    for patent in patents:
+                        self._upsert(normalize_record(patent))
+                self._conn.commit()
+                return
+            self._prune_searches(
+                "keyword = ? AND params = ? OR created < ?", (keyword, params, time.time() - SEARCH_MAX_AGE_SECONDS))
+            cursor = self._conn.execute(
+                "INSERT INTO searches (keyword, params, created) VALUES (?, ?, ?)", (keyword, params, time.time()),
+            )
+            search_id = cursor.lastrowid
+            hits = []
+            for source, patents in results.items():
+                keys = [self._upsert(normalize_record(patent)) for patent in patents]
+                for position, (key, patent) in enumerate(zip(keys, patents)):
+                    hits.append((search_id, position, source, key, json.dumps(patent)))
+            self._conn.executemany("INSERT INTO search_hits VALUES (?, ?, ?, ?, ?)", hits)
+            self._conn.commit()
+
+    def _prune_searches(self, where, args):
+        # Called with the lock held.
+        ids = [(row["id"],) for row in self._conn.execute(f"SELECT id FROM searches WHERE {where}", args)]
+        self._conn.executemany("DELETE FROM search_hits WHERE search_id = ?", ids)
+        self._conn.executemany("DELETE FROM searches WHERE id = ?", ids)
+
+    def cached_search(self, keyword, params, max_age=SEARCH_MAX_AGE_SECONDS):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM searches WHERE keyword = ? AND params = ? AND created >= ?"
+                " ORDER BY created DESC LIMIT 1",
+                (normalize_words(keyword), json.dumps(params, sort_keys=True), time.time() - max_age),
+            ).fetchone()
+            if row is None:
+                return None
+            results = {}
+            for hit in self._conn.execute(
+                "SELECT source, payload FROM search_hits WHERE search_id = ? ORDER BY source, position",
+                (row["id"],),
+            ):
+                results.setdefault(hit["source"], []).append(json.loads(hit["payload"]))
+        return results
+
+    def stats(self):
+        with self._lock:
+            total, embedded = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(embedded != 0), 0) FROM patents"
+            ).fetchone()
+        return {"patents": total, "embedded": embedded}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_patent_store = None
+_patent_store_lock = threading.Lock()
+
+
+def get_patent_store():
+    global _patent_store
+    with _patent_store_lock:
+        if _patent_store is None:
+            _patent_store = PatentStore()
+        return _patent_store
@@ -0,0 +1,94 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import fitz  # PyMuPDF
+from langchain_core.documents import Document
+
+
+PAGES_PER_TASK = 32
+PARALLEL_MIN_PAGES = 96
+MAX_PROCESSES = os.cpu_count() or 1
+
+
+def open_pdf(source):
+    # source: a path, raw bytes, or a file-like object such as a Streamlit upload.
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    if hasattr(source, "getvalue"):
+        return fitz.open(stream=source.getvalue(), filetype="pdf")
+    return fitz.open(stream=source.read(), filetype="pdf")
+
+
+def extract_page_range(path, start, stop):
+    # Runs in a worker process: only the pages [start, stop) are decoded.
+    with fitz.open(path) as doc:
+        return [(number, doc[number].get_text()) for number in range(start, min(stop, doc.page_count))]
+
+
+def iter_pdf_pages(source, source_name=None):
+    # Yields one Document per page as soon as it is parsed; page numbers are
+    # 0-based like the PyPDF loaders, so chunk IDs stay "source:page:chunk".
+    if source_name is None:
+        source_name = str(source) if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "upload")
+    with open_pdf(source) as doc:
+        for page in doc:
+            yield Document(page_content=page.get_text(), metadata={"source": source_name, "page": page.number})
+
+
+def iter_pdf_pages_parallel(path, max_processes=MAX_PROCESSES, pages_per_task=PAGES_PER_TASK):
+    # Large files are spread over a process pool by page range. At most two
+    # ranges per process are in flight and results are yielded in page order,
+    # so memory stays bounded whatever the size of the file.
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    if page_count < PARALLEL_MIN_PAGES or max_processes <= 1:
+        yield from iter_pdf_pages(path)
+        return
+
+    source_name = str(path)
+    ranges = iter(range(0, page_count, pages_per_task))
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        pending = deque(
+            pool.submit(extract_page_range, path, start, start + pages_per_task)
+            for start in islice(ranges, max_processes * 2)
+        )
+        while pending:
+            pages = pending.popleft().result()
+            for start in islice(ranges, 1):
+                pending.append(pool.submit(extract_page_range, path, start, start + pages_per_task))
+            for number, text in pages:
+                yield Document(page_content=text, metadata={"source": source_name, "page": number})
+
+
+def page_chunk_id(page, index):
+    # "source:page:chunk", the ID scheme of populate_database.calculate_chunk_ids.
+    return f"{page.metadata.get('source')}:{page.metadata.get('page')}:{index}"
+
+
+def iter_chunks(pages, splitter):
+    # Splits page by page instead of loading the whole document first. IDs
+    # are set here, per page, so they stay unique when the stream is written
+    # in batches that cut a page.
+    for page in pages:
+        if page.page_content.strip():
+            chunks = splitter.split_documents([page])
+            for index, chunk in enumerate(chunks):
+                chunk.metadata["id"] = page_chunk_id(page, index)
+            yield from chunks
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def extract_text(source):
+    return "".join(page.page_content for page in iter_pdf_pages(source))
@@ -1,15 +1,26 @@
 import argparse
+import hashlib
+import json
 import os
 import shutil
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from get_embedding_function import get_embedding_function
-from langchain_community.vectorstores import Chroma
+from answer_cache import bump_collection_version
+from chunking import get_child_splitter, iter_child_chunks, profile_name, take_parents
+from doc_metadata import METADATA_VERSION, pdf_metadata, tag_chunks
+from keyword_index import drop_keyword_index, get_keyword_index
+from parent_store import drop_parent_store, get_parent_store
+from patent_indexing import index_patents
+from patent_store import get_patent_store
+from pdf_pipeline import batched, iter_pdf_pages_parallel
+from quantized_index import DEFAULT_QUANTIZATION, DEFAULT_RERANK_FACTOR, read_backend, write_backend
+from resources import evict_vector_store, vector_store
+from tracing import span, start_trace, traced_iter
 
 
 CHROMA_PATH = "chroma"
 DATA_PATH = "data"
+MANIFEST_PATH = os.path.join(CHROMA_PATH, "ingest_manifest.json")
+ADD_BATCH_SIZE = 256
 
 
 def main():
@@ -17,59 +28,199 @@ def main():
     # Check if the database should be cleared (using the --clear flag).
     parser = argparse.ArgumentParser()
     parser.add_argument("--reset", action="store_true", help="Reset the database.")
+    parser.add_argument("--backend", choices=["chroma", "quantized"], default=None,
+                        help="Vector backend of a new database (with --reset or on the first run).")
+    parser.add_argument("--quantization", choices=["int8", "pq"], default=DEFAULT_QUANTIZATION)
+    parser.add_argument("--rerank-factor", type=int, default=DEFAULT_RERANK_FACTOR,
+                        help="Quantized backend: candidates re-ranked exactly = k * factor.")
     args = parser.parse_args()
     if args.reset:
         print("✨ Clearing Database")
         clear_database()
 
-    # Create (or update) the data store.
-    documents = load_documents()
-    chunks = split_documents(documents)
-    add_to_chroma(chunks)
+    if args.backend == "quantized":
+        if os.path.exists(CHROMA_PATH) and read_backend(CHROMA_PATH) is None:
+            print("⚠️ The database already exists: use --reset, or migrate_vectors.py to convert it")
+        else:
+            write_backend(CHROMA_PATH, quantization=args.quantization, rerank_factor=args.rerank_factor)
+
+    update_database()
+
+
+def update_database(job=None):
+    # job (optional) is an ingest_jobs.JobContext used to report progress and
+    # to stop between batches when the job is cancelled.
+    with start_trace("populate_database"):
+        # Only re-parse the files whose content changed since the last run.
+        with span("scan_files"):
+            manifest = load_manifest()
+            changed_files, removed_files = scan_data_files(manifest)
+        reindex_stale_patents(job)
+        if not changed_files and not removed_files:
+            save_manifest(manifest)
+            print("✅ No changed files in data/")
+            return
+
+        # Create (or update) the data store, one file at a time: pages are
+        # streamed from the PDF and split as they are parsed.
+        print(f"👉 Changed files: {len(changed_files)}, removed files: {len(removed_files)}")
+        for path in changed_files:
+            print(f"📄 {path}")
+            if job is not None:
+                job.check_cancelled()
+            with span("ingest_file", source=path):
+                # Pages are parsed, split and written as the stream is consumed.
+                parents = {}
+                chunks = iter_child_chunks(iter_pdf_pages_parallel(path), parents)
+                add_to_chroma(chunks, manifest=manifest, sources=[path], job=job, parents=parents,
+                              metadata=pdf_metadata(path))
+        if removed_files:
+            add_to_chroma([], manifest=manifest, sources=[], removed_files=removed_files, job=job)
+
+
+def reindex_stale_patents(job=None):
+    # Patents indexed from the chatbot with an older METADATA_VERSION or
+    # another chunking profile get their chunks written again.
+    store = get_patent_store()
+    records = store.stale_embedded()
+    if not records:
+        return
+    print(f"👉 Re-indexing patents with older metadata or chunking: {len(records)}")
 
+    def on_batch(keys, chunk_count):
+        store.mark_embedded(keys)
+        if job is not None:
+            job.add_progress(embedded=chunk_count, written=chunk_count)
+            job.check_cancelled()
 
-def load_documents():
-    document_loader = PyPDFDirectoryLoader(DATA_PATH)
-    return document_loader.load()
+    with span("reindex_patents", patents=len(records)), vector_store(CHROMA_PATH) as db:
+        try:
+            index_patents(db, records, on_batch=on_batch, keyword_index=get_keyword_index(CHROMA_PATH),
+                          parent_store=get_parent_store(CHROMA_PATH))
+        finally:
+            db.persist()
+            bump_collection_version(CHROMA_PATH)
+
+
+def load_documents(paths=None):
+    if paths is None:
+        paths = list_data_files()
+
+    documents = []
+    for path in paths:
+        documents.extend(iter_pdf_pages_parallel(path))
+    return documents
+
+
+def get_text_splitter():
+    # The shared profile of chunking.py.
+    return get_child_splitter()
 
 
 def split_documents(documents: list[Document]):
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,
-        chunk_overlap=80,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    return text_splitter.split_documents(documents)
-
-
-def add_to_chroma(chunks: list[Document]):
-    # Load the existing database.
-    db = Chroma(
-        persist_directory=CHROMA_PATH, embedding_function=get_embedding_function()
-    )
-
-    # Calculate Page IDs.
-    chunks_with_ids = calculate_chunk_ids(chunks)
-
-    # Add or Update the documents.
-    existing_items = db.get(include=[])  # IDs are always included by default
-    existing_ids = set(existing_items["ids"])
-    print(f"Number of existing documents in DB: {len(existing_ids)}")
-
-    # Only add documents that don't exist in the DB.
-    new_chunks = []
-    for chunk in chunks_with_ids:
-        if chunk.metadata["id"] not in existing_ids:
-            new_chunks.append(chunk)
-
-    if len(new_chunks):
-        print(f"👉 Adding new documents: {len(new_chunks)}")
-        new_chunk_ids = [chunk.metadata["id"] for chunk in new_chunks]
-        db.add_documents(new_chunks, ids=new_chunk_ids)
-        db.persist()
-    else:
-        print("✅ No new documents to add")
+    return get_text_splitter().split_documents(documents)
+
+
+def add_to_chroma(chunks, manifest=None, sources=None, removed_files=(), job=None, parents=None, metadata=None):
+    # chunks: an iterable of chunks with their IDs (chunking.iter_child_chunks),
+    # consumed and written ADD_BATCH_SIZE at a time, so only the chunk hashes
+    # of a file are kept in memory. parents: the dict iter_child_chunks fills
+    # with their parent sections. metadata: doc_metadata fields added to both.
+    # Load the existing database; the reference held on it keeps it open
+    # while it is written.
+    with vector_store(CHROMA_PATH) as db:
+        if manifest is None:
+            manifest = load_manifest()
+        sources = set(sources or ())
+        parents = parents if parents is not None else {}
+
+        # Add or Update the documents. Only the IDs of the files being updated
+        # are fetched.
+        existing_ids = set()
+
+        def fetch_existing_ids(source_list):
+            with span("existing_ids"):
+                for source in source_list:
+                    existing_items = db.get(where={"source": source}, include=[])  # IDs are always included by default
+                    existing_ids.update(existing_items["ids"])
+
+        fetch_existing_ids(sources | set(removed_files))
+        print(f"Number of existing documents for these files: {len(existing_ids)}")
+        new_hashes = {source: {} for source in sources}
+
+        # Parents are cheap to rewrite: those of the processed files are
+        # replaced, batch by batch with their children.
+        parent_store = get_parent_store(CHROMA_PATH)
+        with span("parent_store"):
+            parent_store.delete_sources(sources | set(removed_files))
+
+        written = 0
+        stale_ids = set()
+        try:
+            for batch in traced_iter(batched(chunks, ADD_BATCH_SIZE), "extract_split"):
+                if job is not None:
+                    job.check_cancelled()
+                    job.add_progress(parsed=len(batch))
+                batch_parents = take_parents(parents, batch)
+                if metadata is not None:
+                    tag_chunks(batch, metadata)
+                    tag_chunks(batch_parents, metadata)
+                fetch_existing_ids({chunk.metadata.get("source") for chunk in batch} - set(new_hashes))
+
+                # Upsert chunks that are new or whose text changed.
+                upsert_chunks = []
+                for chunk in batch:
+                    chunk_id = chunk.metadata["id"]
+                    chunk_hash = hash_text(chunk.page_content)
+                    chunk.metadata["hash"] = chunk_hash
+                    new_hashes.setdefault(chunk.metadata.get("source"), {})[chunk_id] = chunk_hash
+                    entry = file_entry(manifest, chunk.metadata.get("source"))
+                    old_hash = entry.get("chunks", {}).get(chunk_id)
+                    if chunk_id not in existing_ids:
+                        upsert_chunks.append(chunk)
+                    elif old_hash is not None and old_hash != chunk_hash:
+                        upsert_chunks.append(chunk)
+                    elif not entry_is_current(entry):
+                        # Same text, metadata written by an older version or another profile.
+                        upsert_chunks.append(chunk)
+
+                with span("parent_store", parents=len(batch_parents)):
+                    parent_store.add_documents(batch_parents)
+                if upsert_chunks:
+                    with span("write_batch", chunks=len(upsert_chunks)):
+                        db.add_documents(upsert_chunks, ids=[chunk.metadata["id"] for chunk in upsert_chunks])
+                    with span("keyword_index", chunks=len(upsert_chunks)):
+                        get_keyword_index(CHROMA_PATH).add_documents(upsert_chunks)
+                    written += len(upsert_chunks)
+                if job is not None:
+                    job.add_progress(embedded=len(upsert_chunks), written=len(upsert_chunks))
+            print(f"👉 New or changed documents added: {written}" if written else "✅ No new documents to add")
+
+            # Remove the chunks of pages that no longer exist.
+            for source, hashes in new_hashes.items():
+                stale_ids.update(ids_for_source(existing_ids, source) - set(hashes))
+            for source in removed_files:
+                stale_ids.update(ids_for_source(existing_ids, source))
+            if stale_ids:
+                print(f"🗑️ Removing stale documents: {len(stale_ids)}")
+                with span("delete_stale", chunks=len(stale_ids)):
+                    db.delete(ids=list(stale_ids))
+                    get_keyword_index(CHROMA_PATH).delete(stale_ids)
+        finally:
+            # Even a cancelled run may have written some batches.
+            if stale_ids or written:
+                with span("persist"):
+                    db.persist()
+                bump_collection_version(CHROMA_PATH)
+
+    # Record what is now in the store.
+    for source, hashes in new_hashes.items():
+        entry = file_entry(manifest, source)
+        entry.update(manifest["pending"].pop(source, {}))
+        entry["chunks"] = hashes
+    for source in removed_files:
+        manifest["files"].pop(source, None)
+    save_manifest(manifest)
 
 
 def calculate_chunk_ids(chunks):
@@ -101,7 +252,106 @@ def calculate_chunk_ids(chunks):
     return chunks
 
 
+def ids_for_source(ids, source):
+    prefix = f"{source}:"
+    return {chunk_id for chunk_id in ids if chunk_id.startswith(prefix)}
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ------------ Ingestion manifest ---------------
+# chroma/ingest_manifest.json keeps, for every file in data/, its size, mtime
+# and content hash, the doc_metadata version it was tagged with and the
+# chunking profile it was split with, plus the text hash of each of its chunks:
+# {"files": {"data/x.pdf": {"size": .., "mtime": .., "hash": .., "metadata_version": ..,
+#                           "chunking_profile": .., "chunks": {id: hash}}}}
+
+def entry_is_current(entry):
+    # Entries written before chunking profiles existed were split flat.
+    return (entry.get("metadata_version") == METADATA_VERSION
+            and entry.get("chunking_profile", "flat") == profile_name())
+
+
+def load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest["pending"] = {}
+    return manifest
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": manifest["files"]}, f, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def file_entry(manifest, source):
+    return manifest["files"].setdefault(source, {})
+
+
+def list_data_files():
+    if not os.path.isdir(DATA_PATH):
+        return []
+    return [
+        os.path.join(DATA_PATH, name)
+        for name in sorted(os.listdir(DATA_PATH))
+        if not name.startswith(".") and name.lower().endswith(".pdf")
+    ]
+
+
+def scan_data_files(manifest):
+    # Returns (changed_files, removed_files). A file whose size and mtime are
+    # unchanged is skipped without being read; otherwise its content hash
+    # decides whether it has to be parsed again.
+    changed_files = []
+    present = set()
+
+    for path in list_data_files():
+        present.add(path)
+        stat = os.stat(path)
+        entry = manifest["files"].get(path)
+        # Files tagged by an older metadata version, or split with another
+        # chunking profile, are processed again.
+        current = entry is not None and entry_is_current(entry)
+
+        if current and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            continue
+
+        file_hash = hash_file(path)
+        if current and entry.get("hash") == file_hash:
+            entry.update(size=stat.st_size, mtime=stat.st_mtime)
+            continue
+
+        # Recorded in the file entry only once its chunks are in the store.
+        manifest["pending"][path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": file_hash,
+                                     "metadata_version": METADATA_VERSION, "chunking_profile": profile_name()}
+        changed_files.append(path)
+
+    removed_files = sorted(set(manifest["files"]) - present)
+    return changed_files, removed_files
+
+
 def clear_database():
+    evict_vector_store(CHROMA_PATH)
+    drop_keyword_index(CHROMA_PATH)
+    drop_parent_store(CHROMA_PATH)
+    get_patent_store().reset_embedded()
     if os.path.exists(CHROMA_PATH):
         shutil.rmtree(CHROMA_PATH)
 
@@ -0,0 +1,549 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+# Optional vector backend for large corpora. Vectors are L2-normalised and
+# kept in memory-mapped files: int8 codes (1 byte per dimension) or product
+# quantisation codes (1 byte per sub-vector) for a fast approximate scan, plus
+# the float32 vectors on disk for exact re-ranking of the best candidates.
+# Only the codes are scanned, so the resident set is what the OS pages in.
+#
+# A store directory uses this backend when it contains VECTOR_BACKEND_FILE
+# (see resources.open_vector_store); the vectors then live in its
+# "quantized" sub-directory.
+
+VECTOR_BACKEND_FILE = "vector_backend.json"
+QUANTIZED_DIR = "quantized"
+DEFAULT_QUANTIZATION = "int8"
+# Candidates re-ranked with the float vectors = k * rerank_factor.
+DEFAULT_RERANK_FACTOR = 10
+PQ_SUBVECTORS = 64
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = 50000
+PQ_ITERATIONS = 15
+# A codebook trained on fewer than PQ_TRAIN_SAMPLE rows (the first batch of
+# a store built by populate_database) is trained again, and every code
+# re-encoded, each time the index grows this many times larger.
+PQ_RETRAIN_GROWTH = 4
+PQ_ENCODE_BLOCK_ROWS = 65536
+# Small blocks keep the decoded int8 rows in the CPU cache; PQ blocks are
+# 64 bytes per row and gain from larger ones.
+SCAN_BLOCK_ROWS = 2048
+PQ_SCAN_BLOCK_ROWS = 16384
+# Deleted and replaced chunks only lose their SQLite row; the vector files are
+# rewritten without them once they make up this share of the rows.
+COMPACT_DELETED_RATIO = 0.25
+COMPACT_MIN_DELETED_ROWS = 10000
+COMPACT_BLOCK_ROWS = 65536
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def kmeans(data, clusters, iterations=PQ_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    clusters = min(clusters, len(data))
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (data ** 2).sum(1)[:, None] - 2 * data @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        labels = distances.argmin(1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=clusters)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+# ------------ Vector index ---------------
+
+class QuantizedIndex:
+    # Append-only vector files addressed by row number:
+    #   codes.bin   int8 (rows x dim) or uint8 PQ codes (rows x subvectors)
+    #   scales.bin  float32 per-row scale of the int8 codes
+    #   floats.bin  float32 (rows x dim), read only for re-ranking
+    #   codebook.npy  PQ centroids (subvectors x 256 x dim / subvectors)
+
+    def __init__(self, path, dim=None, quantization=DEFAULT_QUANTIZATION, pq_subvectors=PQ_SUBVECTORS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        config_path = os.path.join(path, "index.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        else:
+            if quantization not in ("int8", "pq"):
+                raise ValueError(f"Unknown quantization: {quantization}")
+            config = {"dim": dim, "quantization": quantization, "pq_subvectors": pq_subvectors}
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump(config, f)
+        self.dim = config["dim"]
+        self.quantization = config["quantization"]
+        self.pq_subvectors = config["pq_subvectors"]
+        # Rows the PQ codebook was trained on.
+        self.trained_rows = config.get("trained_rows", 0)
+        self.codebook = None
+        if os.path.exists(self._file("codebook.npy")):
+            self.codebook = np.load(self._file("codebook.npy"))
+        self._maps = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save_dim(self, dim):
+        self.dim = dim
+        self._save_config()
+
+    def _save_config(self):
+        with open(self._file("index.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "quantization": self.quantization, "pq_subvectors": self.pq_subvectors,
+                       "trained_rows": self.trained_rows}, f)
+
+    @property
+    def code_size(self):
+        return self.dim if self.quantization == "int8" else self.pq_subvectors
+
+    def __len__(self):
+        if not self.dim or not os.path.exists(self._file("codes.bin")):
+            return 0
+        return os.path.getsize(self._file("codes.bin")) // self.code_size
+
+    def _map(self, name, dtype, width):
+        # Read-only memmaps, re-opened when the files grew or were replaced
+        # (compaction, PQ re-encoding), here or in another process.
+        rows = len(self)
+        if rows == 0:
+            return np.zeros((0, width), dtype=dtype)
+        inode = os.stat(self._file(name)).st_ino
+        cached, cached_inode = self._maps.get(name, (None, None))
+        if cached is None or cached.shape[0] != rows or cached_inode != inode:
+            cached = np.memmap(self._file(name), dtype=dtype, mode="r", shape=(rows, width))
+            self._maps[name] = (cached, inode)
+        return cached
+
+    def train(self, vectors):
+        # PQ codebook from a sample of the (normalised) vectors.
+        vectors = normalize_rows(vectors)
+        if self.dim is None:
+            self._save_dim(vectors.shape[1])
+        if self.dim % self.pq_subvectors:
+            raise ValueError(f"dim {self.dim} is not a multiple of {self.pq_subvectors} sub-vectors")
+        if len(vectors) > PQ_TRAIN_SAMPLE:
+            vectors = vectors[np.random.default_rng(0).choice(len(vectors), PQ_TRAIN_SAMPLE, replace=False)]
+        width = self.dim // self.pq_subvectors
+        codebook = np.zeros((self.pq_subvectors, PQ_CENTROIDS, width), dtype=np.float32)
+        for m in range(self.pq_subvectors):
+            centroids = kmeans(vectors[:, m * width:(m + 1) * width], PQ_CENTROIDS)
+            codebook[m, :len(centroids)] = centroids
+        self.codebook = codebook
+        np.save(self._file("codebook.npy"), codebook)
+        self.trained_rows = len(vectors)
+        self._save_config()
+
+    def _retrain(self):
+        # Called with the lock held: trains on a sample of the stored float
+        # vectors (only the sampled rows are read) and re-encodes every row.
+        rows = len(self)
+        floats = self._map("floats.bin", np.float32, self.dim)
+        sample = np.arange(rows)
+        if rows > PQ_TRAIN_SAMPLE:
+            sample = np.sort(np.random.default_rng(0).choice(rows, PQ_TRAIN_SAMPLE, replace=False))
+        self.train(np.asarray(floats[sample]))
+        building = self._file("codes.bin.tmp")
+        with open(building, "wb") as f:
+            for start in range(0, rows, PQ_ENCODE_BLOCK_ROWS):
+                codes, _ = self._encode(np.asarray(floats[start:start + PQ_ENCODE_BLOCK_ROWS]))
+                f.write(codes.tobytes())
+        os.replace(building, self._file("codes.bin"))
+        self._maps.pop("codes.bin", None)
+
+    def _encode(self, vectors):
+        if self.quantization == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.round(vectors / scales[:, None]).astype(np.int8)
+            return codes, scales.astype(np.float32)
+
+        width = self.dim // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        for m in range(self.pq_subvectors):
+            part = vectors[:, m * width:(m + 1) * width]
+            centroids = self.codebook[m]
+            distances = -2 * part @ centroids.T + (centroids ** 2).sum(1)[None, :]
+            codes[:, m] = distances.argmin(1)
+        return codes, None
+
+    def append(self, vectors):
+        # Returns the row number of the first appended vector.
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            if self.dim is None:
+                self._save_dim(vectors.shape[1])
+            if self.quantization == "pq" and self.codebook is None:
+                self.train(vectors)
+            first = len(self)
+            codes, scales = self._encode(vectors)
+            with open(self._file("codes.bin"), "ab") as f:
+                f.write(codes.tobytes())
+            if scales is not None:
+                with open(self._file("scales.bin"), "ab") as f:
+                    f.write(scales.tobytes())
+            with open(self._file("floats.bin"), "ab") as f:
+                f.write(vectors.tobytes())
+            if (self.quantization == "pq" and self.trained_rows < PQ_TRAIN_SAMPLE
+                    and len(self) >= self.trained_rows * PQ_RETRAIN_GROWTH):
+                self._retrain()
+            return first
+
+    def compact(self, keep):
+        # Rewrites the vector files with only the rows in `keep` (sorted row
+        # numbers); row keep[i] becomes row i. Returns the file names to move
+        # into place with commit_compaction, so that the caller can renumber
+        # its own rows first.
+        with self._lock:
+            keep = np.asarray(keep, dtype=np.int64)
+            files = [("codes.bin", np.int8 if self.quantization == "int8" else np.uint8, self.code_size),
+                     ("floats.bin", np.float32, self.dim)]
+            if self.quantization == "int8":
+                files.append(("scales.bin", np.float32, 1))
+            built = []
+            for name, dtype, width in files:
+                source = self._map(name, dtype, width)
+                with open(self._file(name + ".tmp"), "wb") as f:
+                    for start in range(0, len(keep), COMPACT_BLOCK_ROWS):
+                        f.write(np.asarray(source[keep[start:start + COMPACT_BLOCK_ROWS]]).tobytes())
+                built.append(name)
+            return built
+
+    def commit_compaction(self, built):
+        with self._lock:
+            self._maps.clear()
+            for name in built:
+                os.replace(self._file(name + ".tmp"), self._file(name))
+
+    def _approximate_scores(self, query, start, stop):
+        if self.quantization == "int8":
+            codes = self._map("codes.bin", np.int8, self.dim)[start:stop]
+            scales = self._map("scales.bin", np.float32, 1)[start:stop, 0]
+            return (codes.astype(np.float32) @ query) * scales
+
+        width = self.dim // self.pq_subvectors
+        table = np.einsum("mcw,mw->mc", self.codebook, query.reshape(self.pq_subvectors, width))
+        codes = self._map("codes.bin", np.uint8, self.pq_subvectors)[start:stop]
+        scores = np.zeros(stop - start, dtype=np.float32)
+        for m in range(self.pq_subvectors):
+            scores += table[m].take(codes[:, m])
+        return scores
+
+    def search(self, query, k, rerank_factor=DEFAULT_RERANK_FACTOR, live=None):
+        # Returns [(row, cosine similarity)] best first. live: optional boolean
+        # mask of the rows allowed (deleted or filtered-out rows excluded).
+        with self._lock:
+            rows = len(self)
+            if rows == 0 or k <= 0:
+                return []
+            query = normalize_rows(query)[0]
+            candidates = min(rows, max(k, k * rerank_factor))
+            floats = self._map("floats.bin", np.float32, self.dim)
+
+            if live is not None:
+                selected = np.flatnonzero(live[:rows])
+                if len(selected) * self.dim * 4 <= rows * self.memory_bytes_per_vector():
+                    # A selective filter: reading the float vectors of the rows
+                    # it allows costs less than scanning every code.
+                    exact = np.asarray(floats[selected]) @ query
+                    order = np.argsort(-exact)[:k]
+                    return [(int(selected[i]), float(exact[i])) for i in order]
+
+            best_rows = np.empty(0, dtype=np.int64)
+            best_scores = np.empty(0, dtype=np.float32)
+            block = SCAN_BLOCK_ROWS if self.quantization == "int8" else PQ_SCAN_BLOCK_ROWS
+            for start in range(0, rows, block):
+                stop = min(rows, start + block)
+                scores = self._approximate_scores(query, start, stop)
+                if live is not None:
+                    scores = np.where(live[start:stop], scores, -np.inf)
+                block_rows = np.arange(start, stop)
+                best_rows = np.concatenate([best_rows, block_rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_rows) > candidates:
+                    keep = np.argpartition(-best_scores, candidates - 1)[:candidates]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+            best_rows = best_rows[np.isfinite(best_scores)]
+            if not len(best_rows):
+                return []
+
+            # Exact re-ranking with the float vectors of the candidates only.
+            best_rows.sort()
+            exact = np.asarray(floats[best_rows]) @ query
+            order = np.argsort(-exact)[:k]
+            return [(int(best_rows[i]), float(exact[i])) for i in order]
+
+    def memory_bytes_per_vector(self):
+        return self.code_size + (4 if self.quantization == "int8" else 0)
+
+
+# ------------ Store facade ---------------
+
+# Metadata fields used by the chatbot filters (doc_metadata.py).
+INDEXED_METADATA_FIELDS = ["source", "file", "api_source", "doc_type", "patent_id", "publish_date"]
+WHERE_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def where_sql(where):
+    # Chroma metadata filter -> SQL on the JSON metadata column.
+    if not where:
+        return "1", []
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(part) for part in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params.extend(part_params)
+            continue
+        field = f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                values = list(value)
+                placeholders = ",".join("?" * len(values)) or "NULL"
+                clauses.append(f"{field} {'IN' if operator == '$in' else 'NOT IN'} ({placeholders})")
+                params.extend(values)
+            elif operator in WHERE_OPERATORS:
+                clauses.append(f"{field} {WHERE_OPERATORS[operator]} ?")
+                params.append(value)
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+class QuantizedStore:
+    # Implements the part of the langchain Chroma API used in this project
+    # (add_documents, get, delete, persist, similarity searches), so that
+    # populate_database, the ingestion jobs and query_rag work unchanged.
+
+    def __init__(self, path, embedding_function, quantization=DEFAULT_QUANTIZATION,
+                 rerank_factor=DEFAULT_RERANK_FACTOR, pq_subvectors=PQ_SUBVECTORS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.embeddings = embedding_function
+        self.rerank_factor = rerank_factor
+        self.index = QuantizedIndex(path, quantization=quantization, pq_subvectors=pq_subvectors)
+        self._lock = threading.RLock()
+        self._live = None
+        self._conn = sqlite3.connect(os.path.join(path, "documents.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, document TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        for field in INDEXED_METADATA_FIELDS:
+            # Same expression as where_sql, so filtered lookups use the index.
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS documents_{field} ON documents(json_extract(metadata, '$.{field}'))"
+            )
+        self._conn.commit()
+
+    # ------------ Writes ---------------
+
+    def add_vectors(self, ids, vectors, texts, metadatas):
+        if not len(ids):
+            return []
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            first = self.index.append(vectors)
+            self._conn.executemany(
+                "INSERT INTO documents (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [(first + i, chunk_id, text, json.dumps(metadata or {}))
+                 for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))],
+            )
+            self._conn.commit()
+            self._live = None
+            self._compact_if_needed()
+        return list(ids)
+
+    def add_texts(self, texts, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(texts)
+        if ids is None:
+            ids = [metadata.get("id") for metadata in metadatas]
+        # Like Chroma, chunks without an id get a random one.
+        ids = [chunk_id or str(uuid.uuid4()) for chunk_id in ids]
+        return self.add_vectors(ids, self.embeddings.embed_documents(texts), texts, metadatas)
+
+    def add_documents(self, documents, ids=None):
+        if ids is None:
+            ids = [getattr(doc, "id", None) or doc.metadata.get("id") for doc in documents]
+        return self.add_texts([doc.page_content for doc in documents],
+                              [doc.metadata for doc in documents], ids=ids)
+
+    def delete(self, ids=None):
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", [(chunk_id,) for chunk_id in ids or []])
+            self._conn.commit()
+            self._live = None
+            self._compact_if_needed()
+
+    def persist(self):
+        # Every write is already on disk.
+        pass
+
+    def delete_collection(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.commit()
+            self._live = None
+            self.compact()
+
+    def deleted_rows(self):
+        with self._lock:
+            return len(self.index) - self.count()
+
+    def _compact_if_needed(self):
+        deleted = self.deleted_rows()
+        if deleted >= COMPACT_MIN_DELETED_ROWS and deleted >= len(self.index) * COMPACT_DELETED_RATIO:
+            self.compact()
+
+    def compact(self):
+        # Drops the vectors of deleted rows and renumbers the SQLite rows.
+        # Rows only move down, so renumbering in ascending order never hits a
+        # row still in use. Returns the number of rows removed.
+        with self._lock:
+            rows = [row for row, in self._conn.execute("SELECT row FROM documents ORDER BY row")]
+            removed = len(self.index) - len(rows)
+            if not removed:
+                return 0
+            built = self.index.compact(rows)
+            try:
+                self._conn.executemany("UPDATE documents SET row = ? WHERE row = ?",
+                                       [(new, old) for new, old in enumerate(rows) if new != old])
+                self.index.commit_compaction(built)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+            self._live = None
+            return removed
+
+    # ------------ Reads ---------------
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=None):
+        sql, params = where_sql(where)
+        if ids is not None:
+            ids = list(ids)
+            sql += f" AND id IN ({','.join('?' * len(ids)) or 'NULL'})"
+            params = params + ids
+        query = f"SELECT id, document, metadata FROM documents WHERE {sql} ORDER BY row"
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset or 0]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        result = {"ids": [row[0] for row in rows]}
+        result["documents"] = [row[1] for row in rows] if "documents" in include else None
+        result["metadatas"] = [json.loads(row[2]) for row in rows] if "metadatas" in include else None
+        return result
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def _live_mask(self, where=None):
+        # Rows that are not deleted (and match `where`).
+        with self._lock:
+            if where is None and self._live is not None and len(self._live) == len(self.index):
+                return self._live
+            sql, params = where_sql(where)
+            rows = [row for row, in self._conn.execute(f"SELECT row FROM documents WHERE {sql}", params)]
+            mask = np.zeros(len(self.index), dtype=bool)
+            mask[rows] = True
+            if where is None:
+                self._live = mask
+            return mask
+
+    def _documents(self, hits):
+        if not hits:
+            return []
+        rows = [row for row, _ in hits]
+        with self._lock:
+            found = {
+                row: (chunk_id, text, metadata)
+                for row, chunk_id, text, metadata in self._conn.execute(
+                    f"SELECT row, id, document, metadata FROM documents WHERE row IN ({','.join('?' * len(rows))})",
+                    rows,
+                )
+            }
+        return [(Document(id=found[row][0], page_content=found[row][1], metadata=json.loads(found[row][2])), score)
+                for row, score in hits if row in found]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None):
+        # Relevance = cosine similarity, higher is better. The lock keeps a
+        # compaction from renumbering the rows between the scan and the lookup.
+        with self._lock:
+            hits = self.index.search(embedding, k, self.rerank_factor, self._live_mask(filter))
+            return self._documents(hits)
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        # Score = cosine distance, lower is better, like Chroma.
+        results = self.similarity_search_by_vector_with_relevance_scores(
+            self.embeddings.embed_query(query), k=k, filter=filter
+        )
+        return [(doc, 1.0 - score) for doc, score in results]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def search_by_vectors(self, vectors, k, where=None):
+        # Batch form used by retrieval.batch_dense_search: distances, lower is better.
+        with self._lock:
+            live = self._live_mask(where)
+            return [[(doc, 1.0 - score) for doc, score in
+                     self._documents(self.index.search(vector, k, self.rerank_factor, live))]
+                    for vector in vectors]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ------------ Backend selection ---------------
+
+def read_backend(directory):
+    try:
+        with open(os.path.join(directory, VECTOR_BACKEND_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_backend(directory, quantization=DEFAULT_QUANTIZATION, rerank_factor=DEFAULT_RERANK_FACTOR,
+                  pq_subvectors=PQ_SUBVECTORS):
+    os.makedirs(directory, exist_ok=True)
+    config = {"backend": "quantized", "quantization": quantization,
+              "rerank_factor": rerank_factor, "pq_subvectors": pq_subvectors}
+    with open(os.path.join(directory, VECTOR_BACKEND_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def open_quantized_store(directory, embedding_function, config):
+    return QuantizedStore(
+        os.path.join(directory, QUANTIZED_DIR), embedding_function,
+        quantization=config.get("quantization", DEFAULT_QUANTIZATION),
+        rerank_factor=config.get("rerank_factor", DEFAULT_RERANK_FACTOR),
+        pq_subvectors=config.get("pq_subvectors", PQ_SUBVECTORS),
+    )
@@ -0,0 +1,183 @@
+from contextlib import ExitStack
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from answer_cache import get_answer_cache, store_state
+from chunking import parent_limit
+from context_budget import MIN_RELATIVE_SCORE, assemble_context
+from conversation import CONDENSE_WITH_LLM, condense_question, conversation_prompt
+from model_manager import model_slot
+from parent_store import expand_to_parents
+from reranker import RERANK_CANDIDATES, RERANK_TOP_N, get_reranker
+from resources import get_embeddings, get_llm, vector_store
+from retrieval import FETCH_K, RETRIEVAL_K, multi_store_search
+from streaming import stream_with_metrics
+from tracing import span, start_trace, traced_stream
+
+
+# RAG pipeline shared by the Streamlit chatbot, the HTTP service and the
+# batch runner.
+
+LLM_MODEL = "mistral"
+NO_CONTEXT_ANSWER = "Je n'ai trouvé aucune information pertinente dans la base."
+
+PROMPT_TEMPLATE = ChatPromptTemplate.from_template("""
+You are an assistant who is an expert in patents. Answer the question based only on the following context:
+
+{context}
+
+---
+
+Answer the question based on the above context: {question}
+""")
+
+
+def retrieve_context(query_text: str, db_path, query_vector=None, where=None):
+    # The store and the LLM client are opened once per process (see resources.py).
+    # Dense and BM25 results are fused so exact terms (claim numbers, IDs,
+    # chemical names) are not missed. db_path may list several stores, e.g.
+    # the session collection and the main corpus, searched as one. where is
+    # an optional metadata filter (doc_metadata.build_where) applied in the
+    # vector query itself. With a re-ranker, a wider candidate set is
+    # retrieved and only the best few chunks are kept. The small matched
+    # chunks are then replaced by their parent sections (parent_store.py),
+    # each one given once.
+    db_paths = [db_path] if isinstance(db_path, str) else list(db_path)
+    reranker = get_reranker()
+    k = RERANK_CANDIDATES if reranker is not None else RETRIEVAL_K
+    with ExitStack() as stack:
+        with span("store_open", stores=len(db_paths)):
+            stores = [(stack.enter_context(vector_store(path)), path) for path in db_paths]
+        with span("vector_search"):
+            results = multi_store_search(stores, query_text, query_vector, k=k, fetch_k=max(FETCH_K, k),
+                                         where=where)
+
+    if reranker is not None:
+        results = reranker.rerank(query_text, results, top_n=RERANK_TOP_N)
+    with span("parent_expand"):
+        return expand_to_parents(results, db_paths, limit=parent_limit())
+
+
+def min_relative_score():
+    # Without a re-ranker the scores are RRF fused scores: a hit found by both
+    # the dense and BM25 lists scores about twice a single-list hit, so a
+    # cutoff relative to the best one would drop every single-list hit. The
+    # cutoff is then applied to the dense distances before fusion instead
+    # (retrieval.cut_dense).
+    return MIN_RELATIVE_SCORE if get_reranker() is not None else 0
+
+
+def build_rag_prompt(query_text: str, db_path, query_vector=None, where=None):
+    return prompt_from_results(query_text, retrieve_context(query_text, db_path, query_vector, where))
+
+
+def prompt_from_results(query_text, results):
+    # Returns (prompt, context_report), or (None, None) when nothing was found.
+    if not results:
+        return None, None
+
+    # Overlapping and duplicate chunks are removed and the context is fitted
+    # to the model's token budget.
+    with span("prompt_build"):
+        context_text, context_report = assemble_context(results, model=LLM_MODEL,
+                                                         min_relative_score=min_relative_score())
+        return PROMPT_TEMPLATE.format(context=context_text, question=query_text), context_report
+
+
+def query_rag_stream(query_text: str, db_path, metrics=None, where=None):
+    # Every stage is recorded as a span (tracing.py); the trace is exported to
+    # cache/traces.jsonl and kept on metrics.trace for the sidebar.
+    with start_trace("query_rag", model=LLM_MODEL) as trace:
+        if metrics is not None:
+            metrics.trace = trace
+
+        # Near-identical questions on an unchanged collection are answered from
+        # the semantic answer cache without retrieval or generation.
+        with span("query_embedding"):
+            query_vector = get_embeddings().embed_query(query_text)
+        answer_cache = get_answer_cache()
+        with span("answer_cache_lookup") as current:
+            cached_answer = answer_cache.lookup(db_path, query_vector, where)
+            if current is not None:
+                current["attributes"]["hit"] = cached_answer is not None
+        if cached_answer is not None:
+            yield from stream_with_metrics([cached_answer], metrics)
+            return
+
+        prompt, context_report = build_rag_prompt(query_text, db_path, query_vector, where)
+        if prompt is None:
+            yield NO_CONTEXT_ANSWER
+            return
+        if metrics is not None:
+            metrics.context_report = context_report
+
+        model = get_llm(LLM_MODEL)
+        answer = []
+        with model_slot(LLM_MODEL):
+            for token in stream_with_metrics(traced_stream(model.stream(prompt)), metrics):
+                answer.append(token)
+                yield token
+        answer_cache.store(db_path, query_text, query_vector, "".join(answer), where)
+
+
+def query_rag(query_text: str, db_path, where=None):
+    return "".join(query_rag_stream(query_text, db_path, where=where))
+
+
+def query_conversation_stream(query_text: str, turns, db_path, cache, metrics=None, where=None):
+    # Chatbot pipeline aware of the previous turns ([(question, answer)],
+    # oldest first, see conversation.recent_turns). A follow-up is searched
+    # with a condensed query; when it stays close to an earlier turn, that
+    # turn's chunks (cache: the session's ConversationCache) are reused and
+    # the vector search is skipped. Only a standalone question can be
+    # answered from the answer cache.
+    with start_trace("query_conversation", model=LLM_MODEL, turns=len(turns)) as trace:
+        if metrics is not None:
+            metrics.trace = trace
+
+        with span("condense"):
+            if CONDENSE_WITH_LLM:
+                with model_slot(LLM_MODEL):
+                    search_query = condense_question(query_text, turns, get_llm(LLM_MODEL))
+            else:
+                search_query = condense_question(query_text, turns)
+        with span("query_embedding"):
+            query_vector = get_embeddings().embed_query(search_query)
+        answer_cache = get_answer_cache() if search_query == query_text else None
+        if answer_cache is not None:
+            with span("answer_cache_lookup") as current:
+                cached_answer = answer_cache.lookup(db_path, query_vector, where)
+                if current is not None:
+                    current["attributes"]["hit"] = cached_answer is not None
+            if cached_answer is not None:
+                yield from stream_with_metrics([cached_answer], metrics)
+                return
+
+        state = store_state(db_path, where)
+        with span("conversation_cache_lookup") as current:
+            results = cache.lookup(query_vector, state)
+            if current is not None:
+                current["attributes"]["hit"] = results is not None
+        if results is None:
+            results = retrieve_context(search_query, db_path, query_vector, where)
+            cache.add(query_vector, state, results)
+        if not results:
+            yield NO_CONTEXT_ANSWER
+            return
+
+        with span("prompt_build"):
+            context_text, context_report = assemble_context(results, model=LLM_MODEL,
+                                                             min_relative_score=min_relative_score())
+            prompt = conversation_prompt(turns, context_text, query_text)
+        cache.last_context = context_text
+        if metrics is not None:
+            metrics.context_report = context_report
+
+        model = get_llm(LLM_MODEL)
+        answer = []
+        with model_slot(LLM_MODEL):
+            for token in stream_with_metrics(traced_stream(model.stream(prompt)), metrics):
+                answer.append(token)
+                yield token
+        if answer_cache is not None:
+            answer_cache.store(db_path, query_text, query_vector, "".join(answer), where)
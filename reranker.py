@@ -0,0 +1,177 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from embedding_cache import normalize_text
+from resources import registry
+from tracing import span
+
+
+# Optional second retrieval stage: a wide candidate set from the vector
+# search is scored by a small local cross-encoder (query and chunk read
+# together) and only the best few chunks reach the LLM. Enabled with
+# PATENTBOT_RERANK=1; needs the sentence-transformers package, without it
+# the first-stage order is kept.
+
+RERANK_ENABLED = os.environ.get("PATENTBOT_RERANK", "0") == "1"
+RERANK_MODEL = os.environ.get("PATENTBOT_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched for re-ranking, and chunks kept for the prompt.
+RERANK_CANDIDATES = 50
+RERANK_TOP_N = 3
+RERANK_BATCH_SIZE = 16
+# Scoring stops once the next batch would exceed this budget; the first
+# batch always runs.
+RERANK_BUDGET_SECONDS = 0.5
+RERANK_MAX_TEXT_CHARS = 2000
+
+CACHE_PATH = os.path.join("cache", "rerank_scores.sqlite3")
+CACHE_MAX_ROWS = 200000
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + math.exp(-max(-50.0, min(50.0, x))))
+
+
+class RerankScoreCache:
+    # (model, query, chunk text) -> raw cross-encoder score, in SQLite. The
+    # least recently used rows are evicted above `max_rows`.
+
+    def __init__(self, path=CACHE_PATH, max_rows=CACHE_MAX_ROWS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model, query, text):
+        return hashlib.sha256(f"{model}\0{normalize_text(query)}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                found.update(self._conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall())
+            now = time.time()
+            self._conn.executemany("UPDATE scores SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (key, score, last_used) VALUES (?, ?, ?)",
+                [(key, float(score), now) for key, score in items],
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            if count > self.max_rows:
+                self._conn.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                    (count - self.max_rows,),
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_rerank_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RerankScoreCache()
+        return _cache
+
+
+def load_cross_encoder(model=RERANK_MODEL):
+    # Returns a scorer: [(query, text)] -> [raw score], or None when
+    # sentence-transformers is not installed.
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        print("⚠️ sentence-transformers is not installed: re-ranking disabled")
+        return None
+    encoder = CrossEncoder(model, device="cpu")
+    return lambda pairs, batch_size: [float(score) for score in
+                                      encoder.predict(pairs, batch_size=batch_size, show_progress_bar=False)]
+
+
+class Reranker:
+    def __init__(self, scorer, model=RERANK_MODEL, cache=None, batch_size=RERANK_BATCH_SIZE,
+                 budget_seconds=RERANK_BUDGET_SECONDS):
+        self.scorer = scorer
+        self.model = model
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.budget_seconds = budget_seconds
+
+    def rerank(self, query_text, results, top_n=RERANK_TOP_N):
+        # results: [(Document, score)] from the first stage, best first.
+        # Returns [(Document, relevance in 0..1)], best first. Candidates left
+        # unscored when the budget runs out keep their order after the scored ones.
+        if not results:
+            return []
+        keys = [RerankScoreCache.key(self.model, query_text, doc.page_content) for doc, _ in results]
+        scores = self.cache.get_many(keys) if self.cache is not None else {}
+
+        with span("rerank", candidates=len(results), cached=len(scores)) as current:
+            todo = [i for i, key in enumerate(keys) if key not in scores]
+            start = time.perf_counter()
+            scored = []
+            for offset in range(0, len(todo), self.batch_size):
+                elapsed = time.perf_counter() - start
+                if offset and elapsed / offset * (offset + self.batch_size) > self.budget_seconds:
+                    break
+                batch = todo[offset:offset + self.batch_size]
+                pairs = [(query_text, results[i][0].page_content[:RERANK_MAX_TEXT_CHARS]) for i in batch]
+                batch_scores = self.scorer(pairs, self.batch_size)
+                scored.extend(zip((keys[i] for i in batch), batch_scores))
+            scores.update(scored)
+            if self.cache is not None:
+                self.cache.put_many(scored)
+            if current is not None:
+                current["attributes"].update(scored=len(scored), skipped=len(todo) - len(scored))
+
+        ranked = sorted((i for i in range(len(results)) if keys[i] in scores),
+                        key=lambda i: scores[keys[i]], reverse=True)
+        ranked += [i for i in range(len(results)) if keys[i] not in scores]
+        return [(results[i][0], sigmoid(scores[keys[i]]) if keys[i] in scores else 0.0)
+                for i in ranked[:top_n]]
+
+
+def get_reranker():
+    # Shared per process; None when re-ranking is disabled or unavailable.
+    if not RERANK_ENABLED:
+        return None
+
+    def factory():
+        scorer = load_cross_encoder(RERANK_MODEL)
+        return Reranker(scorer, RERANK_MODEL, get_rerank_cache()) if scorer is not None else None
+
+    return registry.get(("reranker", RERANK_MODEL), factory)
@@ -0,0 +1,184 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_community.vectorstores import Chroma
+
+from get_embedding_function import OLLAMA_BASE_URL, OLLAMA_KEEP_ALIVE, get_embedding_function
+from quantized_index import open_quantized_store, read_backend
+from session_store import split_store_ref
+
+
+# Process-wide registry of expensive clients (vector stores, embedding and LLM
+# clients). Streamlit re-runs the page scripts on every interaction but keeps
+# imported modules, so everything registered here survives reruns and is
+# shared between sessions.
+
+class ResourceRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        # One lock per key being built: a slow factory (a store being opened)
+        # only blocks the callers of the same key.
+        self._building = {}
+
+    def _take(self, key):
+        # Called with the lock held.
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry["refs"] += 1
+            entry["last_used"] = time.time()
+        return entry
+
+    def acquire(self, key, factory, closer=None):
+        with self._lock:
+            entry = self._take(key)
+            if entry is not None:
+                return entry["resource"]
+            build_lock = self._building.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                with self._lock:
+                    entry = self._take(key)
+                if entry is not None:
+                    return entry["resource"]
+                resource = factory()
+                with self._lock:
+                    self._entries[key] = {"resource": resource, "refs": 0, "closer": closer, "last_used": 0.0}
+                    return self._take(key)["resource"]
+        finally:
+            with self._lock:
+                if self._building.get(key) is build_lock and key in self._entries:
+                    del self._building[key]
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["refs"] > 0:
+                entry["refs"] -= 1
+                entry["last_used"] = time.time()
+
+    def get(self, key, factory, closer=None):
+        # Returns a shared resource without holding a reference on it: for
+        # clients that live as long as the process. Code that must not see
+        # the resource closed under it (stores being written or searched)
+        # holds a reference with use().
+        resource = self.acquire(key, factory, closer)
+        self.release(key)
+        return resource
+
+    @contextmanager
+    def use(self, key, factory, closer=None):
+        resource = self.acquire(key, factory, closer)
+        try:
+            yield resource
+        finally:
+            self.release(key)
+
+    def evict(self, key, force=False):
+        # Closes and forgets a resource. Returns False if it is still in use.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return True
+            if entry["refs"] > 0 and not force:
+                return False
+            del self._entries[key]
+        close_resource(entry["resource"], entry["closer"])
+        return True
+
+    def evict_idle(self, max_idle_seconds):
+        now = time.time()
+        with self._lock:
+            idle = [key for key, entry in self._entries.items()
+                    if entry["refs"] == 0 and now - entry["last_used"] > max_idle_seconds]
+        return [key for key in idle if self.evict(key)]
+
+    def evict_prefix(self, prefix, force=False):
+        # Evicts `prefix` and every key derived from it, e.g. the chains
+        # built on a vector store. Returns False if one is still in use.
+        with self._lock:
+            keys = [key for key in self._entries if key[:len(prefix)] == prefix]
+        return all([self.evict(key, force=force) for key in keys])
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def close(self):
+        for key in self.keys():
+            self.evict(key, force=True)
+
+
+def close_resource(resource, closer=None):
+    try:
+        if closer is not None:
+            closer(resource)
+        elif hasattr(resource, "close"):
+            resource.close()
+    except Exception as e:
+        print(f"⚠️ Error while closing {type(resource).__name__}: {e}")
+
+
+registry = ResourceRegistry()
+
+
+def get_embeddings():
+    return registry.get(("embeddings",), get_embedding_function)
+
+
+def vector_store_key(path):
+    return ("chroma", path)
+
+
+def open_vector_store(path):
+    # path is a store reference: "directory" or "directory#collection".
+    # A directory migrated with migrate_vectors.py uses the quantized backend.
+    directory, collection = split_store_ref(path)
+    if collection is None:
+        backend = read_backend(directory)
+        if backend is not None:
+            return open_quantized_store(directory, get_embeddings(), backend)
+        return Chroma(persist_directory=directory, embedding_function=get_embeddings())
+    return Chroma(collection_name=collection, persist_directory=directory, embedding_function=get_embeddings())
+
+
+def close_vector_store(db):
+    # Recent chromadb clients release their SQLite/HNSW handles on close()
+    # (reference counted per directory, so the other collections of a shared
+    # store stay open); older ones have nothing to close.
+    client = getattr(db, "_client", None)
+    if client is not None and hasattr(client, "close"):
+        client.close()
+    elif client is None and hasattr(db, "close"):
+        db.close()
+
+
+def get_vector_store(path):
+    return registry.get(vector_store_key(path), lambda: open_vector_store(path), close_vector_store)
+
+
+def vector_store(path):
+    # Context manager holding a reference on the store while it is used.
+    return registry.use(vector_store_key(path), lambda: open_vector_store(path), close_vector_store)
+
+
+def evict_vector_store(path, force=True):
+    # Also evicts what was built on the store (keys starting with its key).
+    return registry.evict_prefix(vector_store_key(path), force=force)
+
+
+def get_llm(model):
+    def factory():
+        from langchain_community.llms.ollama import Ollama
+        return Ollama(model=model, base_url=OLLAMA_BASE_URL, keep_alive=OLLAMA_KEEP_ALIVE)
+
+    return registry.get(("llm", model), factory)
+
+
+def get_chat_llm(model):
+    def factory():
+        from langchain_community.chat_models import ChatOllama
+        return ChatOllama(model=model, base_url=OLLAMA_BASE_URL, keep_alive=OLLAMA_KEEP_ALIVE)
+
+    return registry.get(("chat", model), factory)
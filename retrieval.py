@@ -0,0 +1,157 @@
+import hashlib
+
+from langchain_core.documents import Document
+
+from keyword_index import get_keyword_index
+from tracing import span
+
+
+RETRIEVAL_K = 5
+FETCH_K = 20
+DENSE_WEIGHT = 1.0
+KEYWORD_WEIGHT = 1.0
+RRF_K = 60
+# Dense candidates farther than this multiple of the best candidate's
+# distance are dropped before fusion, since the fused RRF scores only reflect
+# ranks. Distances are cosine or squared L2 on normalized vectors, both
+# proportional to 1 - cosine, so the ratio holds for either. The best
+# distance is floored, so a near-exact match does not drop everything else.
+DENSE_MAX_DISTANCE_RATIO = 1.5
+DENSE_MIN_BEST_DISTANCE = 0.05
+
+
+def doc_key(doc):
+    # The Chroma ID when the Document carries it, else the ID this project
+    # stores in the metadata, else the text itself.
+    chunk_id = getattr(doc, "id", None) or doc.metadata.get("id")
+    if chunk_id:
+        return chunk_id
+    return "text:" + hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings, weights=None, rrf_k=RRF_K):
+    # rankings: lists of keys, best first. Returns [(key, fused_score)].
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def dense_search(db, query_text, query_vector=None, k=RETRIEVAL_K, where=None):
+    if query_vector is None:
+        return db.similarity_search_with_score(query_text, k=k, filter=where)
+    return db.similarity_search_by_vector_with_relevance_scores(query_vector, k=k, filter=where)
+
+
+def cut_dense(dense, ratio=DENSE_MAX_DISTANCE_RATIO):
+    # dense: [(Document, distance)], lower is better.
+    if not dense or not ratio:
+        return dense
+    limit = max(min(distance for _, distance in dense), DENSE_MIN_BEST_DISTANCE) * ratio
+    return [(doc, distance) for doc, distance in dense if distance <= limit]
+
+
+def batch_dense_search(db, query_vectors, k=FETCH_K, where=None):
+    # One Chroma query for many query vectors. Returns one
+    # [(Document, distance)] list per vector, best first.
+    if not query_vectors:
+        return []
+    if hasattr(db, "search_by_vectors"):
+        # quantized_index.QuantizedStore
+        return db.search_by_vectors(query_vectors, k, where=where)
+    found = db._collection.query(
+        query_embeddings=[list(vector) for vector in query_vectors], n_results=k, where=where,
+        include=["documents", "metadatas", "distances"],
+    )
+    return [
+        [(Document(id=chunk_id, page_content=text, metadata=metadata or {}), distance)
+         for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+        for ids, texts, metadatas, distances in zip(
+            found["ids"], found["documents"], found["metadatas"], found["distances"])
+    ]
+
+
+def hybrid_search(db, db_path, query_text, query_vector=None, k=RETRIEVAL_K, fetch_k=FETCH_K,
+                  dense_weight=DENSE_WEIGHT, keyword_weight=KEYWORD_WEIGHT, rrf_k=RRF_K, where=None):
+    # Dense (Chroma) and BM25 (keyword_index) candidates fused with
+    # reciprocal-rank fusion. Returns [(Document, fused_score)], best first.
+    # where: optional Chroma metadata filter applied to both sides.
+    with span("dense_search", store=db_path):
+        dense = dense_search(db, query_text, query_vector, k=fetch_k, where=where)
+    return fuse_with_keywords(db, db_path, query_text, dense, k=k, fetch_k=fetch_k, dense_weight=dense_weight,
+                              keyword_weight=keyword_weight, rrf_k=rrf_k, where=where)
+
+
+def fuse_with_keywords(db, db_path, query_text, dense, k=RETRIEVAL_K, fetch_k=FETCH_K,
+                       dense_weight=DENSE_WEIGHT, keyword_weight=KEYWORD_WEIGHT, rrf_k=RRF_K, where=None):
+    # Second half of hybrid_search, for dense results computed elsewhere
+    # (e.g. batch_dense_search). Distant dense candidates are cut first
+    # (cut_dense): without a re-ranker it is the relevance cutoff.
+    docs = {doc_key(doc): doc for doc, _ in cut_dense(dense)}
+
+    with span("keyword_search", store=db_path):
+        keyword_index = get_keyword_index(db_path)
+        if keyword_weight and docs:
+            keyword_index.ensure_covered(db)
+        keyword_hits = keyword_index.search(query_text, k=fetch_k) if keyword_weight else []
+        keyword_ids = [chunk_id for chunk_id, _ in keyword_hits]
+        if where and keyword_ids:
+            # The keyword index has no metadata: keep the hits the filter allows.
+            allowed = set(db.get(ids=keyword_ids, where=where, include=[])["ids"])
+            keyword_ids = [chunk_id for chunk_id in keyword_ids if chunk_id in allowed]
+
+    fused = reciprocal_rank_fusion(
+        [list(docs), keyword_ids],
+        [dense_weight, keyword_weight],
+        rrf_k,
+    )[:k]
+
+    # Keyword-only hits are loaded from the store by ID.
+    missing = [key for key, _ in fused if key not in docs]
+    if missing:
+        items = db.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(items["ids"], items["documents"], items["metadatas"]):
+            docs[chunk_id] = Document(page_content=text, metadata=metadata or {})
+
+    results = []
+    seen_texts = set()
+    for key, score in fused:
+        doc = docs.get(key)
+        if doc is None or doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+        results.append((doc, score))
+    return results
+
+
+def multi_store_search(stores, query_text, query_vector=None, k=RETRIEVAL_K, fetch_k=FETCH_K, rrf_k=RRF_K,
+                       where=None):
+    # stores: [(db, db_path)], e.g. a session collection and the main corpus.
+    # Each store is searched with hybrid_search and the per-store rankings are
+    # fused again, so one query spans all of them.
+    if len(stores) == 1:
+        db, db_path = stores[0]
+        return hybrid_search(db, db_path, query_text, query_vector, k=k, fetch_k=fetch_k, rrf_k=rrf_k, where=where)
+
+    rankings = []
+    docs = {}
+    for db, db_path in stores:
+        ranking = []
+        for doc, _ in hybrid_search(db, db_path, query_text, query_vector, k=k, fetch_k=fetch_k, rrf_k=rrf_k,
+                                    where=where):
+            key = (db_path, doc_key(doc))
+            docs[key] = doc
+            ranking.append(key)
+        rankings.append(ranking)
+
+    results = []
+    seen_texts = set()
+    for key, score in reciprocal_rank_fusion(rankings, rrf_k=rrf_k):
+        doc = docs[key]
+        if doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+        results.append((doc, score))
+    return results[:k]
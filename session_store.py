@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+
+SESSION_STORE_PATH = "chroma_sessions"
+SESSIONS_FILE = "sessions.json"
+SESSION_IDLE_TTL_SECONDS = 2 * 3600
+MAX_SESSION_BYTES = 512 * 1024 * 1024
+SWEEP_INTERVAL_SECONDS = 300
+# One 1024-float embedding, an 800-character chunk and its metadata.
+BYTES_PER_CHUNK = 1024 * 4 + 800 + 200
+
+STORE_REF_SEPARATOR = "#"
+COLLECTION_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+# ------------ Store references ---------------
+# A store is addressed by its directory ("chroma") or, for one collection of
+# a shared store, by "directory#collection". Every cache keyed by db_path
+# (vector stores, keyword index, collection version, answers) accepts both.
+
+def store_ref(path, collection=None):
+    return f"{path}{STORE_REF_SEPARATOR}{collection}" if collection else path
+
+
+def split_store_ref(ref):
+    path, _, collection = ref.partition(STORE_REF_SEPARATOR)
+    if collection and not COLLECTION_PATTERN.match(collection):
+        raise ValueError(f"Invalid collection name: {collection}")
+    return path, collection or None
+
+
+# ------------ Session collections ---------------
+
+class SessionStores:
+    # PDFs uploaded in the chatbot go to one collection per session inside a
+    # single persistent Chroma store, instead of one directory per upload.
+    # Collections idle for longer than `idle_ttl` are dropped by a background
+    # sweeper, and the least recently used ones go first when the estimated
+    # size of all sessions exceeds `max_bytes`.
+
+    def __init__(self, path=SESSION_STORE_PATH, idle_ttl=SESSION_IDLE_TTL_SECONDS,
+                 max_bytes=MAX_SESSION_BYTES, sweep_interval=SWEEP_INTERVAL_SECONDS):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        self._sessions = self._load()
+        self._stopped = threading.Event()
+        self._sweeper = None
+
+    def _sessions_path(self):
+        return os.path.join(self.path, SESSIONS_FILE)
+
+    def _load(self):
+        try:
+            with open(self._sessions_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        tmp_path = self._sessions_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._sessions, f)
+        os.replace(tmp_path, self._sessions_path())
+
+    def create(self):
+        collection = "session_" + uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._sessions[collection] = {"created": now, "last_used": now, "chunks": 0}
+            self._save()
+        return store_ref(self.path, collection)
+
+    def is_live(self, ref):
+        # False once the session has been dropped (expired, evicted or reset):
+        # opening its ref would silently create an empty, untracked collection.
+        directory, collection = split_store_ref(ref)
+        with self._lock:
+            return directory == self.path and collection in self._sessions
+
+    def touch(self, ref, chunks=None):
+        # Returns False if the session no longer exists.
+        _, collection = split_store_ref(ref)
+        with self._lock:
+            session = self._sessions.get(collection)
+            if session is None:
+                return False
+            session["last_used"] = time.time()
+            if chunks is not None:
+                session["chunks"] = chunks
+            self._save()
+            return True
+
+    def refresh_size(self, ref):
+        # Called once an upload has been written.
+        from resources import vector_store
+
+        with vector_store(ref) as db:
+            self.touch(ref, chunks=db._collection.count())
+
+    def drop(self, ref):
+        # Returns False, and keeps the session for the next sweep, while its
+        # store is in use (a query or an upload holds a reference on it).
+        from answer_cache import remove_collection_version
+        from keyword_index import delete_keyword_index
+        from parent_store import delete_parent_store
+        from resources import close_vector_store, evict_vector_store, open_vector_store
+
+        _, collection = split_store_ref(ref)
+        if not evict_vector_store(ref, force=False):
+            return False
+        with self._lock:
+            self._sessions.pop(collection, None)
+            self._save()
+        try:
+            db = open_vector_store(ref)
+            db.delete_collection()
+            close_vector_store(db)
+        except Exception as e:
+            print(f"⚠️ Could not delete collection {collection}: {e}")
+        delete_keyword_index(ref)
+        delete_parent_store(ref)
+        remove_collection_version(ref)
+        return True
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(session["chunks"] for session in self._sessions.values()) * BYTES_PER_CHUNK
+
+    def sweep(self):
+        # Returns the refs of the dropped sessions.
+        now = time.time()
+        with self._lock:
+            by_age = sorted(self._sessions.items(), key=lambda item: item[1]["last_used"])
+            expired = [name for name, session in by_age if now - session["last_used"] > self.idle_ttl]
+            size = sum(session["chunks"] for name, session in by_age if name not in expired) * BYTES_PER_CHUNK
+            for name, session in by_age:
+                if size <= self.max_bytes:
+                    break
+                if name not in expired:
+                    expired.append(name)
+                    size -= session["chunks"] * BYTES_PER_CHUNK
+
+        return [ref for ref in (store_ref(self.path, name) for name in expired) if self.drop(ref)]
+
+    def start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Session sweep failed: {e}")
+            self._stopped.wait(self.sweep_interval)
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+        return {"sessions": sessions, "bytes": self.total_bytes(), "max_bytes": self.max_bytes}
+
+    def close(self):
+        self._stopped.set()
+
+
+_session_stores = None
+_session_stores_lock = threading.Lock()
+
+
+def get_session_stores():
+    global _session_stores
+    with _session_stores_lock:
+        if _session_stores is None:
+            _session_stores = SessionStores()
+            _session_stores.start_sweeper()
+        return _session_stores
@@ -0,0 +1,62 @@
+import time
+
+
+class StreamMetrics:
+    # Time to first token and generation speed of one streamed answer.
+    # Ollama streams roughly one token per chunk, so chunks are counted as tokens.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.end = None
+        self.tokens = 0
+        self.context_report = None
+        self.trace = None
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def total_time(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def tokens_per_second(self):
+        if self.first_token_at is None or self.tokens < 2:
+            return 0.0
+        generation = (self.end or time.perf_counter()) - self.first_token_at
+        return (self.tokens - 1) / generation if generation > 0 else 0.0
+
+    def summary(self):
+        ttft = self.time_to_first_token
+        ttft_text = f"{ttft:.1f}s" if ttft is not None else "-"
+        summary = (f"⏱️ 1er token : {ttft_text} · {self.tokens_per_second:.1f} tokens/s · "
+                   f"total : {self.total_time:.1f}s")
+        if self.context_report:
+            summary += (f" · contexte : {self.context_report['context_tokens']} tokens "
+                        f"({self.context_report['tokens_saved']} économisés)")
+        return summary
+
+
+def chunk_text(chunk):
+    # LLMs stream str, chat models stream message chunks.
+    return chunk if isinstance(chunk, str) else getattr(chunk, "content", str(chunk))
+
+
+def stream_with_metrics(chunks, metrics=None):
+    try:
+        for chunk in chunks:
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            if metrics is not None:
+                if metrics.first_token_at is None:
+                    metrics.first_token_at = time.perf_counter()
+                metrics.tokens += 1
+            yield text
+    finally:
+        if metrics is not None:
+            metrics.end = time.perf_counter()
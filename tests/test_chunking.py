@@ -0,0 +1,52 @@
+from langchain_core.documents import Document
+
+import chunking
+from chunking import CHUNKING_PROFILES, iter_child_chunks, take_parents
+
+
+def page(number, sentences):
+    text = " ".join(f"Sentence {number}.{i} about welding, solar panels and patents." for i in range(sentences))
+    return Document(page_content=text, metadata={"source": "data/doc.pdf", "page": number})
+
+
+def test_parent_profile_is_small_to_big():
+    flat, parent = CHUNKING_PROFILES["flat"], CHUNKING_PROFILES["parent"]
+    assert parent["chunk_size"] < flat["chunk_size"] < parent["parent_max_chars"]
+    assert chunking.CHUNKING_PROFILE in CHUNKING_PROFILES
+
+
+def test_children_expand_to_their_page_section(monkeypatch):
+    monkeypatch.setattr(chunking, "CHUNKING_PROFILE", "parent")
+    parents = {}
+    pages = [page(0, 3), page(1, 20), page(2, 80)]
+    children = list(iter_child_chunks(pages, parents))
+    profile = CHUNKING_PROFILES["parent"]
+
+    # A short page fits in one child and needs no parent.
+    short = [child for child in children if child.metadata["page"] == 0]
+    assert len(short) == 1 and "parent_id" not in short[0].metadata
+
+    for child in children:
+        assert len(child.page_content) <= profile["chunk_size"]
+        if "parent_id" in child.metadata:
+            section = parents[child.metadata["parent_id"]].page_content
+            assert child.page_content in section
+            assert len(section) <= profile["parent_max_chars"]
+
+    # A long page is cut into several parent sections.
+    long_parents = {child.metadata["parent_id"] for child in children if child.metadata["page"] == 2}
+    assert len(long_parents) > 1
+    assert len({child.metadata["id"] for child in children}) == len(children)
+
+    taken = take_parents(parents, children[:2])
+    assert [parent.metadata["id"] for parent in taken] == [children[1].metadata["parent_id"]]
+    assert children[1].metadata["parent_id"] not in parents
+
+
+def test_flat_profile_has_no_parents(monkeypatch):
+    monkeypatch.setattr(chunking, "CHUNKING_PROFILE", "flat")
+    parents = {}
+    children = list(iter_child_chunks([page(1, 40)], parents))
+    assert not parents
+    assert all("parent_id" not in child.metadata for child in children)
+    assert max(len(child.page_content) for child in children) > CHUNKING_PROFILES["parent"]["chunk_size"]
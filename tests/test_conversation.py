@@ -0,0 +1,54 @@
+import pytest
+
+from conversation import condense_question, is_follow_up, recent_turns
+
+FOLLOW_UPS = [
+    "Et ceux de LG ?",
+    "What about its claims?",
+    "Quelle est sa date ?",
+    "Résume le premier",
+    "And Toyota?",
+    "Et pour Samsung ?",
+    "Quels sont ses avantages ?",
+    "What is the filing date of its first patent?",
+    "Quelle est la date de sa publication ?",
+    "Summarize the second one.",
+    "Who filed the last one?",
+    "Détaille la dernière.",
+    "Qu’en est-il en Europe ?",
+    "Qui a déposé celui-ci ?",
+    "Is it still valid?",
+    "Quand ont-ils été publiés ?",
+]
+
+STANDALONE = [
+    "Qu'est-ce que le soudage ?",
+    "Il y a combien de planètes ?",
+    "What is a solar panel?",
+    "How does this technology improve its efficiency?",
+    "Comment fonctionne un panneau solaire et quel est son rendement ?",
+    "Who was the first person to patent a solar cell?",
+    "Quel est le premier brevet de Tesla sur les batteries ?",
+    "Which companies filed the most patents on welding in 2020?",
+    "What are the benefits of renewable energies?",
+    "Quelles entreprises et quelles universités déposent des brevets sur l'impression 3D ?",
+]
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_follow_ups_are_detected(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", STANDALONE)
+def test_standalone_questions_are_kept(question):
+    assert not is_follow_up(question)
+
+
+def test_condense_prepends_previous_question():
+    turns = recent_turns([("user", "Brevets de Samsung sur les écrans OLED"), ("bot", "Voici les brevets…"),
+                          ("user", "Échec"), ("bot", "❌ Erreur")])
+    assert turns == [("Brevets de Samsung sur les écrans OLED", "Voici les brevets…")]
+    assert condense_question("Et ceux de LG ?", turns) == "Brevets de Samsung sur les écrans OLED Et ceux de LG ?"
+    assert condense_question("What is a solar panel?", turns) == "What is a solar panel?"
+    assert condense_question("Et ceux de LG ?", []) == "Et ceux de LG ?"
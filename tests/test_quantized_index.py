@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+import quantized_index
+from quantized_index import QuantizedIndex, QuantizedStore, normalize_rows, where_sql
+
+DIM = 16
+
+
+class RandomEmbeddings:
+    # Deterministic random vector per text.
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = sum(ord(c) * (i + 1) for i, c in enumerate(text))
+        return np.random.default_rng(seed).standard_normal(DIM).tolist()
+
+
+def make_store(path, count=40, **kwargs):
+    store = QuantizedStore(str(path), RandomEmbeddings(), **kwargs)
+    store.add_documents([Document(page_content=f"chunk {i}",
+                                  metadata={"id": f"c{i}", "source": f"doc{i % 4}.pdf", "page": i})
+                         for i in range(count)])
+    return store
+
+
+def search_ids(store, text, k=5, filter=None):
+    return [doc.id for doc, _ in store.similarity_search_with_score(text, k=k, filter=filter)]
+
+
+def test_where_sql_operators():
+    assert where_sql(None) == ("1", [])
+    sql, params = where_sql({"source": "a.pdf", "page": {"$gte": 2, "$lt": 5}})
+    assert sql == ("json_extract(metadata, '$.source') = ? AND json_extract(metadata, '$.page') >= ? "
+                   "AND json_extract(metadata, '$.page') < ?")
+    assert params == ["a.pdf", 2, 5]
+    sql, params = where_sql({"$or": [{"source": {"$in": ["a", "b"]}}, {"doc_type": {"$ne": "patent"}}]})
+    assert sql == ("(json_extract(metadata, '$.source') IN (?,?) OR "
+                   "json_extract(metadata, '$.doc_type') != ?)")
+    assert params == ["a", "b", "patent"]
+    assert where_sql({"source": {"$nin": []}})[0] == "json_extract(metadata, '$.source') NOT IN (NULL)"
+    with pytest.raises(ValueError):
+        where_sql({"source": {"$like": "a%"}})
+
+
+def test_filtered_search(tmp_path):
+    store = make_store(tmp_path)
+    for doc, _ in store.similarity_search_with_score("chunk 3", k=10, filter={"source": "doc1.pdf"}):
+        assert doc.metadata["source"] == "doc1.pdf"
+    assert search_ids(store, "chunk 3", k=1) == ["c3"]
+
+
+def test_deleted_rows_are_not_returned(tmp_path):
+    store = make_store(tmp_path)
+    store.delete(["c3"])
+    assert "c3" not in search_ids(store, "chunk 3", k=40)
+    assert store.count() == 39
+    assert store.deleted_rows() == 1
+
+    # Replacing a chunk leaves the old vector deleted too.
+    store.add_documents([Document(page_content="chunk 5 bis", metadata={"id": "c5"})])
+    assert store.count() == 39
+    assert store.deleted_rows() == 2
+    assert store.get(ids=["c5"])["documents"] == ["chunk 5 bis"]
+
+
+def test_compaction_keeps_results(tmp_path):
+    store = make_store(tmp_path)
+    store.delete([f"c{i}" for i in range(0, 40, 3)])
+    before = {text: search_ids(store, text) for text in ("chunk 4", "chunk 11", "query")}
+    assert store.compact() == 14
+    assert len(store.index) == store.count() == 26
+    assert store.deleted_rows() == 0
+    assert {text: search_ids(store, text) for text in before} == before
+    assert search_ids(store, "chunk 4", k=1) == ["c4"]
+
+    # Appending after a compaction uses the renumbered rows.
+    store.add_documents([Document(page_content="chunk 100", metadata={"id": "c100"})])
+    assert search_ids(store, "chunk 100", k=1) == ["c100"]
+
+
+def test_automatic_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(quantized_index, "COMPACT_MIN_DELETED_ROWS", 5)
+    store = make_store(tmp_path)
+    store.delete(["c0", "c1", "c2", "c3"])
+    assert len(store.index) == 40
+    store.delete([f"c{i}" for i in range(4, 10)])
+    assert len(store.index) == 30
+    assert search_ids(store, "chunk 12", k=1) == ["c12"]
+
+
+def test_delete_collection_truncates_vectors(tmp_path):
+    store = make_store(tmp_path)
+    store.delete_collection()
+    assert len(store.index) == 0
+    assert search_ids(store, "chunk 1") == []
+
+
+def test_documents_without_id_get_one(tmp_path):
+    store = make_store(tmp_path, count=0)
+    ids = store.add_documents([Document(page_content="a"), Document(page_content="b")])
+    assert len(set(ids)) == 2 and all(ids)
+    assert sorted(store.get()["documents"]) == ["a", "b"]
+
+
+def test_pq_codebook_retrained_as_index_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(quantized_index, "PQ_CENTROIDS", 8)
+    index = QuantizedIndex(str(tmp_path), quantization="pq", pq_subvectors=4)
+    rng = np.random.default_rng(0)
+    index.append(rng.standard_normal((10, DIM)))
+    assert index.trained_rows == 10
+    first_codebook = index.codebook.copy()
+
+    index.append(rng.standard_normal((29, DIM)))
+    assert index.trained_rows == 10
+    vectors = rng.standard_normal((1, DIM))
+    index.append(vectors)
+    assert index.trained_rows == 40
+    assert not np.array_equal(index.codebook, first_codebook)
+
+    # Every row was re-encoded with the new codebook.
+    floats = np.asarray(index._map("floats.bin", np.float32, DIM))
+    codes = np.asarray(index._map("codes.bin", np.uint8, 4))
+    assert np.array_equal(codes, index._encode(floats)[0])
+    assert index.search(vectors[0], 1)[0][0] == 39
+    assert np.allclose(floats[39], normalize_rows(vectors)[0])
@@ -0,0 +1,207 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+
+TRACE_PATH = os.path.join("cache", "traces.jsonl")
+MAX_TRACE_FILE_BYTES = 50 * 1024 * 1024
+SERVICE_NAME = "patentbot"
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    # Spans of one request (a question, an ingestion run). Spans opened with
+    # span() while the trace is current nest under the innermost open span of
+    # the same thread, or under the root span in other threads. Exported in
+    # the OpenTelemetry JSON span layout.
+
+    def __init__(self, name, **attributes):
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+        self._open = threading.local()
+        self.root = None
+        self.root = self.start_span(name, attributes)
+
+    def _stack(self):
+        if not hasattr(self._open, "stack"):
+            self._open.stack = []
+        return self._open.stack
+
+    def start_span(self, name, attributes=None, parent=None):
+        stack = self._stack()
+        if parent is None:
+            parent = stack[-1] if stack else self.root
+        span = {
+            "traceId": self.trace_id,
+            "spanId": secrets.token_hex(8),
+            "parentSpanId": parent["spanId"] if parent else "",
+            "name": name,
+            "startTimeUnixNano": time.time_ns(),
+            "endTimeUnixNano": None,
+            "attributes": dict(attributes or {}),
+        }
+        with self._lock:
+            self.spans.append(span)
+        stack.append(span)
+        return span
+
+    def end_span(self, span, **attributes):
+        span["endTimeUnixNano"] = time.time_ns()
+        span["attributes"].update(attributes)
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+
+    def add_span(self, name, start_ns, end_ns, **attributes):
+        # For stages measured from the outside, e.g. the time to first token.
+        stack = self._stack()
+        parent = stack[-1] if stack else self.root
+        span = {
+            "traceId": self.trace_id,
+            "spanId": secrets.token_hex(8),
+            "parentSpanId": parent["spanId"] if parent else "",
+            "name": name,
+            "startTimeUnixNano": start_ns,
+            "endTimeUnixNano": end_ns,
+            "attributes": attributes,
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def breakdown(self):
+        # [(indented stage name, milliseconds)] in start order.
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["startTimeUnixNano"])
+        depth = {"": -1}
+        rows = []
+        for span in spans:
+            depth[span["spanId"]] = depth.get(span["parentSpanId"], 0) + 1
+            end = span["endTimeUnixNano"] or time.time_ns()
+            rows.append(("  " * depth[span["spanId"]] + span["name"],
+                         (end - span["startTimeUnixNano"]) / 1e6))
+        return rows
+
+    @property
+    def duration_ms(self):
+        end = self.root["endTimeUnixNano"] or time.time_ns()
+        return (end - self.root["startTimeUnixNano"]) / 1e6
+
+
+class TraceExporter:
+    # Appends finished spans to a JSONL file, one span per line. The file is
+    # rotated to <path>.1 once it passes max_bytes.
+
+    def __init__(self, path=TRACE_PATH, max_bytes=MAX_TRACE_FILE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, trace):
+        with trace._lock:
+            spans = list(trace.spans)
+        lines = []
+        for span in spans:
+            record = dict(span, resource={"service.name": SERVICE_NAME})
+            if record["endTimeUnixNano"] is None:
+                record["endTimeUnixNano"] = time.time_ns()
+            lines.append(json.dumps(record))
+        with self._lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+
+
+exporter = TraceExporter()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name, **attributes):
+    # Makes a new trace current; it is exported when the block ends. Inside an
+    # existing trace, this only opens a child span.
+    parent = _current_trace.get()
+    if parent is not None:
+        with span(name, **attributes):
+            yield parent
+        return
+
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.root["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        trace.end_span(trace.root)
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A generator closed from another context.
+            _current_trace.set(None)
+        try:
+            exporter.export(trace)
+        except OSError as e:
+            print(f"⚠️ Could not export trace: {e}")
+
+
+@contextmanager
+def span(name, **attributes):
+    # No-op outside of a trace, so instrumented code runs the same everywhere.
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        trace.end_span(current)
+
+
+def traced_stream(chunks, name="generation"):
+    # Wraps a token stream in a "generation" span and records the time to the
+    # first token as its own span.
+    with span(name) as current:
+        start = time.time_ns()
+        first = True
+        count = 0
+        for chunk in chunks:
+            if first:
+                first = False
+                trace = _current_trace.get()
+                if trace is not None:
+                    trace.add_span("time_to_first_token", start, time.time_ns())
+            count += 1
+            yield chunk
+        if current is not None:
+            current["attributes"]["chunks"] = count
+
+
+def traced_iter(iterable, name):
+    # One span per item, covering the time spent producing it (e.g. parsing
+    # and splitting the next batch of a lazily read PDF).
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item